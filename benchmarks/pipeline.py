@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the invoice pipeline against mocked Toggl and Dinero APIs.
+
+All HTTP requests are served by requests-mock from synthetic data generated
+with a fixed random seed, so the benchmarks run fully offline and are
+reproducible.  For each benchmark, the wall-clock time, the peak memory
+allocated (as traced by tracemalloc) and the number of HTTP requests are
+reported.
+
+Usage::
+
+    python benchmarks/pipeline.py [--scale N] [--json] [BENCHMARK...]
+
+.. currentmodule:: benchmarks.pipeline
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests_mock
+from click.testing import CliRunner
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from toggl_dinero import cli  # noqa: E402
+from toggl_dinero.dinero import DineroAPI, DINERO_TOKEN_URL  # noqa: E402
+from toggl_dinero.toggl import TOGGL_REPORTS_URL  # noqa: E402
+
+TOGGL_API_URL = 'https://www.toggl.com/api/v8'
+DINERO_API_URL = 'https://api.dinero.dk/v1'
+ORGANIZATION_ID = 1234
+CLIENT_ID = 4242
+
+ENV = {
+    'TOGGL_API_TOKEN': 'token',
+    'TOGGL_WORKSPACE': 'Workspace',
+    'DINERO_CLIENT_ID': 'client',
+    'DINERO_CLIENT_SECRET': 'secret',
+    'DINERO_API_KEY': 'key',
+    'DINERO_ORGANIZATION': 'Organization',
+}
+
+
+def synthetic_summary_report(rng, projects, items):
+    """
+    Generate a summary report.
+
+    :param rng: random.Random instance.
+    :param projects: Number of projects.
+    :param items: Number of items (time entry descriptions) per project.
+    :return: Summary report data as dictionary.
+    """
+    data = []
+    total = 0
+    for p in range(projects):
+        project_items = []
+        for i in range(items):
+            ms = rng.randrange(60000, 8 * 3600000, 60000)
+            rate = rng.choice([800.0, 1000.0, 1200.0])
+            project_items.append({
+                'title': {'time_entry': f'Task {p}.{i}'},
+                'time': ms, 'cur': 'DKK', 'rate': rate,
+                'sum': rate * ms / 3600000})
+        time_ = sum(i['time'] for i in project_items)
+        amount = sum(i['sum'] for i in project_items)
+        total += time_
+        data.append({
+            'id': p, 'title': {'project': f'Project {p}'},
+            'time': time_, 'items': project_items,
+            'total_currencies': [{'currency': 'DKK', 'amount': amount}]})
+    return {'data': data, 'total_grand': total, 'total_billable': total}
+
+
+def synthetic_contacts(rng, count, linked):
+    """
+    Generate Dinero contacts.
+
+    :param rng: random.Random instance.
+    :param count: Number of contacts.
+    :param linked: Index of contact linked to CLIENT_ID.
+    :return: List of contacts.
+    """
+    contacts = []
+    for n in range(count):
+        extref = None
+        if n == linked:
+            extref = json.dumps({'toggl': CLIENT_ID})
+        elif rng.random() < 0.5:
+            extref = json.dumps({'toggl': 100000 + n})
+        contacts.append({'name': f'Contact {n}',
+                         'contactGuid': f'guid-{n:08d}',
+                         'ExternalReference': extref})
+    return contacts
+
+
+def synthetic_invoice(rng, lines):
+    """
+    Generate a Dinero draft invoice with an hours block.
+
+    :param rng: random.Random instance.
+    :param lines: Number of product lines in the hours block.
+    :return: Invoice data.
+    """
+    product_lines = [
+        {'Description': 'Other product', 'LineType': 'Product',
+         'Quantity': 1, 'BaseAmountValue': 100.0},
+        {'Description': 'Konsulent ydelser: 2020-01-01 - 2020-01-31',
+         'LineType': 'Text'},
+    ]
+    for n in range(lines):
+        product_lines.append({
+            'Description': f'Project: Task {n}', 'LineType': 'Product',
+            'Quantity': rng.randrange(1, 1000) / 100, 'Unit': 'hours',
+            'BaseAmountValue': 1000.0, 'AccountNumber': 1000})
+    product_lines.append({'Description': 'I alt: 42.0 timer',
+                          'LineType': 'Text'})
+    return {'Guid': 'invoice-guid', 'ProductLines': product_lines}
+
+
+def mock_services(mock, rng, scale):
+    """Register mocked Toggl and Dinero endpoints."""
+    report = synthetic_summary_report(rng, projects=100, items=100 * scale)
+    contacts = synthetic_contacts(rng, 1000 * scale, linked=500 * scale)
+    mock.get(f'{TOGGL_API_URL}/clients',
+             json=[{'id': CLIENT_ID, 'wid': 1, 'name': 'Client'}])
+    mock.get(f'{TOGGL_API_URL}/workspaces',
+             json=[{'id': 1, 'name': 'Workspace'}])
+    mock.get(f'{TOGGL_REPORTS_URL}/v2/summary', json=report)
+    mock.get(f'{TOGGL_REPORTS_URL}/v2/summary.pdf', content=b'%PDF' * 1000)
+    mock_dinero(mock, contacts)
+    mock.post(f'{DINERO_API_URL}/{ORGANIZATION_ID}/invoices',
+              json={'Guid': 'invoice-guid'})
+
+
+def mock_dinero(mock, contacts, max_pagesize=1000):
+    """Register mocked Dinero login and contacts endpoints."""
+    def contacts_page(request, context):
+        page = int(request.qs.get('page', ['0'])[0])
+        pagesize = min(int(request.qs.get('pagesize', ['100'])[0]),
+                       max_pagesize)
+        collection = contacts[page*pagesize:(page+1)*pagesize]
+        return {'Collection': collection,
+                'Pagination': {'Result': len(collection),
+                               'PageSize': pagesize,
+                               'ResultWithoutFilter': len(contacts)}}
+    mock.post(DINERO_TOKEN_URL, json={'access_token': 'token',
+                                      'token_type': 'Bearer',
+                                      'expires_in': 3600})
+    mock.get(f'{DINERO_API_URL}/organizations',
+             json=[{'name': 'Organization', 'id': ORGANIZATION_ID}])
+    mock.get(f'{DINERO_API_URL}/{ORGANIZATION_ID}/contacts',
+             json=contacts_page)
+
+
+def bench_invoice(mock, rng, scale):
+    """End-to-end `invoice` command on a summary report with 10k+ items."""
+    mock_services(mock, rng, scale)
+    runner = CliRunner(env=ENV)
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            yield
+            result = runner.invoke(cli.cli, ['invoice', 'Client',
+                                             'last-month'])
+        finally:
+            os.chdir(cwd)
+    assert result.exit_code == 0, result.output
+
+
+def bench_contact_sweep(mock, rng, scale):
+    """Contact index sweep through 50k+ paginated Dinero contacts."""
+    contacts = synthetic_contacts(rng, 50000 * scale, linked=49999 * scale)
+    mock_dinero(mock, contacts)
+    dinero = DineroAPI('client', 'secret', 'key', 'Organization')
+    yield
+    contact = dinero.contact_with_external_reference('toggl', CLIENT_ID)
+    assert contact == contacts[49999 * scale]['contactGuid']
+
+
+def bench_update_product_lines(mock, rng, scale):
+    """update_product_lines() on a draft invoice with 5k+ lines."""
+    invoice = synthetic_invoice(rng, 5000 * scale)
+    new_lines = synthetic_invoice(rng, 5000 * scale)['ProductLines'][1:]
+    yield
+    for _ in range(10):
+        cli.update_product_lines(json.loads(json.dumps(invoice)), new_lines)
+
+
+BENCHMARKS = {
+    'invoice': bench_invoice,
+    'contact-sweep': bench_contact_sweep,
+    'update-product-lines': bench_update_product_lines,
+}
+
+
+def run(name, scale, seed=42):
+    """
+    Run a single benchmark.
+
+    Benchmarks are generator functions, doing setup until the first yield,
+    and the measured work after that.
+
+    :param name: Name of benchmark.
+    :param scale: Scale factor for the synthetic data.
+    :param seed: Random seed for the synthetic data.
+    :return: Dictionary with benchmark results.
+    """
+    rng = random.Random(seed)
+    with requests_mock.Mocker() as mock:
+        bench = BENCHMARKS[name](mock, rng, scale)
+        next(bench)
+        setup_requests = mock.call_count
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in bench:
+            pass
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            'benchmark': name,
+            'seconds': round(elapsed, 3),
+            'peak_mib': round(peak / (1024 * 1024), 1),
+            'requests': mock.call_count - setup_requests,
+        }
+
+
+def main():
+    """Run pipeline benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f'Benchmarks to run ({", ".join(BENCHMARKS)}).')
+    parser.add_argument('--scale', type=int, default=1,
+                        help='Scale factor for the synthetic data.')
+    parser.add_argument('--json', action='store_true',
+                        help='Output results as JSON.')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark: {name}')
+    results = [run(name, args.scale)
+               for name in args.benchmarks or BENCHMARKS]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"benchmark":<24} {"seconds":>9} {"peak MiB":>9} {"requests":>9}')
+    for r in results:
+        print(f'{r["benchmark"]:<24} {r["seconds"]:>9.3f} '
+              f'{r["peak_mib"]:>9.1f} {r["requests"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of toggl-dinero CLI startup (import) time.
+
+Each subcommand is run in a fresh interpreter with ``python -X importtime``,
+and the total import time, the time spent importing toggl-dinero itself, and
+any heavy dependencies imported are reported.
+
+Usage::
+
+    python benchmarks/startup.py [--repeat N] [--json]
+
+.. currentmodule:: benchmarks.startup
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+#: Subcommand argument lists to benchmark
+COMMANDS = [
+    ['version'],
+    ['--help'],
+    ['invoice', '--help'],
+    ['invoice-batch', '--help'],
+    ['link', '--help'],
+]
+
+#: Modules that should only be imported when actually needed
+HEAVY_MODULES = ['requests', 'togglwrapper', 'oauthlib', 'requests_oauthlib']
+
+SCRIPT = '''
+import sys
+from toggl_dinero.cli import cli
+try:
+    cli(sys.argv[1:], prog_name='toggl-dinero')
+except SystemExit:
+    pass
+'''
+
+
+def import_times(args):
+    """
+    Run CLI with given arguments, and parse import times.
+
+    :param args: CLI arguments.
+    :return: Dictionary mapping imported top-level package names to their
+             cumulative import time in microseconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT] + args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue  # header line
+        name = fields[2].strip()
+        times[name] = cumulative
+    return times
+
+
+def measure(args, repeat):
+    """Measure startup of CLI with given arguments."""
+    totals = []
+    own = []
+    for _ in range(repeat):
+        times = import_times(args)
+        totals.append(sum(t for n, t in times.items() if '.' not in n))
+        own.append(times.get('toggl_dinero.cli', 0))
+    return {
+        'command': ' '.join(args),
+        'total_ms': statistics.median(totals) / 1000,
+        'toggl_dinero_ms': statistics.median(own) / 1000,
+        'heavy_modules': [m for m in HEAVY_MODULES if m in times],
+    }
+
+
+def main():
+    """Run startup benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of runs per command (median is used).')
+    parser.add_argument('--json', action='store_true',
+                        help='Output results as JSON.')
+    args = parser.parse_args()
+    results = [measure(command, args.repeat) for command in COMMANDS]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"command":<24} {"total ms":>9} {"cli ms":>9}  heavy imports')
+    for r in results:
+        print(f'{r["command"]:<24} {r["total_ms"]:>9.1f} '
+              f'{r["toggl_dinero_ms"]:>9.1f}  '
+              f'{", ".join(r["heavy_modules"]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
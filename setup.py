@@ -55,6 +55,10 @@ setup(
         'oauthlib>=3.1.0',
         'requests-oauthlib>=1.3.0',
     ],
+    extras_require={
+        # asyncio API (toggl_dinero.aio)
+        'async': ['httpx>=0.18'],
+    },
     entry_points="""
     [console_scripts]
     toggl-dinero=toggl_dinero.cli:cli
@@ -0,0 +1,41 @@
+"""Shared fixtures for the toggl_dinero tests."""
+
+
+import json
+import pytest
+from toggl_dinero.dinero import DINERO_TOKEN_URL
+from test_toggl import CLIENTS, WORKSPACES, SUMMARY_REPORT_JSON
+from test_dinero import ORGANIZATIONS, CONTACTS_URL, contact_pages
+
+TOGGL_REPORTS_URL = 'https://api.track.toggl.com/reports/api/v2'
+
+
+@pytest.fixture(scope='function')
+def services(requests_mock, monkeypatch):
+    """Mock both Toggl and Dinero with a single linked client (Foo)."""
+    for var in ['TOGGL_API_TOKEN', 'TOGGL_WORKSPACE', 'TOGGL_USER_EMAIL',
+                'DINERO_CLIENT_ID', 'DINERO_CLIENT_SECRET',
+                'DINERO_API_KEY', 'DINERO_ORGANIZATION']:
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setenv('TOGGL_API_TOKEN', '__DUMMY_API_KEY__')
+    monkeypatch.setenv('DINERO_CLIENT_ID', 'client')
+    monkeypatch.setenv('DINERO_CLIENT_SECRET', 'secret')
+    monkeypatch.setenv('DINERO_API_KEY', 'key')
+    requests_mock.get('https://www.toggl.com/api/v8/clients', json=CLIENTS)
+    requests_mock.get('https://www.toggl.com/api/v8/workspaces',
+                      json=WORKSPACES)
+    requests_mock.get(f'{TOGGL_REPORTS_URL}/summary',
+                      json=SUMMARY_REPORT_JSON)
+    requests_mock.get(f'{TOGGL_REPORTS_URL}/summary.pdf', content=b'pdf')
+    requests_mock.post(DINERO_TOKEN_URL,
+                       json={'access_token': 'token',
+                             'token_type': 'Bearer',
+                             'expires_in': 3600})
+    requests_mock.get('https://api.dinero.dk/v1/organizations',
+                      json=ORGANIZATIONS)
+    contacts = [{'name': 'Foo A/S', 'contactGuid': 'guid-foo',
+                 'ExternalReference': json.dumps({'toggl': CLIENTS[0]['id']})}]
+    requests_mock.get(CONTACTS_URL, json=contact_pages(contacts, 100))
+    requests_mock.post('https://api.dinero.dk/v1/1234/invoices',
+                       json={'Guid': 'invoice-guid'})
+    return requests_mock
@@ -0,0 +1,110 @@
+"""Tests for toggl_dinero.aggregate module."""
+
+
+import pytest
+from toggl_dinero.aggregate import Aggregator, centihours
+from test_toggl import SUMMARY_REPORT_JSON, DETAILED_ENTRIES
+
+
+@pytest.mark.parametrize('ms,expected', [
+    (0, 0), (17999, 0), (18000, 1), (36000, 1), (53999, 1), (54000, 2),
+    (3600000, 100), (20520000, 570),
+])
+def test_centihours(ms, expected):
+    assert centihours(ms) == expected
+
+
+def test_summary_report():
+    aggregator = Aggregator()
+    aggregator.add_summary_report(SUMMARY_REPORT_JSON)
+    assert aggregator.currency == 'DKK'
+    assert aggregator.total_ms == SUMMARY_REPORT_JSON['total_grand']
+    assert aggregator.total_centihours == 570
+    assert [(line.description, line.centihours, line.rate)
+            for line in aggregator.lines()] == [
+        ('Things: Some stuff', 20, 1000.0),
+        ('Things: Other stuff', 540, 1000.0),
+        ('Nothing: Wasting time', 10, 2000.0),
+    ]
+
+
+def test_time_entries():
+    aggregator = Aggregator()
+    aggregator.add_time_entries(iter(DETAILED_ENTRIES))
+    expected = Aggregator()
+    expected.add_summary_report(SUMMARY_REPORT_JSON)
+    assert aggregator.lines() == expected.lines()
+    assert aggregator.total_ms == expected.total_ms
+
+
+def odd_entry(seconds, rate=1000.0, description='D'):
+    """Make time entry with billable amount rounded to cents, like Toggl."""
+    return {'project': 'P', 'description': description, 'cur': 'DKK',
+            'dur': seconds * 1000, 'billable': round(rate * seconds / 3600, 2)}
+
+
+#: Entries with durations that do not divide evenly into the rate.  Naively
+#: calculated from the rounded amounts, the rates are 999.74 and 1000.22.
+ODD_ENTRIES = [odd_entry(61), odd_entry(37), odd_entry(3967)]
+
+
+def test_time_entries_rounded_amounts():
+    aggregator = Aggregator()
+    aggregator.add_time_entries(ODD_ENTRIES)
+    assert aggregator.lines() == [('P: D', 113, 1000.0, 4065000)]
+
+
+@pytest.mark.parametrize('group_by', ['description', 'project', 'rate',
+                                      'user'])
+def test_time_entries_rounded_amounts_rates(group_by):
+    aggregator = Aggregator(group_by)
+    aggregator.add_time_entries(ODD_ENTRIES + [odd_entry(1111, 1250.5),
+                                               odd_entry(42, 1250.5)])
+    assert [line.rate for line in aggregator.lines()] == [1000.0, 1250.5]
+
+
+@pytest.mark.parametrize('group_by,expected', [
+    ('project', [('Things', 560, 1000.0), ('Nothing', 10, 2000.0)]),
+    ('rate', [('Things', 560, 1000.0), ('Nothing', 10, 2000.0)]),
+    ('user', [('Alice', 20, 1000.0), ('Bob', 540, 1000.0),
+              ('Alice', 10, 2000.0)]),
+])
+def test_group_by(group_by, expected):
+    aggregator = Aggregator(group_by)
+    for entry, user in zip(DETAILED_ENTRIES, ['Alice', 'Bob', 'Alice',
+                                              'Alice']):
+        aggregator.add_time_entries([dict(entry, user=user)])
+    assert [(line.description, line.centihours, line.rate)
+            for line in aggregator.lines()] == expected
+
+
+def test_group_by_rate_collapses_projects():
+    aggregator = Aggregator('rate')
+    aggregator.add(3600000, 1000.0, 'DKK', project='Foo')
+    aggregator.add(1800000, 1000.0, 'DKK', project='Bar')
+    aggregator.add(1800000, 1000.0, 'DKK', project='Foo')
+    assert aggregator.lines()[0][:3] == ('Foo, Bar', 200, 1000.0)
+
+
+def test_exact_total():
+    # 3 lines of 0.333 hours are rounded to 0.33 hours each.  Time is summed
+    # exactly, but the total hours is the sum of the rounded lines.
+    aggregator = Aggregator()
+    for n in range(3):
+        aggregator.add(1200000, 1000.0, 'DKK', project='P',
+                       description=f'{n}')
+    assert [line.centihours for line in aggregator.lines()] == [33, 33, 33]
+    assert aggregator.total_ms == 3600000
+    assert aggregator.total_centihours == 99
+
+
+def test_mixed_currencies():
+    aggregator = Aggregator()
+    aggregator.add(3600000, 1000.0, 'DKK', project='Foo')
+    with pytest.raises(ValueError):
+        aggregator.add(3600000, 100.0, 'EUR', project='Foo')
+
+
+def test_unsupported_grouping():
+    with pytest.raises(ValueError):
+        Aggregator('client')
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import pytest
+from test_toggl import CLIENTS, WORKSPACES, SUMMARY_REPORT_JSON
+from test_toggl import DETAILED_ENTRIES
+from test_dinero import ORGANIZATIONS
+
+httpx = pytest.importorskip('httpx')
+aio = pytest.importorskip('toggl_dinero.aio')
+
+CONTACTS = [{'name': f'Contact {n}', 'contactGuid': f'guid-{n}',
+             'ExternalReference': json.dumps({'toggl': n})}
+            for n in range(250)]
+
+
+class Services:
+    """Mocked Toggl and Dinero services for httpx.MockTransport."""
+
+    def __init__(self):
+        self.requests = []
+        self.fail = {}
+
+    def __call__(self, request):
+        self.requests.append(request)
+        url = request.url
+        path = url.path
+        failures = self.fail.get(path)
+        if failures:
+            self.fail[path] -= 1
+            return httpx.Response(429, headers={'Retry-After': '0'})
+        if url.host == 'authz.dinero.dk':
+            assert request.headers['Authorization'].startswith('Basic ')
+            # Like the blocking login, no scope is requested
+            assert b'scope' not in request.content
+            return httpx.Response(200, json={
+                'access_token': 'token', 'token_type': 'Bearer',
+                'expires_in': 3600})
+        if url.host == 'api.dinero.dk':
+            assert request.headers['Authorization'] == 'Bearer token'
+            if path == '/v1/organizations':
+                return httpx.Response(200, json=ORGANIZATIONS)
+            if path == '/v1/1234/contacts':
+                page = int(url.params['page'])
+                collection = CONTACTS[page*100:(page+1)*100]
+                return httpx.Response(200, json={
+                    'Collection': collection,
+                    'Pagination': {'Result': len(collection),
+                                   'PageSize': 100,
+                                   'ResultWithoutFilter': len(CONTACTS)}})
+            if path == '/v1/1234/invoices' and request.method == 'GET':
+                return httpx.Response(200, json={
+                    'Collection': [{'Guid': 'invoice-guid'}]})
+            if path == '/v1/1234/invoices/invoice-guid':
+                return httpx.Response(200, json={'Guid': 'invoice-guid'})
+            return httpx.Response(200, json={'Guid': 'invoice-guid'})
+        if path == '/api/v8/clients':
+            return httpx.Response(200, json=CLIENTS)
+        if path == '/api/v8/workspaces':
+            return httpx.Response(200, json=WORKSPACES)
+        if path == '/reports/api/v2/summary':
+            return httpx.Response(200, json=SUMMARY_REPORT_JSON)
+        if path == '/reports/api/v2/summary.pdf':
+            return httpx.Response(200, content=b'pdf')
+        if path == '/reports/api/v2/details':
+            page = int(url.params['page'])
+            return httpx.Response(200, json={
+                'total_count': len(DETAILED_ENTRIES), 'per_page': 3,
+                'data': DETAILED_ENTRIES[(page-1)*3:page*3]})
+        return httpx.Response(404)
+
+
+@pytest.fixture
+def services():
+    return Services()
+
+
+def run(services, coro):
+    async def main():
+        transport = httpx.MockTransport(services)
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await coro(client)
+    return asyncio.run(main())
+
+
+def test_toggl(services):
+    async def main(client):
+        toggl = aio.AsyncTogglAPI('token', client=client)
+        client_id, workspace_id = await asyncio.gather(
+            toggl.client_id('Foo'), toggl.workspace_id('Bar'))
+        params = {'workspace_id': workspace_id, 'client_ids': client_id}
+        report, pdf = await asyncio.gather(
+            toggl.summary_report(dict(params)),
+            toggl.summary_report_pdf(dict(params)))
+        entries = [e async for e in toggl.detailed_report(params)]
+        return client_id, workspace_id, report, pdf, entries
+    client_id, workspace_id, report, pdf, entries = run(services, main)
+    assert (client_id, workspace_id) == (1234, 5678)
+    assert report == SUMMARY_REPORT_JSON
+    assert pdf == b'pdf'
+    assert entries == DETAILED_ENTRIES
+    assert all(r.headers['Authorization'].startswith('Basic ')
+               for r in services.requests)
+
+
+def test_toggl_pdf_path(services, tmp_path):
+    services.fail['/reports/api/v2/summary.pdf'] = 1
+    path = str(tmp_path / 'report.pdf')
+
+    async def main(client):
+        toggl = aio.AsyncTogglAPI('token', client=client)
+        toggl.PDF_CHUNK_SIZE = 2
+        return await toggl.summary_report_pdf({'workspace_id': 42},
+                                              path=path)
+    assert run(services, main) == path
+    with open(path, 'rb') as f:
+        assert f.read() == b'pdf'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['report.pdf']
+    assert len(services.requests) == 2
+
+
+def test_toggl_retry(services):
+    services.fail['/reports/api/v2/summary'] = 2
+
+    async def main(client):
+        toggl = aio.AsyncTogglAPI('token', client=client)
+        return await toggl.summary_report({'workspace_id': 42})
+    assert run(services, main) == SUMMARY_REPORT_JSON
+    assert len(services.requests) == 3
+
+
+@pytest.mark.parametrize('method,error,requests', [
+    ('POST', httpx.ReadTimeout, 1),
+    ('POST', httpx.RemoteProtocolError, 1),
+    ('POST', httpx.ConnectError, 3),
+    ('GET', httpx.ReadTimeout, 3),
+])
+def test_retry_transport_error(monkeypatch, method, error, requests):
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        if len(sent) < 3:
+            raise error('failed', request=request)
+        return httpx.Response(200, json={})
+
+    async def sleep(seconds):
+        pass
+    monkeypatch.setattr(aio.asyncio, 'sleep', sleep)
+
+    async def main():
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            session = aio._AsyncSession(client)
+            return await session.request(method, 'https://example.com/')
+    if requests == 1:
+        with pytest.raises(error):
+            asyncio.run(main())
+    else:
+        assert asyncio.run(main()).status_code == 200
+    assert len(sent) == requests
+
+
+def test_dinero(services):
+    async def main(client):
+        async with aio.AsyncDineroAPI('client', 'secret', 'key', 'Foo',
+                                      client=client) as dinero:
+            contacts = await asyncio.gather(*[
+                dinero.contact_with_external_reference('toggl', n)
+                for n in (0, 150, 249, 250)])
+            linked = await dinero.update_contact('guid-249', {
+                'Name': 'Contact 249',
+                'ExternalReference': json.dumps({'toggl': 1000})})
+            assert linked is True
+            assert await dinero.contact_with_external_reference(
+                'toggl', 1000) == 'guid-249'
+            invoice = await dinero.get_draft_invoice(contacts[0])
+            updated = await dinero.update_invoice(invoice)
+            created = await dinero.create_invoice(contacts[1], [],
+                                                  language='da')
+            return dinero.organization, contacts, updated, created
+    organization, contacts, updated, created = run(services, main)
+    assert organization == 1234
+    assert updated is True
+    assert created == 'invoice-guid'
+    assert contacts == ['guid-0', 'guid-150', 'guid-249', None]
+    paths = [(r.method, r.url.path) for r in services.requests]
+    assert paths.count(('POST', '/dineroapi/oauth/token')) == 1
+    assert paths.count(('GET', '/v1/1234/contacts')) == 3
+    assert ('PUT', '/v1.2/1234/invoices/invoice-guid') in paths
+    created = [r for r in services.requests if r.method == 'POST' and
+               r.url.path == '/v1/1234/invoices']
+    assert json.loads(created[0].content) == {
+        'ContactGuid': 'guid-150', 'Language': 'da-DK', 'ProductLines': []}
+
+
+def test_dinero_pages_bounded(monkeypatch):
+    contacts = [{'contactGuid': f'guid-{n}'} for n in range(1000)]
+    active = []
+
+    async def handler(request):
+        if request.url.host == 'authz.dinero.dk':
+            return httpx.Response(200, json={
+                'access_token': 'token', 'token_type': 'Bearer',
+                'expires_in': 3600})
+        if request.url.path == '/v1/organizations':
+            return httpx.Response(200, json=ORGANIZATIONS)
+        page = int(request.url.params['page'])
+        active.append(page)
+        # Later pages arrive first
+        await asyncio.sleep(0.01 * (10 - page))
+        peak.append(len(active))
+        active.remove(page)
+        collection = contacts[page*100:(page+1)*100]
+        return httpx.Response(200, json={
+            'Collection': collection,
+            'Pagination': {'Result': len(collection), 'PageSize': 100,
+                           'ResultWithoutFilter': len(contacts)}})
+
+    async def main():
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            async with aio.AsyncDineroAPI('client', 'secret', 'key', 'Foo',
+                                          client=client) as dinero:
+                return [c['contactGuid'] async for c in
+                        dinero._iter_contacts(['contactGuid'])]
+
+    peak = []
+    monkeypatch.setattr(aio.AsyncDineroAPI, 'PAGE_JOBS', 3)
+    assert asyncio.run(main()) == [c['contactGuid'] for c in contacts]
+    assert max(peak) == 3
@@ -0,0 +1,53 @@
+"""Tests for toggl_dinero.cache module."""
+
+
+import os
+import time
+from toggl_dinero.cache import FileCache, cache_key
+
+
+def test_store_load(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.store('foo.json', {'foo': [1, 2]})
+    assert cache.load('foo.json') == {'foo': [1, 2]}
+
+
+def test_load_missing(tmp_path):
+    assert FileCache(str(tmp_path)).load('foo.json') is None
+
+
+def test_load_expired(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.store('foo.json', 42)
+    past = time.time() - 120
+    os.utime(cache.path('foo.json'), (past, past))
+    assert cache.load('foo.json', ttl=60) is None
+    assert cache.load('foo.json', ttl=300) == 42
+
+
+def test_refresh(tmp_path):
+    FileCache(str(tmp_path)).store('foo.json', 42)
+    cache = FileCache(str(tmp_path), refresh=True)
+    assert cache.load('foo.json') is None
+    cache.store('foo.json', 43)
+    assert cache.load('foo.json') == 43
+
+
+def test_private(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.store('secret.json', 'secret', private=True)
+    assert os.stat(cache.path('secret.json')).st_mode & 0o777 == 0o600
+
+
+def test_invalidate(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.store('foo.json', 42)
+    cache.invalidate('foo.json')
+    cache.invalidate('foo.json')
+    assert cache.load('foo.json') is None
+
+
+def test_cache_key():
+    assert cache_key('foo', 1) == cache_key('foo', 1)
+    assert cache_key('foo', 1) != cache_key('foo', 2)
+    assert 'foo' not in cache_key('foo')
@@ -0,0 +1,113 @@
+"""Tests for toggl_dinero.cassette module."""
+
+
+import json
+import os
+import pytest
+import requests
+import requests_mock
+from toggl_dinero.cassette import Cassette, SCRUBBED, _scrub_body
+from toggl_dinero.toggl import TogglAPI, TOGGL_REPORTS_URL
+
+TOKEN_URL = 'https://auth.example.com/token'
+API_URL = 'https://api.example.com'
+
+
+def recording_session(cassette):
+    session = requests.Session()
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('POST', TOKEN_URL,
+                         json={'access_token': 'secret-token',
+                               'token_type': 'Bearer'})
+    adapter.register_uri('GET', f'{API_URL}/items?a=1&b=2',
+                         [{'json': [1]}, {'json': [1, 2]}])
+    adapter.register_uri('GET', f'{API_URL}/report.pdf',
+                         content=b'\xff\xfe%PDF')
+    session.mount('https://', adapter)
+    cassette.install(session, 'test')
+    return session
+
+
+def exchange(session):
+    token = session.post(TOKEN_URL, data={'username': 'secret-user',
+                                          'password': 'secret-password'})
+    headers = {'Authorization': 'Bearer secret-token'}
+    items = [session.get(f'{API_URL}/items', params={'b': 2, 'a': 1},
+                         headers=headers).json() for _ in range(3)]
+    pdf = session.get(f'{API_URL}/report.pdf', headers=headers).content
+    return token.json()['token_type'], items, pdf
+
+
+def test_record_replay(tmp_path):
+    recorded = exchange(recording_session(Cassette(str(tmp_path), 'record')))
+    assert len(os.listdir(tmp_path)) == 5
+    session = requests.Session()
+    Cassette(str(tmp_path), 'replay').install(session)
+    assert exchange(session) == recorded
+    assert recorded[1] == [[1], [1, 2], [1, 2]]
+
+
+def test_replay_stream(tmp_path):
+    directory = str(tmp_path / 'cassette')
+    pdf = b'%PDF' * 100000
+
+    def toggl(mode):
+        api = TogglAPI('__DUMMY_API_KEY__')
+        if mode == 'record':
+            adapter = requests_mock.Adapter()
+            adapter.register_uri('GET', f'{TOGGL_REPORTS_URL}/v2/summary.pdf',
+                                 content=pdf)
+            api.session.mount('https://', adapter)
+        Cassette(directory, mode).install(api.session, 'toggl')
+        return api
+
+    path = str(tmp_path / 'recorded.pdf')
+    toggl('record').summary_report_pdf({'workspace_id': 42}, path=path)
+    api = toggl('replay')
+    path = str(tmp_path / 'replayed.pdf')
+    assert api.summary_report_pdf({'workspace_id': 42}, path=path) == path
+    with open(path, 'rb') as f:
+        assert f.read() == pdf
+    assert api.summary_report_pdf({'workspace_id': 42}) == pdf
+
+
+def test_record_scrubbed(tmp_path):
+    exchange(recording_session(Cassette(str(tmp_path), 'record')))
+    content = ''
+    for name in os.listdir(tmp_path):
+        with open(tmp_path / name) as f:
+            content += f.read()
+    assert 'secret' not in content
+    assert SCRUBBED in content
+
+
+@pytest.mark.parametrize('body', [
+    [{'id': 1, 'name': 'Foo', 'api_token': 'secret-token'}],
+    {'since': 2000, 'data': {'id': 1, 'api_token': 'secret-token',
+                             'workspaces': [{'api_token': 'secret-ws'}]}},
+])
+def test_scrub_nested(body):
+    scrubbed = json.loads(_scrub_body(json.dumps(body).encode('utf-8')))
+    assert 'secret' not in json.dumps(scrubbed)
+    if isinstance(body, list):
+        assert scrubbed == [{'id': 1, 'name': 'Foo', 'api_token': SCRUBBED}]
+    else:
+        assert scrubbed['data']['api_token'] == SCRUBBED
+        assert scrubbed['data']['workspaces'] == [{'api_token': SCRUBBED}]
+
+
+def test_scrub_unchanged():
+    body = b'[{"id": 1},  {"id": 2}]'
+    assert _scrub_body(body) == body.decode('utf-8')
+
+
+def test_replay_unknown(tmp_path):
+    session = requests.Session()
+    Cassette(str(tmp_path), 'replay').install(session)
+    with pytest.raises(requests.ConnectionError):
+        session.get(f'{API_URL}/unknown')
+
+
+def test_mode():
+    with pytest.raises(ValueError):
+        Cassette('foo', 'rewind')
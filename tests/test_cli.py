@@ -9,10 +9,24 @@ This is the test module for the project's command-line interface (CLI)
 module.
 """
 # fmt: off
+import json
+import os
+import subprocess
+import sys
+from datetime import date
 import toggl_dinero.cli as cli
 from toggl_dinero import __version__
 # fmt: on
 from click.testing import CliRunner, Result
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from urllib.parse import urlsplit
+import requests
+from toggl_dinero.aggregate import Aggregator
+from toggl_dinero.metrics import Metrics
+from test_dinero import CONTACTS_URL, contact_pages
+from test_toggl import (CLIENTS, DETAILED_ENTRIES, SUMMARY_REPORT_JSON,
+                        TOGGL_REPORTS_URL, detailed_pages)
 
 
 # To learn more about testing Click applications, visit the link below.
@@ -67,3 +81,626 @@ def test_link_help():
     assert 'Usage: toggl-dinero link' in result.output.strip(), \
         "Help message should contain the command and subcommand name."
     # fmt: on
+
+
+def test_invoice_batch_help():
+    """
+    Arrange/Act: Run the `invoice-batch --help` subcommand.
+    Assert:  The first line of output looks right.
+    """
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["invoice-batch", "--help"])
+    # fmt: off
+    assert 'Usage: toggl-dinero invoice-batch' in result.output.strip(), \
+        "Help message should contain the command and subcommand name."
+    # fmt: on
+
+
+def test_serve_help():
+    """
+    Arrange/Act: Run the `serve --help` subcommand.
+    Assert:  The first line of output looks right.
+    """
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["serve", "--help"])
+    # fmt: off
+    assert 'Usage: toggl-dinero serve' in result.output.strip(), \
+        "Help message should contain the command and subcommand name."
+    assert '--update' not in result.output
+    # fmt: on
+
+
+def test_invoice_batch(services):
+    """
+    Arrange: Mock Toggl and Dinero with one linked and one unlinked client.
+    Act: Run the `invoice-batch` subcommand.
+    Assert: Only the linked client is invoiced, and summary is printed.
+    """
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice-batch", "last-month", "--workspace", "Foo",
+            "--dinero-organization", "Foo"])
+    assert result.exit_code == 0, result.output
+    assert 'Foo: ok' in result.output
+    assert 'Bar' not in result.output
+    assert '1 succeeded, 0 failed' in result.output
+    invoices = [r for r in services.request_history
+                if r.method == 'POST' and r.url.endswith('/invoices')]
+    assert len(invoices) == 1
+    assert invoices[0].json()['ContactGuid'] == 'guid-foo'
+
+
+def test_invoice(services):
+    """
+    Arrange: Mock Toggl and Dinero with a linked client.
+    Act: Run the `invoice` subcommand.
+    Assert: An invoice with the report hours is created, and PDF is saved.
+    """
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "last-month", "--workspace", "Foo",
+            "--dinero-organization", "Foo"])
+        with open('Foo_report.pdf', 'rb') as f:
+            assert f.read() == b'pdf'
+    assert result.exit_code == 0, result.output
+    invoices = [r for r in services.request_history
+                if r.method == 'POST' and r.url.endswith('/invoices')]
+    assert len(invoices) == 1
+    body = invoices[0].json()
+    assert body['ContactGuid'] == 'guid-foo'
+    assert body['Currency'] == 'DKK'
+    assert [line.get('Quantity') for line in body['ProductLines']] == \
+        [None, 0.2, 5.4, 0.1, None]
+    assert body['ProductLines'][-1]['Description'] == 'I alt: 5.7 timer'
+
+
+def test_invoice_not_linked(services):
+    """
+    Arrange: Mock Toggl and Dinero with a linked client.
+    Act: Run the `invoice` subcommand for a client that is not linked.
+    Assert: An error is shown, and no invoice is created.
+    """
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Bar", "--workspace", "Bar",
+            "--dinero-organization", "Foo"])
+    assert 'Could not find linked Dinero contact' in result.output
+    assert not [r for r in services.request_history if r.method == 'POST'
+                and r.url.endswith('/invoices')]
+
+
+def test_lazy_imports():
+    """
+    Arrange/Act: Import the CLI module in a fresh interpreter.
+    Assert: The Toggl and Dinero API client dependencies are not imported.
+    """
+    script = ("import sys, toggl_dinero.cli; "
+              "print(' '.join(m for m in ['togglwrapper', 'requests', "
+              "'oauthlib', 'requests_oauthlib'] if m in sys.modules))")
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     universal_newlines=True)
+    assert output.strip() == '', "API clients should be imported lazily."
+
+
+def invoice_with_lines(hours_lines):
+    """Make draft invoice data with an hours block and an other line."""
+    product_lines = [{'Description': 'Other', 'LineType': 'Product',
+                      'Quantity': 1, 'BaseAmountValue': 10.0}]
+    for line in hours_lines:
+        # Add some fields set by Dinero
+        product_lines.append(dict(line, LineType=line.get('LineType',
+                                                          'Product'),
+                                  TotalAmount=42.0))
+    return {'Guid': 'invoice-guid', 'ProductLines': product_lines}
+
+
+HOURS_LINES = [
+    {'Description': 'Konsulent ydelser: 2020-01-01 - 2020-01-31',
+     'LineType': 'Text'},
+    {'Description': 'Foo: a', 'AccountNumber': 1000, 'Quantity': 1.5,
+     'Unit': 'hours', 'BaseAmountValue': 1000.0},
+    {'Description': 'Foo: b', 'AccountNumber': 1000, 'Quantity': 2.0,
+     'Unit': 'hours', 'BaseAmountValue': 1000.0},
+    {'Description': 'I alt: 3.5 timer', 'LineType': 'Text'},
+]
+
+
+def test_update_product_lines_unchanged():
+    """
+    Arrange: Make invoice with the same hours lines.
+    Act: Update invoice product lines.
+    Assert: Invoice is reported as unchanged, and is left untouched.
+    """
+    invoice = invoice_with_lines(HOURS_LINES)
+    expected = json.loads(json.dumps(invoice))
+    assert not cli.update_product_lines(invoice, HOURS_LINES)
+    assert invoice == expected
+
+
+def test_update_product_lines_changed():
+    """
+    Arrange: Make invoice with hours lines, and change one line.
+    Act: Update invoice product lines.
+    Assert: Only the changed lines are replaced.
+    """
+    invoice = invoice_with_lines(HOURS_LINES)
+    new_lines = json.loads(json.dumps(HOURS_LINES))
+    new_lines[2]['Quantity'] = 3.0
+    new_lines[3]['Description'] = 'I alt: 4.5 timer'
+    assert cli.update_product_lines(invoice, new_lines)
+    lines = invoice['ProductLines']
+    assert [line['Description'] for line in lines] == \
+        ['Other'] + [line['Description'] for line in new_lines]
+    assert [line.get('TotalAmount') for line in lines] == \
+        [None, 42.0, 42.0, None, None]
+
+
+def test_update_product_lines_no_header():
+    """
+    Arrange: Make invoice without hours lines.
+    Act: Update invoice product lines.
+    Assert: The hours lines are appended.
+    """
+    invoice = invoice_with_lines([])
+    assert cli.update_product_lines(invoice, HOURS_LINES)
+    assert invoice['ProductLines'][1:] == HOURS_LINES
+
+
+def test_make_invoice_lines_total():
+    """
+    Arrange: Aggregate 3 lines of 20 seconds, 1 minute in total.
+    Act: Make invoice lines.
+    Assert: The footer total is the sum of the rounded lines.
+    """
+    aggregator = Aggregator()
+    for n in range(3):
+        aggregator.add(20000, 1000.0, 'DKK', project='P', description=f'{n}')
+    lines = cli.make_invoice_lines(aggregator, date(2026, 1, 1),
+                                   date(2026, 1, 31))
+    assert [line.get('Quantity') for line in lines[1:-1]] == [0.01] * 3
+    assert lines[-1]['Description'] == 'I alt: 0.03 timer'
+
+
+def test_invoice_update_unchanged(services):
+    """
+    Arrange: Mock a draft invoice with the hours already up to date.
+    Act: Run the `invoice --update` subcommand.
+    Assert: The draft invoice is not updated.
+    """
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "last-month", "--workspace", "Foo",
+            "--dinero-organization", "Foo", "--language", "en"])
+    body = [r for r in services.request_history if r.method == 'POST'
+            and r.url.endswith('/invoices')][0].json()
+    invoice = invoice_with_lines(body['ProductLines'])
+    services.get('https://api.dinero.dk/v1/1234/invoices',
+                 json={'Collection': [{'Guid': 'invoice-guid'}]})
+    services.get('https://api.dinero.dk/v1/1234/invoices/invoice-guid',
+                 json=invoice)
+    services.put('https://api.dinero.dk/v1.2/1234/invoices/invoice-guid',
+                 json={})
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "last-month", "--workspace", "Foo",
+            "--dinero-organization", "Foo", "--language", "en", "--update"])
+    assert result.exit_code == 0, result.output
+    assert 'up to date' in result.output
+    assert not [r for r in services.request_history if r.method == 'PUT']
+
+
+def test_split_period():
+    since, until = date(2026, 1, 15), date(2026, 3, 10)
+    assert cli.split_period(since, until, 'month') == [
+        (date(2026, 1, 15), date(2026, 1, 31)),
+        (date(2026, 2, 1), date(2026, 2, 28)),
+        (date(2026, 3, 1), date(2026, 3, 10))]
+    assert cli.split_period(since, until, 'year') == [(since, until)]
+    weeks = cli.split_period(since, until, 'week')
+    assert weeks[0] == (date(2026, 1, 15), date(2026, 1, 18))
+    assert all(start.weekday() == 0 for start, _ in weeks[1:])
+    assert weeks[-1][1] == until
+
+
+def test_parse_month_or_date():
+    assert cli.parse_month_or_date('2024-02') == date(2024, 2, 1)
+    assert cli.parse_month_or_date('2024-02', end=True) == date(2024, 2, 29)
+    assert cli.parse_month_or_date('2024-02-10', end=True) == \
+        date(2024, 2, 10)
+
+
+def test_invoice_range(services):
+    """
+    Arrange: Mock Toggl detailed report with entries in January and March.
+    Act: Run the `invoice` subcommand for January through March.
+    Assert: The report is fetched once, and an invoice is created for each
+            month with time entries.
+    """
+    entries = [dict(e, start=start) for e, start in zip(DETAILED_ENTRIES, [
+        '2026-01-02T10:00:00+01:00', '2026-01-31T23:00:00+01:00',
+        '2026-03-01T08:00:00+01:00', '2026-03-31T08:00:00+01:00'])]
+    services.get(f'{TOGGL_REPORTS_URL}/v2/details',
+                 json=detailed_pages(entries, 50))
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "--from", "2026-01", "--to", "2026-03",
+            "--workspace", "Foo", "--dinero-organization", "Foo"])
+    assert result.exit_code == 0, result.output
+    details = [r for r in services.request_history
+               if r.url.split('?')[0].endswith('/details')]
+    assert len(details) == 1
+    assert details[0].qs['since'] == ['2026-01-01']
+    assert details[0].qs['until'] == ['2026-03-31']
+    invoices = [r.json() for r in services.request_history
+                if r.method == 'POST' and r.url.endswith('/invoices')]
+    assert [i['ProductLines'][0]['Description'] for i in invoices] == [
+        'Konsulent ydelser: 2026-01-01 - 2026-01-31',
+        'Konsulent ydelser: 2026-03-01 - 2026-03-31']
+    assert [i['ProductLines'][-1]['Description'] for i in invoices] == [
+        'I alt: 5.5 timer', 'I alt: 0.2 timer']
+    assert [i['Date'] for i in invoices] == ['2026-01-31', '2026-03-31']
+
+
+def test_invoice_range_years(services):
+    """
+    Arrange: Mock Toggl detailed report with entries in 2024 and 2026.
+    Act: Run the `invoice` subcommand per year for 2024 through 2026.
+    Assert: The report is fetched a year at a time, and an invoice is created
+            for each year with time entries.
+    """
+    entries = [dict(e, start=start) for e, start in zip(DETAILED_ENTRIES, [
+        '2024-03-02T10:00:00+01:00', '2024-12-31T23:00:00+01:00',
+        '2026-03-01T08:00:00+01:00', '2026-03-31T08:00:00+01:00'])]
+
+    def details(request, context):
+        since, until = request.qs['since'][0], request.qs['until'][0]
+        return detailed_pages([e for e in entries
+                               if since <= e['start'][:10] <= until],
+                              50)(request, context)
+    services.get(f'{TOGGL_REPORTS_URL}/v2/details', json=details)
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "--from", "2024-03", "--to", "2026-03",
+            "--per", "year", "--workspace", "Foo",
+            "--dinero-organization", "Foo"])
+        assert sorted(os.listdir()) == ['Foo_report_2024-03-01.pdf',
+                                        'Foo_report_2025-01-01.pdf',
+                                        'Foo_report_2026-01-01.pdf']
+    assert result.exit_code == 0, result.output
+    details = [r.qs for r in services.request_history
+               if r.url.split('?')[0].endswith('/details')]
+    assert sorted((q['since'][0], q['until'][0]) for q in details) == [
+        ('2024-03-01', '2024-12-31'), ('2025-01-01', '2025-12-31'),
+        ('2026-01-01', '2026-03-31')]
+    invoices = [r.json() for r in services.request_history
+                if r.method == 'POST' and r.url.endswith('/invoices')]
+    assert [i['ProductLines'][0]['Description'] for i in invoices] == [
+        'Konsulent ydelser: 2024-03-01 - 2024-12-31',
+        'Konsulent ydelser: 2026-01-01 - 2026-03-31']
+
+
+def test_invoice_range_update(services):
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, [
+        "invoice", "Foo", "--from", "2026-01", "--to", "2026-03", "--update"])
+    assert result.exit_code == 2
+    assert '--update' in result.output
+
+
+def test_invoice_range_period(services):
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, [
+        "invoice", "Foo", "last-month", "--from", "2026-01", "--to",
+        "2026-03"])
+    assert result.exit_code == 2
+    assert 'PERIOD' in result.output
+    assert not services.request_history
+
+
+def test_invoice_workspaces(services):
+    """
+    Arrange: Mock Toggl with client Foo in both workspaces.
+    Act: Run the `invoice` subcommand for all workspaces.
+    Assert: A single invoice is created with time from both workspaces.
+    """
+    services.get('https://www.toggl.com/api/v8/clients', json=CLIENTS + [
+        {'id': 4321, 'wid': 5678, 'name': 'Foo'}])
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "last-month", "--workspace", "all",
+            "--dinero-organization", "Foo"])
+        assert sorted(os.listdir()) == ['Foo_1234_report.pdf',
+                                        'Foo_5678_report.pdf']
+    assert result.exit_code == 0, result.output
+    reports = [r.qs for r in services.request_history
+               if r.url.split('?')[0].endswith('/summary')]
+    assert sorted((q['workspace_id'][0], q['client_ids'][0])
+                  for q in reports) == [('1234', '1234'), ('5678', '4321')]
+    invoices = [r.json() for r in services.request_history
+                if r.method == 'POST' and r.url.endswith('/invoices')]
+    assert len(invoices) == 1
+    assert invoices[0]['ProductLines'][-1]['Description'] == \
+        'I alt: 11.4 timer'
+
+
+def test_invoice_workspaces_mixed_currency(services):
+    report = json.loads(json.dumps(SUMMARY_REPORT_JSON))
+    for project in report['data']:
+        for item in project['items']:
+            item['cur'] = 'EUR'
+    services.get('https://www.toggl.com/api/v8/clients', json=CLIENTS + [
+        {'id': 4321, 'wid': 5678, 'name': 'Foo'}])
+    services.get(f'{TOGGL_REPORTS_URL}/v2/summary?workspace_id=5678',
+                 json=report)
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "last-month", "--workspace", "Foo",
+            "--workspace", "Bar", "--dinero-organization", "Foo"])
+    assert 'Mixed currencies' in result.output
+    assert not [r for r in services.request_history if r.method == 'POST'
+                and r.url.endswith('/invoices')]
+
+
+def test_invoice_metrics(services):
+    # requests_mock bypasses the transport adapters, so only check that the
+    # metrics file is written (see test_setup_session_metrics for the
+    # collection itself)
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "--metrics-file", "metrics.prom", "--metrics-format",
+            "prometheus", "invoice", "Foo", "last-month",
+            "--workspace", "Foo", "--dinero-organization", "Foo"])
+        with open('metrics.prom') as f:
+            metrics = f.read()
+    assert result.exit_code == 0, result.output
+    assert '# TYPE toggl_dinero_http_requests_total counter' in metrics
+
+
+class StubAdapter(BaseAdapter):
+    """Transport adapter answering requests with fixed responses by path."""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = responses
+
+    def send(self, request, **kwargs):
+        status, body = self.responses[urlsplit(request.url).path]
+        response = Response()
+        response.status_code = status
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+def test_setup_session_metrics():
+    """
+    Arrange: Set up a session with metrics, on top of a stub adapter.
+    Act: Send requests for different objects of the same endpoints.
+    Assert: Requests are counted per templated endpoint and status, with
+            response sizes, in both the JSON and the Prometheus metrics.
+    """
+    guid = '0b4f2f6e-7f3a-4c62-9a53-5d1e8e2f8a10'
+    invoice = b'{"Guid": "0b4f2f6e-7f3a-4c62-9a53-5d1e8e2f8a10"}'
+    info = cli.Info()
+    info.metrics = Metrics()
+    session = requests.Session()
+    session.mount('https://', StubAdapter({
+        '/v1/1234/contacts': (200, b'[]'),
+        f'/v1/1234/invoices/{guid}': (200, invoice),
+        f'/v1/5678/invoices/{guid}': (404, b'not found'),
+    }))
+    cli.setup_session(info, session, 'dinero')
+    for page in range(2):
+        session.get('https://api.dinero.dk/v1/1234/contacts',
+                    params={'page': page})
+    session.get(f'https://api.dinero.dk/v1/1234/invoices/{guid}')
+    session.get(f'https://api.dinero.dk/v1/5678/invoices/{guid}')
+    endpoints = info.metrics.to_dict()['endpoints']
+    assert [(e['api'], e['method'], e['endpoint'], e['count'], e['status'],
+             e['bytes']) for e in endpoints] == [
+        ('dinero', 'GET', '/v1/{id}/contacts', 2, {'200': 2}, 4),
+        ('dinero', 'GET', '/v1/{id}/invoices/{guid}', 2,
+         {'200': 1, '404': 1}, len(invoice) + len('not found'))]
+    lines = info.metrics.to_prometheus().splitlines()
+    contacts = 'api="dinero",method="GET",endpoint="/v1/{id}/contacts"'
+    invoices = ('api="dinero",method="GET",'
+                'endpoint="/v1/{id}/invoices/{guid}"')
+    for line in [
+            f'toggl_dinero_http_requests_total{{{contacts},status="200"}} 2',
+            f'toggl_dinero_http_requests_total{{{invoices},status="200"}} 1',
+            f'toggl_dinero_http_requests_total{{{invoices},status="404"}} 1',
+            f'toggl_dinero_http_response_bytes_total{{{contacts}}} 4',
+            f'toggl_dinero_http_response_bytes_total{{{invoices}}} '
+            f'{len(invoice) + len("not found")}',
+            'toggl_dinero_http_request_duration_seconds_count'
+            f'{{{invoices}}} 2']:
+        assert line in lines
+
+
+def test_invoice_rate_limit(services):
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "--toggl-rate", "1000", "--dinero-rate", "1000",
+            "invoice", "Foo", "last-month",
+            "--workspace", "Foo", "--dinero-organization", "Foo"])
+    assert result.exit_code == 0, result.output
+
+
+def test_invoice_batch_update(services):
+    """
+    Arrange: Mock a draft invoice for the linked client.
+    Act: Run the `invoice-batch --update` subcommand.
+    Assert: Draft invoices are listed once, and the draft is updated.
+    """
+    services.get('https://api.dinero.dk/v1/1234/invoices', json={
+        'Collection': [{'Guid': 'invoice-guid', 'ContactGuid': 'guid-foo'}],
+        'Pagination': {'Result': 1, 'PageSize': 1000}})
+    services.get('https://api.dinero.dk/v1/1234/invoices/invoice-guid',
+                 json=invoice_with_lines([]))
+    services.put('https://api.dinero.dk/v1.2/1234/invoices/invoice-guid',
+                 json={})
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice-batch", "last-month", "--workspace", "Foo",
+            "--dinero-organization", "Foo", "--update"])
+    assert result.exit_code == 0, result.output
+    lists = [r for r in services.request_history
+             if r.url.split('?')[0].endswith('/invoices')]
+    assert len(lists) == 1
+    assert 'queryfilter' not in lists[0].qs
+    assert len([r for r in services.request_history
+                if r.method == 'PUT']) == 1
+
+
+def test_invoice_incremental(services):
+    """
+    Arrange: Mock Toggl detailed report and time entry changes.
+    Act: Run the `invoice --incremental` subcommand twice.
+    Assert: The full report is only fetched the first time.
+    """
+    services.get(f'{TOGGL_REPORTS_URL}/v2/details',
+                 json=detailed_pages(DETAILED_ENTRIES, 50))
+    services.get('https://www.toggl.com/api/v8/me',
+                 json={'since': 2000, 'data': {}})
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        for _ in range(2):
+            result: Result = runner.invoke(cli.cli, [
+                "--cache-dir", "cache", "invoice", "Foo", "last-month",
+                "--workspace", "Foo", "--dinero-organization", "Foo",
+                "--incremental"])
+            assert result.exit_code == 0, result.output
+    details = [r for r in services.request_history
+               if r.url.split('?')[0].endswith('/details')]
+    assert len(details) == 1
+    invoices = [r.json() for r in services.request_history
+                if r.method == 'POST' and r.url.endswith('/invoices')]
+    assert len(invoices) == 2
+    assert invoices[0]['ProductLines'] == invoices[1]['ProductLines']
+
+
+def test_invoice_incremental_no_cache(services):
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, [
+        "invoice", "Foo", "--incremental"])
+    assert result.exit_code == 2
+    assert '--cache-dir' in result.output
+
+
+def test_invoice_ledger(services):
+    """
+    Arrange: Mock Toggl and Dinero with a linked client.
+    Act: Run the `invoice` subcommand with a ledger, and then `query`.
+    Assert: The report items and invoice lines are summarized locally.
+    """
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "--ledger", "ledger.db", "invoice", "Foo", "last-month",
+            "--workspace", "Foo", "--dinero-organization", "Foo"])
+        assert result.exit_code == 0, result.output
+        services.reset_mock()
+        result = runner.invoke(cli.cli, [
+            "--ledger", "ledger.db", "query", "--by", "project"])
+        assert result.exit_code == 0, result.output
+        assert result.output.splitlines() == [
+            'Nothing\t0.10 hours\t200.00 DKK',
+            'Things\t5.60 hours\t5600.00 DKK']
+        result = runner.invoke(cli.cli, [
+            "--ledger", "ledger.db", "query", "--invoiced"])
+        assert result.output == 'Foo\t5.70 hours\t5800.00 DKK\n'
+    assert not services.request_history
+
+
+def test_query_no_ledger():
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["query"])
+    assert result.exit_code == 2
+    assert '--ledger' in result.output
+
+
+def test_invoice_pdf_options(services):
+    services.get(f'{TOGGL_REPORTS_URL}/v2/details',
+                 json=detailed_pages([], 50))
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        result: Result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "--from", "2026-01", "--to", "2026-01",
+            "--workspace", "Foo", "--dinero-organization", "Foo",
+            "--detailed", "--pdf-dir", "reports",
+            "--pdf-name", "{client}-{since}.pdf"])
+        assert result.exit_code == 0, result.output
+        assert os.listdir('reports') == ['Foo-2026-01-01.pdf']
+        services.reset_mock()
+        result = runner.invoke(cli.cli, [
+            "invoice", "Foo", "last-month", "--workspace", "Foo",
+            "--dinero-organization", "Foo", "--no-pdf"])
+        assert result.exit_code == 0, result.output
+        assert os.listdir() == ['reports']
+    assert not [r for r in services.request_history
+                if r.url.split('?')[0].endswith('.pdf')]
+
+
+def test_invoice_pdf_name_invalid(services):
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, [
+        "invoice", "Foo", "--pdf-name", "{customer}.pdf"])
+    assert result.exit_code == 2
+    assert 'customer' in result.output
+
+
+def test_link_from_file(services):
+    """
+    Arrange: Mock Dinero with a linked and an unlinked contact.
+    Act: Run the `link --from-file` subcommand.
+    Assert: Only the unlinked contact is updated, and a summary is printed.
+    """
+    contacts = [
+        {'name': 'Foo A/S', 'contactGuid': 'guid-foo',
+         'ExternalReference': json.dumps({'toggl': CLIENTS[0]['id']})},
+        {'name': 'Bar ApS', 'contactGuid': 'guid-bar',
+         'ExternalReference': json.dumps({'other': 1})}]
+    services.get(CONTACTS_URL, json=contact_pages(contacts, 100))
+    services.get(f'{CONTACTS_URL}/guid-bar', json={
+        'Name': 'Bar ApS', 'ExternalReference': json.dumps({'other': 1})})
+    services.put(f'{CONTACTS_URL}/guid-bar', json={})
+    runner: CliRunner = CliRunner()
+    with runner.isolated_filesystem():
+        with open('mapping.csv', 'w') as f:
+            f.write('toggl_client,dinero_contact\nFoo,Foo A/S\nBar, Bar ApS\n'
+                    '\nBaz,Baz\n')
+        result: Result = runner.invoke(cli.cli, [
+            "link", "--from-file", "mapping.csv",
+            "--dinero-organization", "Foo"])
+    assert result.exit_code == 1, result.output
+    assert 'Toggl client not found: Baz' in result.output
+    assert '1 linked, 1 already linked, 1 failed' in result.output
+    puts = [r for r in services.request_history if r.method == 'PUT']
+    assert len(puts) == 1
+    assert json.loads(puts[0].json()['ExternalReference']) == {
+        'other': 1, 'toggl': CLIENTS[1]['id']}
+    contact_requests = [r for r in services.request_history
+                        if r.url.split('?')[0] == CONTACTS_URL]
+    assert len(contact_requests) == 1
+
+
+def test_link_usage(services):
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["link", "Foo"])
+    assert result.exit_code == 2
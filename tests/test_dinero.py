@@ -0,0 +1,257 @@
+"""Tests for toggl_dinero.dinero module."""
+
+
+import json
+import os
+import pytest
+from toggl_dinero.cache import FileCache
+from toggl_dinero.dinero import ContactIndex, DineroAPI, DINERO_TOKEN_URL
+
+ORGANIZATIONS = [
+    {'name': 'Foo', 'id': 1234},
+    {'name': 'Bar', 'id': 5678},
+]
+
+CONTACTS = [
+    {'name': 'Foo A/S', 'contactGuid': 'guid-foo',
+     'ExternalReference': json.dumps({'toggl': 1234})},
+    {'name': 'Bar ApS', 'contactGuid': 'guid-bar',
+     'ExternalReference': None},
+    {'name': 'Baz', 'contactGuid': 'guid-baz',
+     'ExternalReference': 'not json'},
+    {'name': 'Qux', 'contactGuid': 'guid-qux',
+     'ExternalReference': json.dumps({'toggl': 8901, 'other': 'x'})},
+]
+
+CONTACTS_URL = 'https://api.dinero.dk/v1/1234/contacts'
+
+
+def contact_pages(contacts, max_pagesize, total=True):
+    def callback(request, context):
+        page = int(request.qs.get('page', ['0'])[0])
+        pagesize = min(int(request.qs.get('pagesize', ['100'])[0]),
+                       max_pagesize)
+        collection = contacts[page*pagesize:(page+1)*pagesize]
+        pagination = {'Result': len(collection), 'PageSize': pagesize}
+        if total:
+            pagination['ResultWithoutFilter'] = len(contacts)
+        return {'Collection': collection, 'Pagination': pagination}
+    return callback
+
+
+@pytest.fixture(scope='function')
+def api(requests_mock):
+    requests_mock.post(DINERO_TOKEN_URL,
+                       json={'access_token': 'token',
+                             'token_type': 'Bearer',
+                             'expires_in': 3600})
+    requests_mock.get('https://api.dinero.dk/v1/organizations',
+                      json=ORGANIZATIONS)
+    requests_mock.get(CONTACTS_URL, json=contact_pages(CONTACTS, 3))
+    api = DineroAPI('client', 'secret', 'key', 'Foo')
+    api.mock = requests_mock
+    return api
+
+
+def test_init(api):
+    assert api.organization == 1234
+
+
+def test_init_unknown_organization(requests_mock):
+    requests_mock.post(DINERO_TOKEN_URL,
+                       json={'access_token': 'token',
+                             'token_type': 'Bearer'})
+    requests_mock.get('https://api.dinero.dk/v1/organizations',
+                      json=ORGANIZATIONS)
+    with pytest.raises(Exception):
+        DineroAPI('client', 'secret', 'key', 'unknown')
+
+
+@pytest.mark.parametrize('i', range(len(CONTACTS)))
+def test_contact_id(api, i):
+    assert api.contact_id(CONTACTS[i]['name']) == CONTACTS[i]['contactGuid']
+
+
+def test_contact_id_unknown(api):
+    assert api.contact_id('unknown') is None
+
+
+def test_contact_with_external_reference(api):
+    assert api.contact_with_external_reference('toggl', 8901) == 'guid-qux'
+    assert api.contact_with_external_reference('toggl', 42) is None
+
+
+def test_contacts_with_external_reference(api):
+    assert api.contacts_with_external_reference('toggl') == {
+        1234: 'guid-foo', 8901: 'guid-qux'}
+
+
+def test_contact_index_single_sweep(api):
+    api.contact_id('Foo A/S')
+    api.contact_with_external_reference('toggl', 1234)
+    api.contact_id('unknown')
+    assert api.mock.call_count == 2 + 2
+
+
+@pytest.mark.parametrize('count,total,requests', [
+    (0, True, 1), (5, True, 2), (6, True, 2), (7, True, 3),
+    (5, False, 2), (6, False, 3)])
+def test_iter_contacts(api, count, total, requests):
+    contacts = [{'name': f'Contact {n}', 'contactGuid': f'guid-{n}'}
+                for n in range(count)]
+    api.mock.get(CONTACTS_URL, json=contact_pages(contacts, 3, total))
+    assert list(api._iter_contacts('name,contactGuid')) == contacts
+    history = [r for r in api.mock.request_history if r.url.startswith(
+        CONTACTS_URL)]
+    assert len(history) == requests
+    assert sorted(int(r.qs['page'][0]) for r in history) == \
+        list(range(requests))
+    for r in history:
+        assert r.qs['fields'] == ['name,contactguid']
+        assert r.qs['pagesize'] == [str(api.PAGE_SIZE)]
+
+
+def test_contact_index_cached(api, tmp_path):
+    api.cache = FileCache(str(tmp_path))
+    assert api.contact_id('Qux') == 'guid-qux'
+    api._contact_index = None
+    api.mock.reset_mock()
+    assert api.contact_with_external_reference('toggl', 1234) == 'guid-foo'
+    assert api.mock.call_count == 0
+    api.contact_index(refresh=True)
+    assert api.mock.call_count == 2
+
+
+def test_update_contact_updates_index(api):
+    api.mock.put(f'{CONTACTS_URL}/guid-bar', json={})
+    assert api.contact_with_external_reference('toggl', 5678) is None
+    api.update_contact('guid-bar', {
+        'Name': 'Bar ApS',
+        'ExternalReference': json.dumps({'toggl': 5678})})
+    assert api.contact_with_external_reference('toggl', 5678) == 'guid-bar'
+    assert api.contact_id('Bar ApS') == 'guid-bar'
+
+
+def test_update_contact_store(api, tmp_path):
+    api.cache = FileCache(str(tmp_path))
+    api.mock.put(f'{CONTACTS_URL}/guid-bar', json={})
+    api.contact_index()
+    name = api._contact_index_cache_name()
+    data = {'Name': 'Bar ApS', 'ExternalReference': json.dumps({'toggl': 1})}
+
+    def cached_reference():
+        return {c['contactGuid']: c['ExternalReference']
+                for c in api.cache.load(name)}['guid-bar']
+    assert api.update_contact('guid-bar', data, store=False)
+    assert cached_reference() is None
+    api.store_contact_index()
+    assert cached_reference() == data['ExternalReference']
+
+
+def test_token_cached(api, tmp_path):
+    mock = api.mock
+    cache = FileCache(str(tmp_path))
+    DineroAPI('client', 'secret', 'key', 'Foo', cache=cache)
+    mock.reset_mock()
+    api = DineroAPI('client', 'secret', 'key', 'Foo', cache=cache)
+    assert api.organization == 1234
+    assert api.token['access_token'] == 'token'
+    assert mock.call_count == 0
+    token_files = [f for f in os.listdir(tmp_path) if 'token' in f]
+    assert len(token_files) == 1
+    assert os.stat(tmp_path / token_files[0]).st_mode & 0o777 == 0o600
+
+
+def test_token_cache_refresh(api, tmp_path):
+    mock = api.mock
+    cache = FileCache(str(tmp_path))
+    api = DineroAPI('client', 'secret', 'key', 'Foo', cache=cache)
+    cache.store(api._token_cache_name(),
+                dict(api.token, refresh_token='refresh', expires_at=0))
+    mock.post(DINERO_TOKEN_URL, json={'access_token': 'refreshed',
+                                      'refresh_token': 'refresh2',
+                                      'token_type': 'Bearer',
+                                      'expires_in': 3600})
+    mock.reset_mock()
+    api = DineroAPI('client', 'secret', 'key', 'Foo', cache=cache)
+    assert mock.call_count == 1
+    assert 'grant_type=refresh_token' in mock.last_request.text
+    assert api.token['access_token'] == 'refreshed'
+    assert cache.load(api._token_cache_name())['access_token'] == 'refreshed'
+
+
+def test_token_cache_expired(api, tmp_path):
+    mock = api.mock
+    cache = FileCache(str(tmp_path))
+    api = DineroAPI('client', 'secret', 'key', 'Foo', cache=cache)
+    cache.store(api._token_cache_name(), dict(api.token, expires_at=0))
+    mock.reset_mock()
+    DineroAPI('client', 'secret', 'key', 'Foo', cache=cache)
+    assert mock.call_count == 1
+    assert 'grant_type=password' in mock.last_request.text
+
+
+INVOICES_URL = 'https://api.dinero.dk/v1/1234/invoices'
+
+
+def test_draft_invoices(api, caplog):
+    api.mock.get(INVOICES_URL, json={
+        'Collection': [
+            {'Guid': 'inv-1', 'ContactGuid': 'guid-foo'},
+            {'Guid': 'inv-2', 'ContactGuid': 'guid-qux'},
+            {'Guid': 'inv-3', 'ContactGuid': 'guid-qux'}],
+        'Pagination': {'Result': 3, 'PageSize': 1000,
+                       'ResultWithoutFilter': 3}})
+    api.mock.get(f'{INVOICES_URL}/inv-1', json={'Guid': 'inv-1'})
+    drafts = api.draft_invoices()
+    assert [i['Guid'] for i in drafts['guid-foo']] == ['inv-1']
+    assert len(drafts['guid-qux']) == 2
+    assert 'Multiple draft invoices for contact guid-qux' in caplog.text
+    assert api.mock.last_request.qs['statusfilter'] == ['draft']
+    api.mock.reset_mock()
+    assert api.get_draft_invoice('guid-foo', drafts) == {'Guid': 'inv-1'}
+    assert api.get_draft_invoice('guid-qux', drafts) is None
+    assert api.get_draft_invoice('guid-bar', drafts) is None
+
+
+@pytest.mark.parametrize('with_filter', [True, False])
+def test_draft_invoices_pages(api, monkeypatch, with_filter):
+    drafts = [{'Guid': f'inv-{n}', 'ContactGuid': f'guid-{n}'}
+              for n in range(3)]
+
+    def callback(request, context):
+        page = int(request.qs['page'][0])
+        collection = drafts[page*2:(page+1)*2]
+        pagination = {'Result': len(collection), 'PageSize': 2,
+                      'ResultWithoutFilter': 100}
+        if with_filter:
+            pagination['ResultWithFilter'] = len(drafts)
+        return {'Collection': collection, 'Pagination': pagination}
+    api.mock.get(INVOICES_URL, json=callback)
+    api.mock.reset_mock()
+    monkeypatch.setattr(api, 'PAGE_SIZE', 2)
+    assert sorted(api.draft_invoices()) == ['guid-0', 'guid-1', 'guid-2']
+    # Pages are counted from the drafts, not from all invoices
+    assert api.mock.call_count == 2
+    assert api.mock.call_count == 1
+
+
+def test_contact_index_replace():
+    index = ContactIndex([
+        {'name': 'Foo', 'contactGuid': 'a',
+         'ExternalReference': json.dumps({'toggl': 1})},
+        {'name': 'Foo', 'contactGuid': 'b',
+         'ExternalReference': json.dumps({'toggl': 2, 'x': [1]})},
+    ])
+    assert index.names == {'Foo': 'a'}
+    assert index.linked('toggl') == {1: 'a', 2: 'b'}
+    index.add({'name': 'Bar', 'contactGuid': 'a',
+               'ExternalReference': json.dumps({'toggl': 2})})
+    assert index.names == {'Foo': 'b', 'Bar': 'a'}
+    assert index.linked('toggl') == {2: 'b'}
+    index.remove('b')
+    assert index.names == {'Bar': 'a'}
+    assert index.linked('toggl') == {2: 'a'}
+    index.remove('a')
+    assert (index.contacts, index.names, index.external_references) == \
+        ({}, {}, {})
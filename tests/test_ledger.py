@@ -0,0 +1,59 @@
+"""Tests for toggl_dinero.ledger module."""
+
+
+from datetime import date
+import pytest
+from toggl_dinero.ledger import Ledger
+
+ITEMS = [
+    {'ms': 3600000, 'rate': 1000.0, 'currency': 'DKK', 'project': 'Things',
+     'description': 'Some stuff', 'user': 'alice'},
+    {'ms': 1800000, 'rate': 1000.0, 'currency': 'DKK', 'project': 'Things',
+     'description': 'Other stuff', 'user': 'bob'},
+    {'ms': 7200000, 'rate': 500.0, 'currency': 'DKK', 'project': 'Nothing',
+     'description': 'Wasting time', 'user': 'alice'},
+]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.db'))
+    yield ledger
+    ledger.close()
+
+
+def test_summary(ledger):
+    ledger.record_items('Foo', date(2026, 1, 1), date(2026, 1, 31), ITEMS)
+    ledger.record_items('Bar', date(2026, 2, 1), date(2026, 2, 28), ITEMS[:1])
+    assert ledger.summary() == [('Bar', 'DKK', 1.0, 1000.0),
+                                ('Foo', 'DKK', 3.5, 2500.0)]
+    assert ledger.summary('project', client='Foo') == [
+        ('Nothing', 'DKK', 2.0, 1000.0), ('Things', 'DKK', 1.5, 1500.0)]
+    assert ledger.summary('user', since=date(2026, 2, 1)) == [
+        ('alice', 'DKK', 1.0, 1000.0)]
+    assert ledger.summary('period', until='2026-01-31') == [
+        ('2026-01-01 - 2026-01-31', 'DKK', 3.5, 2500.0)]
+
+
+def test_record_replaces(ledger):
+    ledger.record_items('Foo', date(2026, 1, 1), date(2026, 1, 31), ITEMS)
+    ledger.record_items('Foo', date(2026, 1, 1), date(2026, 1, 31), ITEMS[:1])
+    assert ledger.summary() == [('Foo', 'DKK', 1.0, 1000.0)]
+
+
+def test_invoice_lines(ledger, tmp_path):
+    lines = [{'Description': 'Header', 'LineType': 'Text'},
+             {'Description': 'Things: Some stuff', 'Quantity': 1.5,
+              'Unit': 'hours', 'BaseAmountValue': 1000.0},
+             {'Description': 'Footer', 'LineType': 'Text'}]
+    ledger.record_invoice_lines('Foo', date(2026, 1, 1), date(2026, 1, 31),
+                                lines, contact='guid-foo',
+                                invoice='invoice-guid', currency='DKK')
+    assert ledger.summary(invoiced=True) == [('Foo', 'DKK', 1.5, 1500.0)]
+    with pytest.raises(ValueError):
+        ledger.summary('user', invoiced=True)
+    # Data is persisted
+    ledger.close()
+    ledger = Ledger(str(tmp_path / 'ledger.db'))
+    assert ledger.summary('period', invoiced=True) == [
+        ('2026-01-01 - 2026-01-31', 'DKK', 1.5, 1500.0)]
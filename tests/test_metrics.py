@@ -0,0 +1,70 @@
+"""Tests for toggl_dinero.metrics module."""
+
+
+import json
+import pytest
+import requests
+import requests_mock
+from toggl_dinero.metrics import Metrics, endpoint_template
+
+API_URL = 'https://api.example.com'
+GUID = '0b4f2f6e-7f3a-4c62-9a53-5d1e8e2f8a10'
+
+
+@pytest.mark.parametrize('url,template', [
+    (f'{API_URL}/v1/1234/contacts?page=2', '/v1/{id}/contacts'),
+    (f'{API_URL}/v1/1234/invoices/{GUID}', '/v1/{id}/invoices/{guid}'),
+    (f'{API_URL}/reports/api/v2/summary.pdf', '/reports/api/v2/summary.pdf'),
+])
+def test_endpoint_template(url, template):
+    assert endpoint_template(url) == template
+
+
+def metrics_session(metrics):
+    session = requests.Session()
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', f'{API_URL}/v1/1234/invoices/{GUID}',
+                         json={'Guid': GUID})
+    adapter.register_uri('GET', f'{API_URL}/v1/5678/invoices/{GUID}',
+                         status_code=404, text='not found')
+    adapter.register_uri('GET', f'{API_URL}/down',
+                         exc=requests.exceptions.ConnectionError)
+    session.mount('https://', adapter)
+    metrics.install(session, 'test')
+    return session
+
+
+def test_metrics():
+    metrics = Metrics()
+    session = metrics_session(metrics)
+    session.get(f'{API_URL}/v1/1234/invoices/{GUID}')
+    session.get(f'{API_URL}/v1/5678/invoices/{GUID}')
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get(f'{API_URL}/down')
+    endpoints = metrics.to_dict()['endpoints']
+    assert [(e['endpoint'], e['count'], e['status'], e['bytes'])
+            for e in endpoints] == [
+        ('/down', 1, {'error': 1}, 0),
+        ('/v1/{id}/invoices/{guid}', 2, {'200': 1, '404': 1},
+         len(json.dumps({'Guid': GUID})) + len('not found'))]
+    assert endpoints[1]['latency_buckets']['30.0'] == 2
+
+
+def test_write(tmp_path):
+    metrics = Metrics()
+    metrics_session(metrics).get(f'{API_URL}/v1/1234/invoices/{GUID}')
+    path = str(tmp_path / 'metrics.json')
+    metrics.write(path)
+    with open(path) as f:
+        assert json.load(f) == metrics.to_dict()
+    path = str(tmp_path / 'metrics.prom')
+    metrics.write(path, 'prometheus')
+    with open(path) as f:
+        lines = f.read().splitlines()
+    labels = 'api="test",method="GET",endpoint="/v1/{id}/invoices/{guid}"'
+    assert f'toggl_dinero_http_requests_total{{{labels},status="200"}} 1' \
+        in lines
+    assert 'toggl_dinero_http_request_duration_seconds_bucket' \
+        f'{{{labels},le="+Inf"}} 1' in lines
+    assert '# TYPE toggl_dinero_http_request_duration_seconds histogram' \
+        in lines
@@ -0,0 +1,106 @@
+"""Tests for toggl_dinero.ratelimit module."""
+
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+import pytest
+import requests
+import requests_mock
+from toggl_dinero import ratelimit
+from toggl_dinero.http import make_session
+from toggl_dinero.metrics import Metrics
+from toggl_dinero.ratelimit import TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock, advanced by (fake) sleeping."""
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: now[0])
+
+    def sleep(seconds):
+        now[0] += seconds
+    monkeypatch.setattr(ratelimit.time, 'sleep', sleep)
+    return now
+
+
+def test_reserve(clock):
+    bucket = TokenBucket(2, burst=2)
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0.5, 1.0]
+    clock[0] += 10
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0.5]
+
+
+def test_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_threads(clock):
+    metrics = Metrics()
+    bucket = TokenBucket(10, metrics=metrics, api='test')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        waits = sorted(executor.map(lambda _: bucket.reserve(), range(20)))
+    assert waits == pytest.approx([n / 10 for n in range(20)])
+    [stats] = metrics.to_dict()['rate_limit_waits']
+    assert stats['api'] == 'test'
+    assert stats['count'] == 20
+    assert stats['max_seconds'] == pytest.approx(1.9)
+
+
+def test_adapter(clock):
+    session = requests.Session()
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', 'https://api.example.com/items', json=[])
+    session.mount('https://', adapter)
+    TokenBucket(1).install(session)
+    for _ in range(3):
+        assert session.get('https://api.example.com/items').json() == []
+    assert adapter.call_count == 3
+    assert clock[0] == 1002.0
+
+
+def test_acquire_async(clock, monkeypatch):
+    bucket = TokenBucket(4)
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+    monkeypatch.setattr(ratelimit.asyncio, 'sleep', sleep)
+
+    async def main():
+        return await asyncio.gather(*[bucket.acquire_async()
+                                      for _ in range(3)])
+    assert sorted(asyncio.run(main())) == [0, 0.25, 0.5]
+    assert sorted(sleeps) == [0.25, 0.5]
+
+
+def test_retries_rate_limited():
+    # Retries are sent by urllib3 within the transport adapter, so use a
+    # real server instead of requests_mock
+    responses = [503, 503, 200]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(responses.pop(0))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        metrics = Metrics()
+        session = make_session(retries=3, backoff_factor=0)
+        TokenBucket(1000, metrics=metrics, api='test').install(session)
+        resp = session.get('http://%s:%d/' % server.server_address)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert resp.status_code == 200
+    [stats] = metrics.to_dict()['rate_limit_waits']
+    assert stats['count'] == 3
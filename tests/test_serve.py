@@ -0,0 +1,87 @@
+"""Tests for toggl_dinero.serve module."""
+
+
+import http.client
+import json
+import threading
+import pytest
+from toggl_dinero.dinero import DineroAPI
+from toggl_dinero.serve import InvoiceService, make_server
+from toggl_dinero.toggl import TogglAPI
+
+INVOICES_URL = 'https://api.dinero.dk/v1/1234/invoices'
+
+
+@pytest.fixture
+def service(services):
+    services.get(INVOICES_URL, json={
+        'Collection': [{'Guid': 'invoice-guid', 'ContactGuid': 'guid-foo'}],
+        'Pagination': {'Result': 1, 'PageSize': 1000}})
+    services.get(f'{INVOICES_URL}/invoice-guid', json={
+        'Guid': 'invoice-guid', 'ProductLines': []})
+    services.put('https://api.dinero.dk/v1.2/1234/invoices/invoice-guid',
+                 json={})
+    toggl = TogglAPI('token')
+    dinero = DineroAPI('client', 'secret', 'key', 'Foo')
+    service = InvoiceService(toggl, dinero, [1234], 'last-month', jobs=2)
+    service.mock = services
+    return service
+
+
+def puts(service):
+    return [r for r in service.mock.request_history if r.method == 'PUT']
+
+
+def test_refresh_all(service, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert service.refresh_all() == {'Foo': True}
+    assert len(puts(service)) == 1
+    assert service.status()['results'] == {'Foo': True}
+    # Indexes are kept between refreshes
+    service.mock.reset_mock()
+    service.refresh_all()
+    assert not [r for r in service.mock.request_history
+                if r.url.split('?')[0].endswith(('/clients', '/contacts'))]
+    service.refresh_all(refresh_indexes=True)
+    assert [r for r in service.mock.request_history
+            if r.url.split('?')[0].endswith('/contacts')]
+
+
+def test_http(service, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request(method, path):
+        conn = http.client.HTTPConnection(*server.server_address)
+        conn.request(method, path)
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read())
+    try:
+        assert request('POST', '/refresh/Foo') == \
+            (200, {'client': 'Foo', 'ok': True})
+        assert len(puts(service)) == 1
+        assert request('POST', '/refresh/Unknown')[0] == 404
+        assert request('POST', '/refresh') == (200, {'results': {'Foo': True}})
+        status, data = request('GET', '/status')
+        assert status == 200
+        assert data['results'] == {'Foo': True}
+        assert data['last_refresh'] is not None
+        assert request('GET', '/unknown')[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_run_schedule(service, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    refreshes = []
+
+    def refresh_all(refresh_indexes=False):
+        refreshes.append(refresh_indexes)
+        if len(refreshes) == 3:
+            service.stop()
+    service.refresh_all = refresh_all
+    service.run_schedule(0)
+    assert refreshes == [False, True, True]
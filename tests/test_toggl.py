@@ -1,9 +1,13 @@
 """Tests for toggl_dinero.toggl module."""
 
 
+import datetime
+import os
 import pytest
 import requests
-from toggl_dinero.toggl import TogglAPI
+from toggl_dinero.cache import FileCache
+from toggl_dinero.http import JitterRetry
+from toggl_dinero.toggl import TogglAPI, TOGGL_REPORTS_URL
 
 
 def test_init():
@@ -11,8 +15,8 @@ def test_init():
 
 
 CLIENTS = [
-    {'id': 1234, 'wid': 5657, 'name': 'Foo', 'at': '2019-12-23T12:23:07+00:00'},
-    {'id': 8901, 'wid': 2345, 'name': 'Bar', 'at': '2019-12-23T12:23:12+00:00'},
+    {'id': 1234, 'wid': 1234, 'name': 'Foo', 'at': '2019-12-23T12:23:07+00:00'},
+    {'id': 8901, 'wid': 5678, 'name': 'Bar', 'at': '2019-12-23T12:23:12+00:00'},
 ]
 
 WORKSPACES = [
@@ -124,6 +128,22 @@ def test_workspace_id_none_all(api):
     assert api.workspace_id() == None
 
 
+def test_workspace_ids(api):
+    assert api.workspace_ids(['Bar', 'Foo', 'Bar']) == [5678, 1234]
+    assert api.workspace_ids(['all']) == [1234, 5678]
+    assert api.workspace_ids(['Foo', 'unknown']) is None
+    assert api.workspace_ids() is None
+
+
+def test_client_ids(api):
+    api.mock.get('https://www.toggl.com/api/v8/clients', json=CLIENTS + [
+        {'id': 4321, 'wid': 5678, 'name': 'foo'}])
+    assert api.client_ids('Foo', [1234, 5678]) == {1234: 1234}
+    assert api.client_ids('Foo', [5678]) == {5678: 4321}
+    assert api.client_ids('FOO', [1234, 5678]) == {1234: 1234, 5678: 4321}
+    assert api.client_ids('Bar', [1234]) == {}
+
+
 def test_summary_report(api):
     api.mock.get('https://toggl.com/reports/api/v2/summary?'
                  'user_agent=toggl-dinero&workspace_id=42',
@@ -136,3 +156,176 @@ def test_summary_report_pdf(api):
                  'user_agent=toggl-dinero&workspace_id=42',
                  content=b'pdf file')
     assert api.summary_report_pdf({'workspace_id': 42}) == b'pdf file'
+
+
+def test_session_shared(api):
+    assert api.api.session is api.session
+    assert api.reports_api.session is api.session
+    api.client_id('Foo')
+    assert api.mock.last_request.headers['Authorization'].startswith('Basic ')
+
+
+def test_session_retry():
+    api = TogglAPI('foobar', pool_size=7, retries=3)
+    adapter = api.session.get_adapter(TOGGL_REPORTS_URL)
+    assert adapter._pool_maxsize == 7
+    assert adapter.max_retries.total == 3
+    assert 429 in adapter.max_retries.status_forcelist
+    assert adapter.max_retries.respect_retry_after_header
+
+
+def test_retry_jitter():
+    retry = JitterRetry(total=5, backoff_factor=1)
+    for _ in range(3):
+        retry = retry.increment(method='GET', url='/')
+    backoff = retry.get_backoff_time()
+    assert 2 <= backoff <= 4
+    assert isinstance(retry, JitterRetry)
+
+
+def test_client_id_case_insensitive(api):
+    assert api.client_id('foo') == 1234
+    assert api.client_id('BAR') == 8901
+
+
+def test_client_id_case_insensitive_ambiguous(api):
+    api.mock.get('https://www.toggl.com/api/v8/clients',
+                 json=CLIENTS + [{'id': 42, 'name': 'FOO'}])
+    assert api.client_id('Foo') == 1234
+    assert api.client_id('FOO') == 42
+    assert api.client_id('foo') is None
+
+
+def test_resolve_fetch_once(api):
+    for client in CLIENTS:
+        api.client_id(client['name'])
+    api.workspace_id('Foo')
+    api.workspace_id('Bar')
+    assert api.mock.call_count == 2
+
+
+def test_resolve_cached(api, tmp_path):
+    api.cache = FileCache(str(tmp_path))
+    assert api.client_id('Foo') == 1234
+    mock = api.mock
+    mock.reset_mock()
+    api = TogglAPI('__DUMMY_API_KEY__', cache=FileCache(str(tmp_path)))
+    assert api.client_id('Bar') == 8901
+    assert mock.call_count == 0
+    api.invalidate()
+    assert not os.listdir(tmp_path)
+
+
+def test_summary_report_cached(api, tmp_path):
+    api.cache = FileCache(str(tmp_path))
+    api.mock.get(f'{TOGGL_REPORTS_URL}/v2/summary', json=SUMMARY_REPORT_JSON)
+    api.mock.get(f'{TOGGL_REPORTS_URL}/v2/summary.pdf', content=b'pdf')
+    params = {'workspace_id': 42, 'since': '2020-01-01', 'until': '2020-01-31'}
+    for _ in range(2):
+        assert api.summary_report(dict(params)) == SUMMARY_REPORT_JSON
+        assert api.summary_report_pdf(dict(params)) == b'pdf'
+    assert api.mock.call_count == 2
+    api.summary_report(dict(params, billable='no'))
+    assert api.mock.call_count == 3
+
+
+def test_summary_report_pdf_path(api, tmp_path):
+    api.cache = FileCache(str(tmp_path / 'cache'))
+    api.mock.get(f'{TOGGL_REPORTS_URL}/v2/summary.pdf', content=b'pdf' * 1000)
+    params = {'workspace_id': 42, 'since': '2020-01-01', 'until': '2020-01-31'}
+    for n in range(2):
+        path = str(tmp_path / f'report{n}.pdf')
+        assert api.summary_report_pdf(dict(params), path=path) == path
+        with open(path, 'rb') as f:
+            assert f.read() == b'pdf' * 1000
+    assert api.mock.call_count == 1
+    assert api.mock.last_request.stream
+    assert sorted(os.listdir(tmp_path)) == ['cache', 'report0.pdf',
+                                            'report1.pdf']
+
+
+def test_report_ttl(api):
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    assert api._report_ttl({'until': str(yesterday)}) == \
+        TogglAPI.REPORT_TTL_CLOSED
+    assert api._report_ttl({'until': str(today)}) == TogglAPI.REPORT_TTL_OPEN
+    assert api._report_ttl({}) == TogglAPI.REPORT_TTL_OPEN
+
+
+DETAILED_ENTRIES = [
+    {'id': 1, 'project': 'Things', 'description': 'Some stuff',
+     'dur': 360000, 'cur': 'DKK', 'billable': 100.0},
+    {'id': 2, 'project': 'Things', 'description': 'Other stuff',
+     'dur': 19440000, 'cur': 'DKK', 'billable': 5400.0},
+    {'id': 3, 'project': 'Nothing', 'description': 'Wasting time',
+     'dur': 360000, 'cur': 'DKK', 'billable': 200.0},
+    {'id': 4, 'project': 'Things', 'description': 'Some stuff',
+     'dur': 360000, 'cur': 'DKK', 'billable': 100.0},
+]
+
+
+def detailed_pages(entries, per_page):
+    def callback(request, context):
+        page = int(request.qs['page'][0])
+        return {'total_count': len(entries), 'per_page': per_page,
+                'data': entries[(page-1)*per_page:page*per_page]}
+    return callback
+
+
+@pytest.mark.parametrize('per_page', [1, 3, 4, 50])
+def test_detailed_report(api, per_page):
+    api.mock.get(f'{TOGGL_REPORTS_URL}/v2/details',
+                 json=detailed_pages(DETAILED_ENTRIES, per_page))
+    entries = list(api.detailed_report({'workspace_id': 42}))
+    assert entries == DETAILED_ENTRIES
+    pages = -(-len(DETAILED_ENTRIES) // per_page)
+    assert api.mock.call_count == pages
+
+
+def test_synced_detailed_report(api, tmp_path, monkeypatch):
+    api.cache = FileCache(str(tmp_path))
+    changes = []
+
+    def me(request, context):
+        assert request.qs['with_related_data'] == ['true']
+        return {'since': 2000, 'data': {'time_entries': changes}}
+    api.mock.get('https://www.toggl.com/api/v8/me', json=me)
+    entries = [dict(e) for e in DETAILED_ENTRIES]
+
+    def details(request, context):
+        data = entries
+        if 'time_entry_ids' in request.qs:
+            ids = [int(i) for i in request.qs['time_entry_ids'][0].split(',')]
+            data = [e for e in entries if e['id'] in ids]
+        return {'total_count': len(data), 'per_page': 50, 'data': data}
+    api.mock.get(f'{TOGGL_REPORTS_URL}/v2/details', json=details)
+    params = {'workspace_id': 42, 'client_ids': 1}
+
+    assert api.synced_detailed_report(params) == DETAILED_ENTRIES
+
+    # Entry 2 changed, entry 3 deleted, entry 4 moved to another client
+    # and entry 5 in another workspace
+    entries[1]['dur'] = 720000
+    del entries[2:]
+    changes[:] = [{'id': 2, 'wid': 42},
+                  {'id': 3, 'wid': 42, 'server_deleted_at': '2020-01-01'},
+                  {'id': 4, 'wid': 42}, {'id': 5, 'wid': 43}]
+    api.mock.reset_mock()
+    assert api.synced_detailed_report(params) == entries
+    me_request, details_request = api.mock.request_history
+    assert me_request.qs['since'] == ['2000']
+    assert details_request.qs['time_entry_ids'] == ['2,4']
+    assert details_request.qs['client_ids'] == ['1']
+
+    # Full sync when last full sync is too old
+    monkeypatch.setattr(TogglAPI, 'SYNC_FULL_INTERVAL', -1)
+    changes.clear()
+    api.mock.reset_mock()
+    assert api.synced_detailed_report(params) == entries
+    assert 'time_entry_ids' not in api.mock.request_history[-1].qs
+
+
+def test_synced_detailed_report_no_cache(api):
+    with pytest.raises(ValueError):
+        api.synced_detailed_report({'workspace_id': 42})
@@ -0,0 +1,235 @@
+"""This module contains aggregation of Toggl time into invoice lines."""
+
+from collections import namedtuple
+import logging
+
+MS_PER_HOUR = 60 * 60 * 1000
+MS_PER_CENTIHOUR = MS_PER_HOUR // 100
+
+#: Supported ways of grouping time into invoice lines
+GROUP_BY = ['project', 'description', 'rate', 'user']
+
+#: An aggregated invoice line
+Line = namedtuple('Line', ['description', 'centihours', 'rate', 'ms'])
+
+
+def centihours(ms):
+    """
+    Convert milliseconds to hundredths of hours, rounding half up.
+
+    :param ms: Time in milliseconds.
+    :return: Time in centi-hours (integer).
+    """
+    return (ms + MS_PER_CENTIHOUR // 2) // MS_PER_CENTIHOUR
+
+
+def rate_range(amount, ms):
+    """
+    Get range of hourly rates giving a billable amount for a time.
+
+    Toggl rounds billable amounts to cents, so the rate cannot be calculated
+    exactly from the amount, the less so the shorter the time.
+
+    :param amount: Billable amount, rounded to cents.
+    :param ms: Time in milliseconds.
+    :return: Tuple of lowest and highest possible rate.
+    """
+    if not ms:
+        return float('-inf'), float('inf')
+    hours = ms / MS_PER_HOUR
+    # Allow for floating point errors in amounts
+    return (amount - 0.005 - 1e-9) / hours, (amount + 0.005 + 1e-9) / hours
+
+
+def range_rate(low, high):
+    """
+    Get the rate with fewest decimals within a range of possible rates.
+
+    :param low: Lowest possible rate.
+    :param high: Highest possible rate.
+    :return: Hourly rate, with at most 2 decimals.
+    """
+    if low == float('-inf') or high == float('inf'):
+        return 0
+    middle = (low + high) / 2
+    for digits in (0, 1):
+        rate = round(middle, digits)
+        if low <= rate <= high:
+            return float(rate)
+    return round(middle, 2)
+
+
+class Aggregator:
+    """
+    Aggregate time into invoice lines.
+
+    All time is accumulated as integer milliseconds, and only rounded when
+    converted to centi-hours per invoice line.  The total in centi-hours is
+    the sum of the rounded lines, so it matches the invoiced quantities.  The
+    exact total in milliseconds is kept for checking against the report.
+    """
+
+    def __init__(self, group_by='description', observer=None):
+        """
+        Create a new instance.
+
+        :param group_by: How to group time into invoice lines.  One of
+                         'project', 'description' (project and time entry
+                         description), 'rate' or 'user'.
+        :param observer: Function called with a dictionary of the arguments
+                         of each :meth:`add` call, for example for recording
+                         the added items.
+        """
+        if group_by not in GROUP_BY:
+            raise ValueError(f'Unsupported grouping: {group_by}')
+        self.group_by = group_by
+        self.observer = observer
+        self.currency = None
+        self.total_ms = 0
+        self._lines = {}
+        self._ranges = {}
+
+    def _key(self, project, description, rate, user):
+        if self.group_by == 'project':
+            return (project, rate)
+        if self.group_by == 'description':
+            return (project, description, rate)
+        if self.group_by == 'rate':
+            return (rate,)
+        return (user, rate)
+
+    def add(self, ms, rate, currency, project=None, description=None,
+            user=None, amount=None):
+        """
+        Add time to aggregation.
+
+        Time with the same grouping key (and rate) is collapsed into a single
+        invoice line.
+
+        :param ms: Time in milliseconds.
+        :param rate: Hourly rate, or None to derive it from amount.
+        :param currency: Currency of rate.
+        :param project: Project name.
+        :param description: Time entry description.
+        :param user: User name.
+        :param amount: Billable amount (rounded to cents) when rate is None.
+                       Time is added to a line whose possible rates (see
+                       :func:`rate_range`) overlap those of the amount, and
+                       the line rate is the simplest rate possible for all
+                       amounts of the line.
+        """
+        if self.currency is None:
+            self.currency = currency
+        elif currency != self.currency:
+            raise ValueError(f'Mixed currencies: {self.currency} {currency}')
+        line_range = None
+        if rate is None:
+            # Lines of the same grouping key are told apart by the index of
+            # their range of possible rates
+            low, high = rate_range(amount, ms)
+            base_key = self._key(project, description, None, user)
+            ranges = self._ranges.setdefault(base_key, [])
+            for n, (line_low, line_high) in enumerate(ranges):
+                if low <= line_high and line_low <= high:
+                    ranges[n] = (max(low, line_low), min(high, line_high))
+                    break
+            else:
+                n = len(ranges)
+                ranges.append((low, high))
+            line_range = (base_key, n)
+            key = self._key(project, description, line_range, user)
+        else:
+            key = self._key(project, description, rate, user)
+        line = self._lines.get(key)
+        if line is None:
+            line = self._lines[key] = {
+                'project': project, 'projects': {},
+                'description': description, 'user': user,
+                'rate': rate, 'range': line_range, 'ms': 0}
+        line['projects'][project] = None
+        line['ms'] += ms
+        self.total_ms += ms
+        if self.observer is not None:
+            if rate is None:
+                rate = range_rate(low, high)
+            else:
+                amount = ms * rate / MS_PER_HOUR
+            self.observer({'ms': ms, 'rate': rate, 'currency': currency,
+                           'project': project, 'description': description,
+                           'user': user, 'amount': amount})
+
+    def add_summary_report(self, report):
+        """
+        Add all items of summary report to aggregation.
+
+        Several reports (for example for different workspaces) can be added
+        to the same aggregation.
+
+        :param report: Summary report data, grouped by projects, and
+                       subgrouped by time entries or users.
+        """
+        start_ms = self.total_ms
+        for project in report['data']:
+            project_name = project['title']['project']
+            for item in project['items']:
+                title = item['title']
+                self.add(item['time'], item['rate'], item['cur'],
+                         project=project_name,
+                         description=title.get('time_entry'),
+                         user=title.get('user'))
+        total = report.get('total_grand')
+        if total is not None and total != self.total_ms - start_ms:
+            logging.warning(f'Aggregated time ({self.total_ms - start_ms} ms) '
+                            f'does not match summary report total '
+                            f'({total} ms)')
+
+    def add_time_entries(self, entries):
+        """
+        Add detailed report time entries to aggregation.
+
+        Entries are aggregated as they are consumed, so a generator (like
+        :meth:`TogglAPI.detailed_report`) is never held in memory.
+
+        :param entries: Iterable of detailed report time entries.
+        """
+        for entry in entries:
+            self.add(entry['dur'], None, entry['cur'],
+                     project=entry['project'],
+                     description=entry['description'],
+                     user=entry.get('user'),
+                     amount=entry.get('billable') or 0)
+
+    def lines(self):
+        """
+        Get aggregated invoice lines.
+
+        :return: List of Line tuples, in the order they were first added.
+        """
+        lines = []
+        for line in self._lines.values():
+            rate = line['rate']
+            if rate is None:
+                base_key, n = line['range']
+                rate = range_rate(*self._ranges[base_key][n])
+            if self.group_by == 'description':
+                description = f"{line['project']}: {line['description']}"
+            elif self.group_by == 'project':
+                description = f"{line['project']}"
+            elif self.group_by == 'rate':
+                description = ', '.join(f'{p}' for p in line['projects'])
+            else:
+                description = f"{line['user']}"
+            lines.append(Line(description, centihours(line['ms']), rate,
+                              line['ms']))
+        return lines
+
+    @property
+    def total_centihours(self):
+        """
+        Get total time in centi-hours.
+
+        The total is the sum of the lines, each rounded separately, so it may
+        differ slightly from :attr:`total_ms` rounded, which is only used for
+        checking the total of summary reports.
+        """
+        return sum(line.centihours for line in self.lines())
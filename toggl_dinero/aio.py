@@ -0,0 +1,607 @@
+"""
+This module contains asyncio counterparts of the Toggl and Dinero APIs.
+
+The classes have the same method surface as :class:`~toggl_dinero.toggl.
+TogglAPI` and :class:`~toggl_dinero.dinero.DineroAPI`, but all requests are
+coroutines sent through a single pooled httpx client, so many requests can
+be kept in flight without a thread per request::
+
+    async with httpx.AsyncClient() as client:
+        toggl = AsyncTogglAPI(api_token, client=client)
+        async with AsyncDineroAPI(client_id, client_secret, api_key,
+                                  name, client=client) as dinero:
+            ...
+
+This module requires httpx (``pip install toggl-dinero[async]``).
+"""
+
+import asyncio
+import logging
+import random
+import time
+
+try:
+    import httpx
+except ImportError as e:  # pragma: no cover
+    raise ImportError('The asyncio API requires httpx, install it with: '
+                      'pip install toggl-dinero[async]') from e
+
+from .cache import cache_key
+from .dinero import ContactIndex, DINERO_TOKEN_URL, _DineroBase
+from .http import RETRY_STATUS
+from .toggl import TOGGL_REPORTS_URL, _Index, _TogglBase, _atomic_write
+
+TOGGL_API_URL = 'https://www.toggl.com/api/v8'
+
+#: HTTP methods that are retried on RETRY_STATUS responses
+RETRY_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
+class _AsyncSession:
+    """Pooled httpx client with retries of throttled and failed requests."""
+
+    def __init__(self, client=None, pool_size=10, retries=5,
+                 backoff_factor=0.5, rate_limit=None):
+        self.owned = client is None
+        if client is None:
+            limits = httpx.Limits(max_keepalive_connections=pool_size)
+            client = httpx.AsyncClient(limits=limits)
+        self.client = client
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.rate_limit = rate_limit
+
+    def _backoff(self, attempt, resp):
+        """Get time to wait before retrying, with jitter like JitterRetry."""
+        retry_after = resp.headers.get('Retry-After') if resp else None
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        backoff = self.backoff_factor * (2 ** attempt)
+        return random.uniform(backoff / 2, backoff)
+
+    async def request(self, method, url, stream=False, **kwargs):
+        """
+        Send request, retrying connection errors and RETRY_STATUS responses.
+
+        Like JitterRetry, requests of methods not in RETRY_METHODS (such as
+        POST) are only retried if the connection could not be made, since
+        they might otherwise already have been handled by the server.
+
+        When retries are exhausted, the last response is returned as is.
+
+        :param stream: Do not read the response body.  The caller must close
+                       the returned response.
+        """
+        auth = kwargs.pop('auth', httpx.USE_CLIENT_DEFAULT)
+        for attempt in range(self.retries + 1):
+            resp = None
+            if self.rate_limit is not None:
+                await self.rate_limit.acquire_async()
+            try:
+                request = self.client.build_request(method, url, **kwargs)
+                resp = await self.client.send(request, auth=auth,
+                                              stream=stream)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise
+                if method not in RETRY_METHODS and not isinstance(
+                        e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUS or \
+                        method not in RETRY_METHODS or \
+                        attempt == self.retries:
+                    return resp
+                await resp.aclose()
+            await asyncio.sleep(self._backoff(attempt, resp))
+
+    async def aclose(self):
+        """Close the httpx client, if it was created by this session."""
+        if self.owned:
+            await self.client.aclose()
+
+
+class AsyncTogglAPI(_TogglBase):
+    """An asyncio connection object for accessing Toggl API."""
+
+    def __init__(self, api_token, client=None, pool_size=10, retries=5,
+                 cache=None, rate_limit=None):
+        """
+        Create a new instance.
+
+        :param api_token: Toggl API token.
+        :param client: httpx.AsyncClient to send requests with.  If not
+                       given, a new client is created.
+        :param pool_size: Maximum number of connections to keep open (only
+                          used when creating a new client).
+        :param retries: Maximum number of retries per request.
+        :param cache: FileCache instance for persistent caching.
+        :param rate_limit: TokenBucket instance limiting the request rate.
+        """
+        self.cache = cache
+        self._cache_key = cache_key(api_token)
+        self._auth = (api_token, 'api_token')
+        self._indexes = {}
+        self._index_locks = {}
+        self.session = _AsyncSession(client, pool_size=pool_size,
+                                     retries=retries, rate_limit=rate_limit)
+
+    async def __aenter__(self):
+        """Enter async context."""
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Exit async context, closing connections."""
+        await self.aclose()
+
+    async def aclose(self):
+        """Close connections, if the httpx client is owned by this object."""
+        await self.session.aclose()
+
+    async def _get(self, url, params=None):
+        resp = await self.session.request('GET', url, params=params,
+                                          auth=self._auth)
+        resp.raise_for_status()
+        return resp
+
+    async def _index(self, name, field, path):
+        """Get index of Toggl objects (see :meth:`TogglAPI._index`)."""
+        lock = self._index_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name in self._indexes:
+                return self._indexes[name]
+            items = self._load_index(name)
+            if items is not None:
+                self._indexes[name] = _Index(items, field)
+                return self._indexes[name]
+            items = (await self._get(f'{TOGGL_API_URL}{path}')).json()
+            return self._store_index(name, items, field)
+
+    async def clients(self):
+        """Get all clients."""
+        return (await self._index('clients', 'name', '/clients')).items
+
+    async def client_id(self, name):
+        """Resolve client ID from name."""
+        return (await self._index('clients', 'name', '/clients')).lookup(name)
+
+    async def user_id(self, workspace_id, email):
+        """Resolve user ID from email."""
+        index = await self._index(f'users-{workspace_id}', 'email',
+                                  f'/workspaces/{workspace_id}/users')
+        return index.lookup(email)
+
+    async def workspace_id(self, name=None):
+        """Get workspace ID."""
+        index = await self._index('workspaces', 'name', '/workspaces')
+        return self._lookup_workspace(index, name)
+
+    async def summary_report(self, params):
+        """
+        Fetch summary report (JSON data).
+
+        :param params: Request parameters for the summary report API.
+        :return: Summary report data as dictionary
+        """
+        params.setdefault('user_agent', 'toggl-dinero')
+        name, report = self._load_summary_report(params)
+        if report is not None:
+            return report
+        resp = await self._get(f'{TOGGL_REPORTS_URL}/v2/summary', params)
+        report = resp.json()
+        if name is not None:
+            self.cache.store(name, report)
+        return report
+
+    async def detailed_report(self, params):
+        """
+        Fetch detailed report, one page at a time.
+
+        The next page is fetched in the background while the time entries
+        of the current page are consumed.
+
+        :param params: Request parameters for the detailed report API.
+        :return: Async generator of time entries.
+        """
+        params = dict(params)
+        params.setdefault('user_agent', 'toggl-dinero')
+
+        async def fetch(page):
+            resp = await self._get(f'{TOGGL_REPORTS_URL}/v2/details',
+                                   dict(params, page=page))
+            return resp.json()
+
+        page = 1
+        next_page = asyncio.ensure_future(fetch(page))
+        try:
+            while next_page is not None:
+                report = await next_page
+                next_page = None
+                page = self._next_page(report, page)
+                if page is not None:
+                    next_page = asyncio.ensure_future(fetch(page))
+                for entry in report['data']:
+                    yield entry
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def summary_report_pdf(self, params, path=None):
+        """
+        Fetch summary report (PDF file).
+
+        When a path is given, the PDF is streamed to disk in chunks instead of
+        being held in memory.
+
+        :param params: Request parameters for the summary report API.
+        :param path: Path to write PDF file to.
+        :return: Summary report PDF as bytes, or path if given.
+        """
+        params.setdefault('user_agent', 'toggl-dinero')
+        name, report = self._load_summary_report_pdf(params, path)
+        if report is not None:
+            return report
+        url = f'{TOGGL_REPORTS_URL}/v2/summary.pdf'
+        if path is None:
+            resp = await self._get(url, params)
+            if name is not None:
+                self.cache.store_bytes(name, resp.content)
+            return resp.content
+        resp = await self.session.request('GET', url, stream=True,
+                                          params=params, auth=self._auth)
+        try:
+            resp.raise_for_status()
+            with _atomic_write(path) as f:
+                async for chunk in resp.aiter_bytes(self.PDF_CHUNK_SIZE):
+                    f.write(chunk)
+        finally:
+            await resp.aclose()
+        if name is not None:
+            self.cache.store_file(name, path)
+        return path
+
+
+class AsyncDineroAPI(_DineroBase):
+    """An asyncio connection object for accessing Dinero API."""
+
+    def __init__(self, client_id, client_secret, api_key, name=None,
+                 client=None, pool_size=10, retries=5, cache=None,
+                 rate_limit=None):
+        """
+        Create a new instance.
+
+        No requests are sent until :meth:`login` is awaited (which is done
+        automatically when used as an async context manager).
+
+        :param client_id: Dinero client ID.
+        :param client_secret: Dinero client secret.
+        :param api_key: Dinero API key.
+        :param name: Name of organization to work/on.
+        :param client: httpx.AsyncClient to send requests with.  If not
+                       given, a new client is created.
+        :param pool_size: Maximum number of connections to keep open (only
+                          used when creating a new client).
+        :param retries: Maximum number of retries per request.
+        :param cache: FileCache instance for persistent caching.
+        :param rate_limit: TokenBucket instance limiting the request rate.
+        """
+        self.cache = cache
+        self.name = name
+        self.organization = None
+        self.token = None
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._api_key = api_key
+        self._cache_key = cache_key(client_id, api_key)
+        self._contact_index = None
+        self._contact_index_lock = asyncio.Lock()
+        self._token_lock = asyncio.Lock()
+        self.session = _AsyncSession(client, pool_size=pool_size,
+                                     retries=retries, rate_limit=rate_limit)
+
+    async def __aenter__(self):
+        """Enter async context, logging in to Dinero."""
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Exit async context, closing connections."""
+        await self.aclose()
+
+    async def aclose(self):
+        """Close connections, if the httpx client is owned by this object."""
+        await self.session.aclose()
+
+    async def login(self):
+        """Get OAuth2 token and set organization."""
+        await self._ensure_token()
+        if not await self.set_organization(self.name):
+            raise Exception('Could not set organization')
+
+    async def _fetch_token(self, data):
+        resp = await self.session.request(
+            'POST', DINERO_TOKEN_URL, data=data,
+            auth=(self._client_id, self._client_secret))
+        resp.raise_for_status()
+        token = resp.json()
+        if 'expires_in' in token:
+            token['expires_at'] = time.time() + int(token['expires_in'])
+        self._store_token(token)
+        return token
+
+    async def _ensure_token(self):
+        """Get valid token, refreshing or fetching a new one if needed."""
+        async with self._token_lock:
+            token = self.token
+            if token is None:
+                token = self._load_token()
+            if token is not None and self._token_expired(token):
+                try:
+                    token = await self._fetch_token({
+                        'grant_type': 'refresh_token',
+                        'refresh_token': token['refresh_token']})
+                except Exception as e:
+                    logging.info(f'Refreshing Dinero token failed: {e}')
+                    token = None
+            if token is None:
+                token = await self._fetch_token({
+                    'grant_type': 'password',
+                    'username': self._api_key, 'password': self._api_key})
+            self.token = token
+            return token
+
+    async def _request(self, method, url, **kwargs):
+        token = await self._ensure_token()
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers['Authorization'] = f"Bearer {token['access_token']}"
+        return await self.session.request(method, url, headers=headers,
+                                          **kwargs)
+
+    async def set_organization(self, name=None):
+        """Set the Dinero organization to work with/on.
+
+        :param name: Name of organization.
+
+        """
+        organization = self._load_organization(name)
+        if organization is not None:
+            self.organization = organization
+            return self.organization
+        url = f'{self.API_URL_V1}/organizations'
+        params = {'fields': 'name,id'}
+        orgs = (await self._request('GET', url, params=params)).json()
+        return self._select_organization(orgs, name)
+
+    async def get_contact(self, contact):
+        """Get named contact of current organization."""
+        url = f'{self.API_URL_V1}/{self.organization}/contacts/{contact}'
+        return await self._request('GET', url)
+
+    async def update_contact(self, contact, data, store=True):
+        """
+        Update contact information in current organization.
+
+        :param contact: Contact id to change.
+        :param data: Update contact data to upload.
+        :param store: Store the updated contact index in the cache (see
+                      :meth:`DineroAPI.update_contact`).
+        :return: True on success, False otherwise.
+        """
+        url = f'{self.API_URL_V1}/{self.organization}/contacts/{contact}'
+        resp = await self._request('PUT', url, json=data)
+        if not resp.is_success:
+            self._print_error('Updating contact', resp.status_code,
+                              resp.reason_phrase, resp.text)
+            return False
+        async with self._contact_index_lock:
+            if not self._index_updated_contact(contact, data):
+                return True
+        if store:
+            self.store_contact_index()
+        return True
+
+    def store_contact_index(self):
+        """Store contact index in the cache, if both exist."""
+        # The index cannot change while it is written, as no other coroutine
+        # runs until this returns
+        if self.cache is None or self._contact_index is None:
+            return
+        self.cache.store(self._contact_index_cache_name(),
+                         list(self._contact_index.contacts.values()))
+
+    async def contact_index(self, refresh=False):
+        """
+        Get index of all contacts in current organization.
+
+        See :meth:`DineroAPI.contact_index`.
+
+        :param refresh: Rebuild index, ignoring any cached index.
+        :return: ContactIndex instance.
+        """
+        async with self._contact_index_lock:
+            if self._contact_index is not None and not refresh:
+                return self._contact_index
+            if not refresh:
+                self._contact_index = self._load_contact_index()
+                if self._contact_index is not None:
+                    return self._contact_index
+            index = self._contact_index = ContactIndex(
+                [c async for c in self._iter_contacts(ContactIndex.FIELDS)])
+        self.store_contact_index()
+        return index
+
+    async def _iter_collection(self, url, params):
+        """
+        Iterate over all items of a paginated collection.
+
+        See :meth:`DineroAPI._iter_collection`.
+
+        :param url: Collection URL.
+        :param params: Request parameters (such as fields and filters).
+        :return: Async generator of items.
+        """
+        semaphore = asyncio.Semaphore(self.PAGE_JOBS)
+
+        async def fetch(page):
+            params_ = dict(params, page=page, pageSize=self.PAGE_SIZE)
+            async with semaphore:
+                return (await self._request('GET', url,
+                                            params=params_)).json()
+
+        items = await fetch(0)
+        for item in items['Collection']:
+            yield item
+        pages = self._remaining_pages(items['Pagination'], params)
+        if pages is not None:
+            # At most PAGE_JOBS pages are requested at a time, and pages are
+            # yielded in order as soon as they arrive
+            tasks = [asyncio.ensure_future(fetch(page))
+                     for page in range(1, pages + 1)]
+            try:
+                for task in tasks:
+                    for item in (await task)['Collection']:
+                        yield item
+            finally:
+                for task in tasks:
+                    task.cancel()
+            return
+        # Without a total, fetch one page at a time until a short page
+        page = 1
+        while True:
+            items = await fetch(page)
+            for item in items['Collection']:
+                yield item
+            if self._last_page(items['Pagination']):
+                break
+            page += 1
+
+    def _iter_contacts(self, fields):
+        """
+        Iterate over all contacts of current organization.
+
+        :param fields: Contact fields to request.
+        :return: Async generator of contact data.
+        """
+        url = f'{self.API_URL_V1}/{self.organization}/contacts'
+        return self._iter_collection(url, {'fields': fields})
+
+    async def contact_id(self, name):
+        """Get contact ID of named contact."""
+        return (await self.contact_index()).names.get(name)
+
+    async def contact_with_external_reference(self, key, value):
+        """
+        Get contact ID of contact with matching ExternalReference.
+
+        :param key: Key to match.
+        :param value: Value to match.
+        """
+        index = await self.contact_index()
+        return index.external_references.get((key, value))
+
+    async def contacts_with_external_reference(self, key):
+        """
+        Get all contacts with an ExternalReference key.
+
+        :param key: Key to look for in ExternalReference JSON objects.
+        :return: Dictionary mapping key values to contact IDs.
+        """
+        return (await self.contact_index()).linked(key)
+
+    async def create_invoice(self, contact, product_lines=[],
+                             language=None, currency=None, comment=None,
+                             date=None):
+        """
+        Create draft invoice.
+
+        :param contact: Contact ID.
+        :param product_lines: Product lines for the invoices API.
+        :param language: Language of the invoice.
+        :param currency: Currency to use for the invoice.
+        :param comment: Comment to add to invoice.
+        :param date: Invoice date.
+        :return: ID of created invoice, or None on failure.
+        """
+        url = f'{self.API_URL_V1}/{self.organization}/invoices'
+        body = self._invoice_body(contact, product_lines, language, currency,
+                                  comment, date)
+        resp = await self._request('POST', url, json=body)
+        if not resp.is_success:
+            self._print_error('Creating invoice', resp.status_code,
+                              resp.reason_phrase, resp.text)
+            return None
+        return resp.json().get('Guid')
+
+    async def draft_invoices(self):
+        """
+        Get all draft invoices, indexed by contact.
+
+        See :meth:`DineroAPI.draft_invoices`.
+
+        :return: Dictionary mapping contact ID to list of draft invoices.
+        """
+        url = f'{self.API_URL_V1}/{self.organization}/invoices'
+        return self._index_drafts([i async for i in self._iter_collection(
+            url, self.DRAFTS_PARAMS)])
+
+    async def get_draft_invoice(self, contact, drafts=None):
+        """
+        Get existing draft invoice.
+
+        See :meth:`DineroAPI.get_draft_invoice`.
+
+        :param contact: Contact ID to get draft invoice for.
+        :param drafts: Draft invoices from :meth:`draft_invoices`.  If not
+                       given, the draft invoices of the contact are listed.
+        :return: Invoice data or None.
+        """
+        if drafts is not None:
+            invoices = drafts.get(contact, [])
+        else:
+            url = f'{self.API_URL_V1}/{self.organization}/invoices'
+            resp = await self._request(
+                'GET', url, params=self._contact_drafts_params(contact))
+            if not resp.is_success:
+                self._print_error('Getting invoice list', resp.status_code,
+                                  resp.reason_phrase, resp.text)
+                return None
+            invoices = resp.json()['Collection']
+        guid = self._single_draft(invoices)
+        if guid is None:
+            return None
+        return await self.get_invoice(guid)
+
+    async def get_invoice(self, guid):
+        """
+        Get invoice.
+
+        :param guid: Invoice ID.
+        :return: Invoice data or None.
+        """
+        url = f'{self.API_URL_V1}/{self.organization}/invoices/{guid}'
+        resp = await self._request('GET', url,
+                                   headers={'Accept': 'application/json'})
+        if not resp.is_success:
+            self._print_error('Getting invoice', resp.status_code,
+                              resp.reason_phrase, resp.text)
+            return None
+        return resp.json()
+
+    async def update_invoice(self, invoice):
+        """
+        Update existing draft invoice.
+
+        :param guid: Invoice data.
+        :return: True on success, False otherwise.
+        """
+        guid = invoice['Guid']
+        # API v1 does not support Text lines, so we need to use at least v1.2
+        url = f'{self.API_URL_V1_2}/{self.organization}/invoices/{guid}'
+        resp = await self._request('PUT', url, json=invoice)
+        if not resp.is_success:
+            self._print_error('Updating invoice', resp.status_code,
+                              resp.reason_phrase, resp.text)
+        return resp.is_success
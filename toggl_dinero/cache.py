@@ -0,0 +1,164 @@
+"""This module contains a simple file based cache."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+
+def cache_key(*parts):
+    """
+    Get a short cache key from a number of values.
+
+    Useful for using secrets (like API tokens) as part of cache entry names
+    without writing them to disk.
+
+    :param parts: Values to derive key from.
+    :return: Hexadecimal key string.
+    """
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+
+class FileCache:
+    """A directory of cache entries with time-to-live support."""
+
+    def __init__(self, directory, refresh=False):
+        """
+        Create a new instance.
+
+        :param directory: Directory to store cache entries in.
+        :param refresh: Ignore existing cache entries, only using entries
+                        stored by this instance.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.refresh = refresh
+        self._stored = set()
+
+    def path(self, name):
+        """Get path of named cache entry."""
+        return os.path.join(self.directory, name)
+
+    def _is_valid(self, name, ttl):
+        if self.refresh and name not in self._stored:
+            return False
+        try:
+            mtime = os.path.getmtime(self.path(name))
+        except OSError:
+            return False
+        return ttl is None or time.time() - mtime <= ttl
+
+    def load(self, name, ttl=None):
+        """
+        Load JSON data from cache.
+
+        :param name: Name of cache entry.
+        :param ttl: Maximum age of cache entry in seconds.
+        :return: Cached data, or None if not found or expired.
+        """
+        if not self._is_valid(name, ttl):
+            return None
+        try:
+            with open(self.path(name), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Ignoring bad cache entry: {name}: {e}')
+            return None
+
+    def store(self, name, data, private=False):
+        """
+        Store JSON data in cache.
+
+        :param name: Name of cache entry.
+        :param data: JSON serializable data to store.
+        :param private: Only allow current user to read the cache entry.
+        """
+        self._write(name, json.dumps(data).encode('utf-8'), private)
+
+    def load_bytes(self, name, ttl=None):
+        """
+        Load binary data from cache.
+
+        :param name: Name of cache entry.
+        :param ttl: Maximum age of cache entry in seconds.
+        :return: Cached data, or None if not found or expired.
+        """
+        if not self._is_valid(name, ttl):
+            return None
+        try:
+            with open(self.path(name), 'rb') as f:
+                return f.read()
+        except OSError as e:
+            logging.warning(f'Ignoring bad cache entry: {name}: {e}')
+            return None
+
+    def store_bytes(self, name, data, private=False):
+        """
+        Store binary data in cache.
+
+        :param name: Name of cache entry.
+        :param data: Data to store.
+        :param private: Only allow current user to read the cache entry.
+        """
+        self._write(name, data, private)
+
+    def load_file(self, name, path, ttl=None):
+        """
+        Copy cached file to path.
+
+        :param name: Name of cache entry.
+        :param path: Path to copy cache entry to.
+        :param ttl: Maximum age of cache entry in seconds.
+        :return: True if copied, False if not found or expired.
+        """
+        if not self._is_valid(name, ttl):
+            return False
+        try:
+            shutil.copyfile(self.path(name), path)
+        except OSError as e:
+            logging.warning(f'Ignoring bad cache entry: {name}: {e}')
+            return False
+        return True
+
+    def store_file(self, name, path, private=False):
+        """
+        Store copy of file in cache.
+
+        :param name: Name of cache entry.
+        :param path: Path of file to store.
+        :param private: Only allow current user to read the cache entry.
+        """
+        with open(path, 'rb') as f:
+            self._write(name, f, private)
+
+    def _write(self, name, data, private):
+        # Write to a temporary file and rename it, so that concurrent readers
+        # never see a partially written entry.
+        path = self.path(name)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        mode = 0o600 if private else 0o666
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    shutil.copyfileobj(data, f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._stored.add(name)
+
+    def invalidate(self, name):
+        """Remove named cache entry."""
+        self._stored.discard(name)
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
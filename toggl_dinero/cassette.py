@@ -0,0 +1,230 @@
+"""This module contains recording and replaying of HTTP exchanges."""
+
+import base64
+from collections import defaultdict, deque
+import io
+import json
+import logging
+import os
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from .http import wrap_adapters
+
+#: Placeholder for secrets removed from recorded exchanges
+SCRUBBED = '**scrubbed**'
+
+#: Headers with secrets
+SECRET_HEADERS = {'authorization', 'cookie', 'set-cookie'}
+
+#: Form and JSON fields with secrets
+SECRET_FIELDS = {'access_token', 'refresh_token', 'password', 'username',
+                 'client_secret', 'api_token'}
+
+
+def _normalize_url(url):
+    """Normalize URL, sorting query parameters."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit(parts._replace(query=query))
+
+
+def _scrub_headers(headers):
+    return {k: SCRUBBED if k.lower() in SECRET_HEADERS else v
+            for k, v in headers.items()}
+
+
+def _scrub_data(data):
+    """
+    Scrub secrets from JSON data, at any depth.
+
+    :return: Tuple of scrubbed data, and whether anything was scrubbed.
+    """
+    if isinstance(data, dict):
+        scrubbed = {}
+        changed = False
+        for k, v in data.items():
+            if k in SECRET_FIELDS:
+                scrubbed[k] = SCRUBBED
+                changed = True
+            else:
+                scrubbed[k], v_changed = _scrub_data(v)
+                changed = changed or v_changed
+        return scrubbed, changed
+    if isinstance(data, list):
+        items = [_scrub_data(v) for v in data]
+        return [v for v, _ in items], any(c for _, c in items)
+    return data, False
+
+
+def _scrub_body(body):
+    """Scrub secrets from body, returning JSON serializable data."""
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        try:
+            body = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'base64': base64.b64encode(body).decode('ascii')}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if isinstance(data, (dict, list)):
+        data, changed = _scrub_data(data)
+        return json.dumps(data) if changed else body
+    if data is None and '=' in body:
+        fields = parse_qsl(body, keep_blank_values=True)
+        if any(k in SECRET_FIELDS for k, v in fields):
+            return urlencode([(k, SCRUBBED if k in SECRET_FIELDS else v)
+                              for k, v in fields])
+    return body
+
+
+def _decode_body(body):
+    if body is None:
+        return b''
+    if isinstance(body, dict):
+        return base64.b64decode(body['base64'])
+    return body.encode('utf-8')
+
+
+class Cassette:
+    """
+    A directory of recorded HTTP exchanges.
+
+    In record mode, all requests are sent as usual, and each exchange is
+    written to a JSON file in the directory, with secrets (authorization
+    headers, tokens and credentials) scrubbed.
+
+    In replay mode, no requests are sent.  Responses are served from the
+    recorded exchanges, matching on method and URL.  Exchanges with the same
+    method and URL are replayed in the order they were recorded, repeating
+    the last one.
+    """
+
+    def __init__(self, directory, mode):
+        """
+        Create a new instance.
+
+        :param directory: Directory to record to/replay from.
+        :param mode: Either 'record' or 'replay'.
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unsupported cassette mode: {mode}')
+        self.directory = directory
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._count = 0
+        self._exchanges = defaultdict(deque)
+        if mode == 'record':
+            os.makedirs(directory, exist_ok=True)
+        else:
+            self._load()
+
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.directory, name),
+                      encoding='utf-8') as f:
+                exchange = json.load(f)
+            request = exchange['request']
+            key = (request['method'], _normalize_url(request['url']))
+            self._exchanges[key].append(exchange['response'])
+            self._count += 1
+
+    def install(self, session, api=None):
+        """
+        Install cassette on a session.
+
+        :param session: requests.Session instance.
+        :param api: Name of API the session is used for.
+        """
+        wrap_adapters(session, lambda a: CassetteAdapter(self, a, api))
+
+    def record(self, request, response, api=None):
+        """Record HTTP exchange."""
+        exchange = {
+            'api': api,
+            'request': {
+                'method': request.method,
+                'url': request.url,
+                'headers': _scrub_headers(request.headers),
+                'body': _scrub_body(request.body),
+            },
+            'response': {
+                'status_code': response.status_code,
+                'reason': response.reason,
+                'headers': _scrub_headers(response.headers),
+                'body': _scrub_body(response.content),
+            },
+        }
+        with self._lock:
+            self._count += 1
+            name = f'{self._count:05d}-{api or "http"}.json'
+        with open(os.path.join(self.directory, name), 'w',
+                  encoding='utf-8') as f:
+            json.dump(exchange, f, indent=1)
+
+    def replay(self, request, adapter=None):
+        """Get recorded response for request."""
+        key = (request.method, _normalize_url(request.url))
+        with self._lock:
+            responses = self._exchanges.get(key)
+            if not responses:
+                raise ConnectionError(
+                    f'No recorded response for {request.method} '
+                    f'{request.url}', request=request)
+            recorded = responses[0]
+            if len(responses) > 1:
+                responses.popleft()
+        response = Response()
+        response.status_code = recorded['status_code']
+        response.reason = recorded['reason']
+        response.headers = CaseInsensitiveDict(recorded['headers'])
+        response.headers.pop('Content-Encoding', None)
+        body = _decode_body(recorded['body'])
+        # Replayed responses are also readable as a stream, for requests sent
+        # with stream=True
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        return response
+
+
+class CassetteAdapter(BaseAdapter):
+    """Transport adapter recording or replaying HTTP exchanges."""
+
+    def __init__(self, cassette, adapter, api=None):
+        """
+        Create a new instance.
+
+        :param cassette: Cassette instance.
+        :param adapter: Transport adapter to wrap.
+        :param api: Name of API the adapter is used for.
+        """
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+        self.api = api
+
+    def send(self, request, **kwargs):
+        """Send request, recording it, or replay recorded response."""
+        if self.cassette.mode == 'replay':
+            logging.debug(f'Replaying {request.method} {request.url}')
+            return self.cassette.replay(request, self)
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record(request, response, self.api)
+        return response
+
+    def close(self):
+        """Close wrapped adapter."""
+        self.adapter.close()
@@ -20,13 +20,23 @@ It can be used as a handy facility for running the task from a command line.
 """
 import logging
 import click
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from functools import partial
+import bisect
 import calendar
+import csv
+import difflib
 import json
+import os
+import threading
 from .__init__ import __version__
+from .aggregate import Aggregator, GROUP_BY
+from .cache import FileCache
 
-from .toggl import TogglAPI
-from .dinero import DineroAPI
+# Note: TogglAPI and DineroAPI (and thereby togglwrapper, requests and
+# requests_oauthlib) are imported only when needed, so that commands like
+# `version` and `--help` start fast.
 
 LOGGING_LEVELS = {
     0: logging.NOTSET,
@@ -43,6 +53,11 @@ class Info(object):
     def __init__(self):  # Note: This object must have an empty constructor.
         """Create a new instance."""
         self.verbose: int = 0
+        self.cache: FileCache = None
+        self.cassette = None
+        self.metrics = None
+        self.rate_limits = {}
+        self.ledger = None
 
 
 # pass_info is a decorator for functions that pass 'Info' objects.
@@ -54,8 +69,36 @@ pass_info = click.make_pass_decorator(Info, ensure=True)
 # tasks).
 @click.group(name='toggl-dinero')
 @click.option("--verbose", "-v", count=True, help="Enable verbose output.")
+@click.option('--cache-dir', envvar='TOGGL_DINERO_CACHE_DIR',
+              type=click.Path(file_okay=False),
+              help='Directory for caching data between runs.')
+@click.option('--refresh', default=False, is_flag=True,
+              help='Ignore previously cached data.')
+@click.option('--no-cache', default=False, is_flag=True,
+              help='Disable caching, even if a cache directory is set.')
+@click.option('--record', type=click.Path(file_okay=False),
+              help='Record all HTTP requests and responses to directory.')
+@click.option('--replay', type=click.Path(exists=True, file_okay=False),
+              help='Replay HTTP responses recorded with --record, instead of '
+              'sending requests.')
+@click.option('--metrics-file', type=click.Path(dir_okay=False),
+              help='Write HTTP request metrics to file at exit.')
+@click.option('--metrics-format', type=click.Choice(['json', 'prometheus']),
+              default='json', show_default=True,
+              help='Format of --metrics-file.')
+@click.option('--toggl-rate', type=click.FloatRange(min=0, clamp=False),
+              metavar='N', help='Maximum number of Toggl requests per second.')
+@click.option('--dinero-rate', type=click.FloatRange(min=0, clamp=False),
+              metavar='N',
+              help='Maximum number of Dinero requests per second.')
+@click.option('--ledger', 'ledger_path', envvar='TOGGL_DINERO_LEDGER',
+              type=click.Path(dir_okay=False),
+              help='SQLite database recording invoiced time and lines.')
 @pass_info
-def cli(info: Info, verbose: int):
+def cli(info: Info, verbose: int, cache_dir: str, refresh: bool,
+        no_cache: bool, record: str, replay: str, metrics_file: str,
+        metrics_format: str, toggl_rate: float, dinero_rate: float,
+        ledger_path: str):
     """Run toggl-dinero."""
     # Use the verbosity count to determine the logging level...
     if verbose > 0:
@@ -72,6 +115,55 @@ def cli(info: Info, verbose: int):
             )
         )
     info.verbose = verbose
+    if cache_dir and not no_cache:
+        info.cache = FileCache(cache_dir, refresh=refresh)
+    if record and replay:
+        raise click.UsageError('--record and --replay are mutually exclusive')
+    if record or replay:
+        from .cassette import Cassette
+        info.cassette = Cassette(record or replay,
+                                 'record' if record else 'replay')
+    if metrics_file:
+        from .metrics import Metrics
+        info.metrics = Metrics()
+        click.get_current_context().call_on_close(
+            partial(info.metrics.write, metrics_file, metrics_format))
+    for api, rate in [('toggl', toggl_rate), ('dinero', dinero_rate)]:
+        if rate:
+            from .ratelimit import TokenBucket
+            info.rate_limits[api] = TokenBucket(rate, metrics=info.metrics,
+                                                api=api)
+    if ledger_path:
+        from .ledger import Ledger
+        info.ledger = Ledger(ledger_path)
+        click.get_current_context().call_on_close(info.ledger.close)
+
+
+def setup_session(info, session, api):
+    """Set up HTTP session of Toggl or Dinero API as configured by CLI."""
+    if info.cassette is not None:
+        info.cassette.install(session, api)
+    if info.metrics is not None:
+        info.metrics.install(session, api)
+    # Rate limit outermost, so queue time is not counted as request latency
+    if api in info.rate_limits:
+        info.rate_limits[api].install(session)
+
+
+def make_toggl(info, api_token, jobs=1):
+    """Create TogglAPI instance configured from CLI options."""
+    from .toggl import TogglAPI
+    # Each job needs a couple of concurrent connections (see invoice_client)
+    return TogglAPI(api_token, pool_size=max(10, 2 * jobs), cache=info.cache,
+                    session_hook=partial(setup_session, info))
+
+
+def make_dinero(info, client_id, client_secret, api_key, organization):
+    """Create DineroAPI instance configured from CLI options."""
+    from .dinero import DineroAPI
+    return DineroAPI(client_id, client_secret, api_key, organization,
+                     cache=info.cache,
+                     session_hook=partial(setup_session, info))
 
 
 @cli.command()
@@ -120,41 +212,432 @@ def since_until(period):
         return start_of_year, end_of_year
 
 
+PERIODS = ['today', 'yesterday',
+           'this-week', 'last-week',
+           'this-month', 'last-month',
+           'this-year', 'last-year']
+
+
+def _options(*decorators):
+    """Combine a list of click decorators into a single decorator."""
+    def apply(f):
+        for decorator in reversed(decorators):
+            f = decorator(f)
+        return f
+    return apply
+
+
+class WorkspaceType(click.types.StringParamType):
+    """Toggl workspace name, separated by ',' when given in environment."""
+
+    name = 'workspace'
+    envvar_list_splitter = ','
+
+
+def _require_cache(ctx, param, value):
+    """Check that an option requiring the cache is only used with a cache."""
+    if value and ctx.find_object(Info).cache is None:
+        raise click.BadParameter('requires --cache-dir', ctx, param)
+    return value
+
+
+def _check_pdf_name(ctx, param, value):
+    """Check that PDF file name template only uses known fields."""
+    if value is not None:
+        try:
+            value.format(client='', workspace_id=0, since='', until='')
+        except (KeyError, IndexError, ValueError) as e:
+            raise click.BadParameter(f'invalid template: {e}', ctx, param)
+    return value
+
+
+dinero_options = _options(
+    click.option('--dinero-client-id', envvar='DINERO_CLIENT_ID'),
+    click.option('--dinero-client-secret', envvar='DINERO_CLIENT_SECRET'),
+    click.option('--dinero-api-key', envvar='DINERO_API_KEY'),
+    click.option('--dinero-organization', envvar='DINERO_ORGANIZATION'),
+)
+
+report_options = _options(
+    click.option('--toggl-api-token', envvar='TOGGL_API_TOKEN'),
+    click.option('--workspace', 'workspaces', envvar='TOGGL_WORKSPACE',
+                 type=WorkspaceType(), multiple=True,
+                 help='Toggl workspace name (repeat to merge time from '
+                 'several workspaces, or use "all").'),
+    click.option('--billable', type=click.Choice(['yes', 'no', 'both']),
+                 default='yes'),
+    click.option('--rounding/--no-rounding', default=True, is_flag=True),
+    click.option('--display-hours', type=click.Choice(['decimal', 'minutes']),
+                 default='decimal'),
+    click.option('--language', type=click.Choice(['da', 'en']),
+                 default='da'),
+    click.option('--toggl-user-email', envvar='TOGGL_USER_EMAIL'),
+    dinero_options,
+    click.option('--detailed', default=False, is_flag=True,
+                 help='Build invoice from the paginated detailed report '
+                 'instead of the summary report.'),
+    click.option('--group-by', type=click.Choice(GROUP_BY),
+                 default='description',
+                 help='How to group time into invoice lines.'),
+    click.option('--incremental', default=False, is_flag=True,
+                 callback=_require_cache,
+                 help='Only fetch time entries changed since the last run '
+                 '(implies --detailed, requires --cache-dir).'),
+    click.option('--pdf-dir', type=click.Path(file_okay=False), default='.',
+                 help='Directory to save PDF reports in.'),
+    click.option('--pdf-name', callback=_check_pdf_name,
+                 help='File name template of PDF reports, using {client}, '
+                 '{workspace_id}, {since} and {until} fields.  Default is '
+                 '"{client}_report.pdf".'),
+    click.option('--no-pdf', default=False, is_flag=True,
+                 help='Do not fetch and save PDF reports.'),
+)
+
+invoice_options = _options(
+    report_options,
+    click.option('--update', default=False, is_flag=True),
+)
+
+jobs_option = click.option('--jobs', '-j', type=click.IntRange(min=1),
+                           default=4,
+                           help='Number of clients to invoice in parallel.')
+
+
 @cli.command()
 @click.argument('client')
-@click.argument('period',
-                type=click.Choice(['today', 'yesterday',
-                                   'this-week', 'last-week',
-                                   'this-month', 'last-month',
-                                   'this-year', 'last-year']),
-                default='this-month')
-@click.option('--toggl-api-token', envvar='TOGGL_API_TOKEN')
-@click.option('--workspace', envvar='TOGGL_WORKSPACE')
-@click.option('--billable', type=click.Choice(['yes', 'no', 'both']),
-              default='yes')
-@click.option('--rounding/--no-rounding', default=True, is_flag=True)
-@click.option('--display-hours', type=click.Choice(['decimal', 'minutes']),
-              default='decimal')
-@click.option('--language', type=click.Choice(['da', 'en']),
-              default='da')
-@click.option('--toggl-user-email', envvar='TOGGL_USER_EMAIL')
-@click.option('--dinero-client-id', envvar='DINERO_CLIENT_ID')
-@click.option('--dinero-client-secret', envvar='DINERO_CLIENT_SECRET')
-@click.option('--dinero-api-key', envvar='DINERO_API_KEY')
-@click.option('--dinero-organization', envvar='DINERO_ORGANIZATION')
-@click.option('--update', default=False, is_flag=True)
-def invoice(client, period, toggl_api_token, workspace,
+@click.argument('period', type=click.Choice(PERIODS), required=False)
+@invoice_options
+@click.option('--from', 'from_', metavar='YYYY-MM[-DD]',
+              help='Start of range to invoice (instead of PERIOD).')
+@click.option('--to', metavar='YYYY-MM[-DD]',
+              help='End of range to invoice (instead of PERIOD).')
+@click.option('--per', type=click.Choice(['week', 'month', 'year']),
+              default='month', show_default=True,
+              help='Create an invoice per week, month or year of range.')
+@pass_info
+def invoice(info, client, period, toggl_api_token, workspaces,
             billable, rounding, display_hours, language,
             toggl_user_email, dinero_client_id, dinero_client_secret,
-            dinero_api_key, dinero_organization, update):
-    """CLI invoice sub-command."""
-    toggl = TogglAPI(toggl_api_token)
-    client_id = toggl.client_id(client)
-    workspace_id = toggl.workspace_id(workspace)
-    since, until = since_until(period)
+            dinero_api_key, dinero_organization, update, detailed,
+            group_by, incremental, pdf_dir, pdf_name, no_pdf, from_, to,
+            per):
+    """CLI invoice sub-command.
+
+    PERIOD defaults to this-month.  Use --from and --to instead to invoice a
+    range of months or dates, creating an invoice per week, month or year of
+    the range (see --per).
+    """
+    if not (from_ or to):
+        per = None
+        period = period or 'this-month'
+    else:
+        if not (from_ and to):
+            raise click.UsageError('Both --from and --to must be given')
+        if period is not None:
+            raise click.UsageError('PERIOD cannot be given with --from/--to')
+        if update:
+            raise click.UsageError('--update is not supported with --from')
+        period = (parse_month_or_date(from_), parse_month_or_date(to, True))
+        if period[0] > period[1]:
+            raise click.UsageError('--from is after --to')
+    toggl = make_toggl(info, toggl_api_token)
+    # Run independent Toggl and Dinero requests concurrently.  Dinero login
+    # does not depend on Toggl at all, and contact lookup only depends on the
+    # Toggl client IDs, so it runs while the Toggl reports are downloaded.
+    # The clients of all workspaces are fetched while the workspaces are
+    # resolved, and filtered by workspace afterwards.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dinero = executor.submit(make_dinero, info, dinero_client_id,
+                                 dinero_client_secret, dinero_api_key,
+                                 dinero_organization)
+        clients = executor.submit(toggl.clients)
+        workspace_ids = toggl.workspace_ids(workspaces)
+        if not workspace_ids:
+            click.echo('Error: Could not determine Toggl workspace')
+            return False
+        clients.result()
+        client_ids = toggl.client_ids(client, workspace_ids)
+        if not client_ids:
+            click.echo(f'Error: Unknown Toggl client: {client}')
+            return False
+        user_id = None
+        if toggl_user_email is not None:
+            user_id = toggl.user_id(workspace_ids[0], toggl_user_email)
+        return invoice_client(toggl, dinero, client, client_ids, period,
+                              billable=billable, rounding=rounding,
+                              display_hours=display_hours, language=language,
+                              user_id=user_id, update=update,
+                              detailed=detailed, group_by=group_by, per=per,
+                              incremental=incremental, ledger=info.ledger,
+                              pdf=not no_pdf, pdf_dir=pdf_dir,
+                              pdf_name=pdf_name)
+
+
+@cli.command(name='invoice-batch')
+@click.argument('period', type=click.Choice(PERIODS), default='this-month')
+@invoice_options
+@jobs_option
+@pass_info
+def invoice_batch(info, period, toggl_api_token, workspaces,
+                  billable, rounding, display_hours, language,
+                  toggl_user_email, dinero_client_id, dinero_client_secret,
+                  dinero_api_key, dinero_organization, update, detailed,
+                  group_by, incremental, pdf_dir, pdf_name, no_pdf, jobs):
+    """CLI invoice-batch sub-command.
+
+    Invoice all Toggl clients linked to a Dinero contact.
+    """
+    toggl = make_toggl(info, toggl_api_token, jobs=jobs)
+    workspace_ids = toggl.workspace_ids(workspaces)
+    if not workspace_ids:
+        click.echo('Error: Could not determine Toggl workspace')
+        return False
+    user_id = None
+    if toggl_user_email is not None:
+        user_id = toggl.user_id(workspace_ids[0], toggl_user_email)
+    dinero = make_dinero(info, dinero_client_id, dinero_client_secret,
+                         dinero_api_key, dinero_organization)
+
+    clients = linked_clients(toggl, dinero, workspace_ids)
+    if not clients:
+        click.echo('Error: No Toggl clients linked to Dinero contacts')
+        return False
+    results = invoice_clients(toggl, dinero, clients, period, jobs=jobs,
+                              billable=billable, rounding=rounding,
+                              display_hours=display_hours, language=language,
+                              user_id=user_id, update=update,
+                              detailed=detailed, group_by=group_by,
+                              incremental=incremental, ledger=info.ledger,
+                              pdf=not no_pdf, pdf_dir=pdf_dir,
+                              pdf_name=pdf_name)
+
+    failed = 0
+    for name in sorted(results):
+        ok, error = results[name]
+        if ok:
+            click.echo(f'{name}: ok')
+        else:
+            failed += 1
+            reason = f' ({error})' if error is not None else ''
+            click.echo(click.style(f'{name}: failed{reason}', fg='red'))
+    click.echo(f'{len(results) - failed} succeeded, {failed} failed')
+    if failed:
+        click.get_current_context().exit(1)
+    return True
+
+
+@cli.command()
+@click.argument('period', type=click.Choice(PERIODS), default='this-month')
+@report_options
+@jobs_option
+@click.option('--interval', type=click.IntRange(min=1), default=3600,
+              show_default=True,
+              help='Seconds between refreshes of all draft invoices.')
+@click.option('--host', default='127.0.0.1', show_default=True,
+              help='Address to listen on for refresh requests.')
+@click.option('--port', type=click.IntRange(min=0), default=8080,
+              show_default=True,
+              help='Port to listen on for refresh requests.')
+@pass_info
+def serve(info, period, toggl_api_token, workspaces, billable, rounding,
+          display_hours, language, toggl_user_email, dinero_client_id,
+          dinero_client_secret, dinero_api_key, dinero_organization,
+          detailed, group_by, incremental, pdf_dir, pdf_name, no_pdf, jobs,
+          interval, host, port):
+    """CLI serve sub-command.
+
+    Keep draft invoices of all Toggl clients linked to a Dinero contact up to
+    date, refreshing them every --interval seconds.
+
+    Refreshes can also be triggered over HTTP: POST /refresh refreshes all
+    draft invoices, and POST /refresh/CLIENT the draft invoice of a single
+    client.  GET /status returns the result of the last refreshes.
+    """
+    from .serve import InvoiceService, make_server
+    toggl = make_toggl(info, toggl_api_token, jobs=jobs)
+    workspace_ids = toggl.workspace_ids(workspaces)
+    if not workspace_ids:
+        click.echo('Error: Could not determine Toggl workspace')
+        return False
+    user_id = None
+    if toggl_user_email is not None:
+        user_id = toggl.user_id(workspace_ids[0], toggl_user_email)
+    dinero = make_dinero(info, dinero_client_id, dinero_client_secret,
+                         dinero_api_key, dinero_organization)
+    service = InvoiceService(toggl, dinero, workspace_ids, period, jobs=jobs,
+                             billable=billable, rounding=rounding,
+                             display_hours=display_hours, language=language,
+                             user_id=user_id, detailed=detailed,
+                             group_by=group_by, incremental=incremental,
+                             ledger=info.ledger, pdf=not no_pdf,
+                             pdf_dir=pdf_dir, pdf_name=pdf_name)
+    server = make_server(service, host, port)
+    scheduler = threading.Thread(target=service.run_schedule,
+                                 args=(interval,), daemon=True)
+    scheduler.start()
+    click.echo(f'Serving on http://{host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+    return True
+
+
+@cli.command()
+@click.option('--client', help='Only include this Toggl client.')
+@click.option('--from', 'from_', metavar='YYYY-MM[-DD]',
+              help='Only include periods starting on or after this date.')
+@click.option('--to', metavar='YYYY-MM[-DD]',
+              help='Only include periods ending on or before this date.')
+@click.option('--by', type=click.Choice(['client', 'project', 'user',
+                                         'period']),
+              default='client', show_default=True,
+              help='How to group the summary.')
+@click.option('--invoiced', default=False, is_flag=True,
+              help='Summarize lines sent to Dinero, instead of time fetched '
+              'from Toggl.')
+@pass_info
+def query(info, client, from_, to, by, invoiced):
+    """CLI query sub-command.
+
+    Summarize hours and amounts recorded in the --ledger database, without
+    contacting Toggl or Dinero.
+    """
+    if info.ledger is None:
+        raise click.UsageError('--ledger is required')
+    since = parse_month_or_date(from_) if from_ else None
+    until = parse_month_or_date(to, True) if to else None
+    try:
+        rows = info.ledger.summary(by, client=client, since=since,
+                                   until=until, invoiced=invoiced)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for group, currency, hours, amount in rows:
+        click.echo(f'{group}\t{hours:.2f} hours\t{amount:.2f} {currency}')
+    return True
+
+
+def linked_clients(toggl, dinero, workspace_ids):
+    """
+    Get Toggl clients linked to Dinero contacts.
+
+    Clients in different workspaces linked to the same Dinero contact are
+    merged, so that they are invoiced together.
+
+    :param toggl: TogglAPI instance.
+    :param dinero: DineroAPI instance.
+    :param workspace_ids: List of Toggl workspace IDs.
+    :return: Dictionary mapping Dinero contact ID to tuple of Toggl client
+             name and dictionary mapping workspace ID to client ID.
+    """
+    linked = dinero.contacts_with_external_reference('toggl')
+    clients = {}
+    for c in toggl.clients():
+        if c['id'] in linked and c.get('wid') in workspace_ids:
+            name, ids = clients.setdefault(linked[c['id']], (c['name'], {}))
+            ids.setdefault(c['wid'], c['id'])
+    return clients
+
+
+def invoice_clients(toggl, dinero, clients, period, jobs=4, update=False,
+                    **kwargs):
+    """
+    Create or update Dinero invoices for a number of Toggl clients.
+
+    :param toggl: TogglAPI instance.
+    :param dinero: DineroAPI instance.
+    :param clients: Clients to invoice, as returned by :func:`linked_clients`.
+    :param period: Period to invoice (see :func:`invoice_client`).
+    :param jobs: Number of clients to invoice in parallel.
+    :param update: Update existing draft invoices instead of creating new.
+    :param kwargs: Additional arguments for :func:`invoice_client`.
+    :return: Dictionary mapping client name to tuple of success (bool) and
+             exception (or None).
+    """
+    # List all draft invoices once, instead of once per client
+    drafts = dinero.draft_invoices() if update else None
+
+    def invoice_one(contact, name, client_ids):
+        return invoice_client(toggl, dinero, name, client_ids, period,
+                              update=update, contact=contact, drafts=drafts,
+                              **kwargs)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(invoice_one, contact, name, ids): name
+                   for contact, (name, ids) in clients.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = (bool(future.result()), None)
+            except Exception as e:
+                logging.exception(f'Invoicing {name} failed')
+                results[name] = (False, e)
+    return results
+
+
+def _result(value):
+    """Get result of value if it is a Future, or else the value itself."""
+    if isinstance(value, Future):
+        return value.result()
+    return value
+
+
+def invoice_client(toggl, dinero, client, workspaces, period,
+                   billable='yes', rounding=True, display_hours='decimal',
+                   language='da', user_id=None, update=False, contact=None,
+                   detailed=False, group_by='description', per=None,
+                   drafts=None, incremental=False, ledger=None, pdf=True,
+                   pdf_dir='.', pdf_name=None):
+    """
+    Create or update Dinero invoice for a Toggl client.
+
+    The client can be tracked in several Toggl workspaces, in which case the
+    reports of all workspaces are merged into a single invoice.
+
+    :param toggl: TogglAPI instance.
+    :param dinero: DineroAPI instance (or Future of it).
+    :param client: Toggl client name.
+    :param workspaces: Dictionary mapping Toggl workspace ID to the ID of the
+                       client in that workspace.
+    :param period: Name of period to invoice (see :func:`since_until`), or
+                   tuple of start and end date.
+    :param user_id: Only include time entries of this Toggl user ID.
+    :param update: Update existing draft invoice instead of creating a new.
+    :param contact: Dinero contact ID (or Future of it).  Looked up from
+                    ExternalReference when not given.
+    :param detailed: Use detailed report instead of summary report.
+    :param group_by: How to group time into invoice lines (see
+                     :class:`~toggl_dinero.aggregate.Aggregator`).
+    :param per: Create an invoice per 'week', 'month' or 'year' of period
+                (see :func:`split_period`), instead of a single invoice.
+                Implies detailed.  Periods longer than a year are fetched
+                (and PDF reports saved) per calendar year.  The invoices are
+                dated at the end of each period.
+    :param drafts: Draft invoices from :meth:`DineroAPI.draft_invoices` (or
+                   Future of it), for looking up the draft invoice to update.
+    :param incremental: Use detailed report synced incrementally with the
+                        cache (see :meth:`TogglAPI.synced_detailed_report`).
+                        Implies detailed.
+    :param ledger: Ledger instance to record report items and invoice lines
+                   in.
+    :param pdf: Save summary report PDF for each workspace.
+    :param pdf_dir: Directory to save PDF reports in.
+    :param pdf_name: File name template of PDF reports, with {client},
+                     {workspace_id}, {since} and {until} fields.  When
+                     invoicing several workspaces, and the template has no
+                     {workspace_id} field, it is added to the name.  The same
+                     goes for {since}, when saving a PDF report per year.
+    :return: True on success, False otherwise.
+    """
+    if isinstance(period, str):
+        since, until = since_until(period)
+    else:
+        since, until = period
     data = {
-        'workspace_id': workspace_id,
-        'client_ids': client_id,
         'since': since.strftime('%Y-%m-%d'),
         'until': until.strftime('%Y-%m-%d'),
         'billable': billable,
@@ -162,16 +645,209 @@ def invoice(client, period, toggl_api_token, workspace,
         'display_hours': display_hours,
     }
 
-    if toggl_user_email is not None:
-        user_id = toggl.user_id(workspace_id, toggl_user_email)
+    if user_id is not None:
         data['user_ids'] = user_id
 
-    report = toggl.summary_report(data)
-    pdf_report = toggl.summary_report_pdf(data)
-    with open(f'{client}_report.pdf', mode='wb') as f:
-        f.write(pdf_report)
+    detailed = detailed or incremental
+    if group_by == 'user' and not detailed:
+        data['subgrouping'] = 'users'
+
+    # Toggl reports span at most one year, so longer ranges are fetched a
+    # calendar year at a time
+    if per is None:
+        chunks = [(since, until)]
+    else:
+        chunks = split_period(since, until, 'year')
+    params = [dict(data, since=start.strftime('%Y-%m-%d'),
+                   until=end.strftime('%Y-%m-%d'),
+                   workspace_id=workspace_id, client_ids=client_id)
+              for start, end in chunks
+              for workspace_id, client_id in workspaces.items()]
+
+    def write_pdf_report(params):
+        if pdf_name is not None:
+            name = pdf_name
+        elif len(workspaces) == 1:
+            name = '{client}_report.pdf'
+        else:
+            name = '{client}_{workspace_id}_report.pdf'
+        if len(workspaces) > 1 and '{workspace_id}' not in name:
+            root, ext = os.path.splitext(name)
+            name = f'{root}_{{workspace_id}}{ext}'
+        if len(chunks) > 1 and '{since}' not in name:
+            root, ext = os.path.splitext(name)
+            name = f'{root}_{{since}}{ext}'
+        filename = name.format(client=client,
+                               workspace_id=params['workspace_id'],
+                               since=params['since'], until=params['until'])
+        os.makedirs(pdf_dir, exist_ok=True)
+        toggl.summary_report_pdf(dict(params),
+                                 path=os.path.join(pdf_dir, filename))
+
+    def lookup_contact():
+        for client_id in workspaces.values():
+            contact = _result(dinero).contact_with_external_reference(
+                'toggl', client_id)
+            if contact:
+                return contact
+        return None
+
+    def get_draft_invoice():
+        if not _result(contact):
+            return None
+        return _result(dinero).get_draft_invoice(_result(contact),
+                                                 _result(drafts))
+
+    if incremental:
+        detailed_report = toggl.synced_detailed_report
+    else:
+        detailed_report = toggl.detailed_report
+    if per is None:
+        periods = [(since, until)]
+    else:
+        periods = split_period(since, until, per)
+    items = [[] for _ in periods]
+    aggregators = [Aggregator(group_by,
+                              observer=i.append if ledger else None)
+                   for i in items]
+    # Fetch PDF reports (and look up contact and draft invoice) while
+    # fetching the JSON reports
+    with ThreadPoolExecutor(max_workers=2 * len(params) + 2) as executor:
+        pdfs_written = [executor.submit(write_pdf_report, p)
+                        for p in params if pdf]
+        if contact is None:
+            contact = executor.submit(lookup_contact)
+        if update:
+            invoice = executor.submit(get_draft_invoice)
+        try:
+            if per is not None:
+                # Split time entries of all periods from a single report
+                starts = [start.strftime('%Y-%m-%d') for start, _ in periods]
+                for p in params:
+                    for entry in detailed_report(dict(p)):
+                        idx = bisect.bisect_right(starts,
+                                                  entry['start'][:10]) - 1
+                        aggregators[max(idx, 0)].add_time_entries([entry])
+            elif detailed:
+                for p in params:
+                    aggregators[0].add_time_entries(
+                        detailed_report(dict(p)))
+            else:
+                reports = [executor.submit(toggl.summary_report, dict(p))
+                           for p in params]
+                for report in reports:
+                    aggregators[0].add_summary_report(report.result())
+        except ValueError as e:
+            # Time in different currencies cannot be merged into one invoice
+            click.echo(f'Error: {client}: {e}')
+            return False
+        for pdf_written in pdfs_written:
+            pdf_written.result()
+    if ledger is not None:
+        for (start, end), period_items in zip(periods, items):
+            if per is None or period_items:
+                ledger.record_items(client, start, end, period_items)
+
+    dinero = _result(dinero)
+    contact = _result(contact)
+    if not contact:
+        client_ids = ', '.join(f'{i}' for i in workspaces.values())
+        click.echo(f'Error: Could not find linked Dinero contact: '
+                   f'{client_ids}')
+        return False
+    for (start, end), aggregator in zip(periods, aggregators):
+        if per is not None and not aggregator.total_ms:
+            continue
+        invoice_lines = make_invoice_lines(aggregator, start, end, language)
+        if update:
+            invoice = invoice.result()
+            if not invoice:
+                click.echo('Error: Could not determine invoice to update')
+                return False
+            if not update_product_lines(invoice, invoice_lines):
+                click.echo(f'{client}: Draft invoice is up to date')
+                continue
+            sent = dinero.update_invoice(invoice) and invoice['Guid']
+        else:
+            # Invoices for past periods are dated at the end of the period
+            invoice_date = None
+            if per is not None:
+                invoice_date = end.strftime('%Y-%m-%d')
+            sent = dinero.create_invoice(contact, invoice_lines,
+                                         currency=aggregator.currency,
+                                         language=language,
+                                         date=invoice_date)
+        if ledger is not None and sent:
+            ledger.record_invoice_lines(client, start, end, invoice_lines,
+                                        contact=contact, invoice=sent,
+                                        currency=aggregator.currency)
+    return True
+
+
+def split_period(since, until, per):
+    """
+    Split period into weeks, months or years.
+
+    The first and last period are cut to the start and end of the period.
+
+    :param since: Start date of period.
+    :param until: End date of period.
+    :param per: Either 'week', 'month' or 'year'.
+    :return: List of (start, end) date tuples.
+    """
+    periods = []
+    start = since
+    while start <= until:
+        if per == 'week':
+            end = start + timedelta(days=6 - start.weekday())
+        elif per == 'month':
+            end = start.replace(
+                day=calendar.monthrange(start.year, start.month)[1])
+        elif per == 'year':
+            end = start.replace(month=12, day=31)
+        else:
+            raise ValueError(f'Unsupported period split: {per}')
+        end = min(end, until)
+        periods.append((start, end))
+        start = end + timedelta(days=1)
+    return periods
+
+
+def parse_month_or_date(value, end=False):
+    """
+    Parse date given as YYYY-MM-DD or YYYY-MM.
 
-    invoice_currency = None
+    :param value: Date string.
+    :param end: Use last day of month for YYYY-MM dates, instead of first.
+    :return: date
+    """
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        pass
+    try:
+        month = datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise click.BadParameter(f'Invalid date (use YYYY-MM[-DD]): {value}')
+    if end:
+        return month.replace(
+            day=calendar.monthrange(month.year, month.month)[1])
+    return month
+
+
+def make_invoice_lines(aggregator, since, until, language='da'):
+    """
+    Make invoice product lines for aggregated hours.
+
+    The hours lines are surrounded by a header text line with the invoiced
+    period, and a footer text line with the total hours.
+
+    :param aggregator: Aggregator instance.
+    :param since: Start date of invoiced period.
+    :param until: End date of invoiced period.
+    :param language: Language of the text lines.
+    :return: List of product lines for the invoices API.
+    """
     invoice_lines = []
     period = f"{since.strftime('%Y-%m-%d')} - {until.strftime('%Y-%m-%d')}"
     if language == 'da':
@@ -180,64 +856,52 @@ def invoice(client, period, toggl_api_token, workspace,
         header = f'Consultancy services: {period}'
     invoice_lines.append({'Description': header, 'LineType': 'Text'})
 
-    total_hours = 0
-    for project in report['data']:
-        project_name = project['title']['project']
-        assert len(project['total_currencies']) == 1
-        currency = project['total_currencies'][0]['currency']
-        if invoice_currency is None:
-            invoice_currency = currency
-        else:
-            assert currency == invoice_currency
-
-        for item in project['items']:
-            assert item['cur'] == currency
-            rate = item['rate']
-            ms = item['time']
-            hours = ms / (1000 * 60 * 60)
-            # round to 2 decimals
-            hours = int((hours * 100) + 0.5) / 100
-            total_hours += hours
-            description = item['title']['time_entry']
-            invoice_lines.append({
-                'Description': f"{project_name}: {description}",
-                'AccountNumber': 1000,
-                'Quantity': hours,
-                'Unit': 'hours',
-                'BaseAmountValue': rate,
-            })
-        total_hours = int((total_hours * 100) + 0.5) / 100
+    for line in aggregator.lines():
+        invoice_lines.append({
+            'Description': line.description,
+            'AccountNumber': 1000,
+            'Quantity': line.centihours / 100,
+            'Unit': 'hours',
+            'BaseAmountValue': line.rate,
+        })
 
+    total_hours = aggregator.total_centihours / 100
     if language == 'da':
-        header = f'I alt: {total_hours} timer'
+        footer = f'I alt: {total_hours} timer'
     else:
-        header = f'Total: {total_hours} hours'
-    invoice_lines.append({'Description': header, 'LineType': 'Text'})
+        footer = f'Total: {total_hours} hours'
+    invoice_lines.append({'Description': footer, 'LineType': 'Text'})
+    return invoice_lines
 
-    dinero = DineroAPI(dinero_client_id, dinero_client_secret, dinero_api_key,
-                       dinero_organization)
 
-    contact = dinero.contact_with_external_reference('toggl', client_id)
-    if not contact:
-        click.echo(f'Error: Could not find linked Dinero contact: {client_id}')
-        return False
-    if update:
-        invoice = dinero.get_draft_invoice(contact)
-        if not invoice:
-            click.echo('Error: Could not determine invoice to update')
-            return False
-        update_product_lines(invoice, invoice_lines)
-        dinero.update_invoice(invoice)
-    else:
-        dinero.create_invoice(contact, invoice_lines,
-                              currency=invoice_currency, language=language)
+def _line_key(line):
+    """Get the invoice line fields set by toggl-dinero, for comparison."""
+    if line.get('LineType') == 'Text':
+        return ('Text', line.get('Description'))
+    return ('Product', line.get('Description'), line.get('Quantity'),
+            line.get('Unit'), line.get('BaseAmountValue'),
+            line.get('AccountNumber'))
 
 
 def update_product_lines(invoice, invoice_lines):
-    """Update invoice with new hours product lines."""
+    """
+    Update invoice with new hours product lines.
+
+    The hours lines (from header to footer text line) already on the invoice
+    are compared with the new lines, looking only at the fields set by
+    toggl-dinero.  If nothing changed, the invoice is left untouched.
+    Otherwise, only the lines that differ are replaced, so unchanged lines
+    are kept as is.
+
+    :param invoice: Invoice data.
+    :param invoice_lines: New hours product lines (see
+                          :func:`make_invoice_lines`).
+    :return: True if invoice was changed, False otherwise.
+    """
 
-    def matching_text_line(lines, prefixes):
-        for idx, line in enumerate(lines):
+    def matching_text_line(lines, prefixes, start=0):
+        for idx in range(start, len(lines)):
+            line = lines[idx]
             if line['LineType'] != 'Text':
                 continue
             for prefix in prefixes:
@@ -245,53 +909,149 @@ def update_product_lines(invoice, invoice_lines):
                     return idx
         return None
 
-    header_idx = matching_text_line(invoice['ProductLines'],
-                                    ['Konsulent ydelser: ',
-                                     'Consultancy services: '])
-    if header_idx is not None:
-        footer_idx = matching_text_line(
-            invoice['ProductLines'][header_idx + 1:],
-            ['I alt: ', 'Total: '])
-        if footer_idx:
-            print(f'{header_idx} - {footer_idx}')
-            invoice['ProductLines'] = invoice['ProductLines'][:header_idx] \
-                + invoice_lines \
-                + invoice['ProductLines'][header_idx + footer_idx + 2:]
+    lines = invoice['ProductLines']
+    header_idx = matching_text_line(lines, ['Konsulent ydelser: ',
+                                            'Consultancy services: '])
+    if header_idx is None:
+        invoice['ProductLines'] = lines + invoice_lines
+        return True
+    footer_idx = matching_text_line(lines, ['I alt: ', 'Total: '],
+                                    start=header_idx + 1)
+    if footer_idx is None:
+        click.echo('Warning: Could not find matching footer line')
+        invoice['ProductLines'] = lines + invoice_lines
+        return True
+
+    old_lines = lines[header_idx:footer_idx + 1]
+    old_keys = [_line_key(line) for line in old_lines]
+    new_keys = [_line_key(line) for line in invoice_lines]
+    if old_keys == new_keys:
+        return False
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys,
+                                      autojunk=False)
+    new_block = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            new_block += old_lines[i1:i2]
         else:
-            click.echo('Warning: Could not find matching footer line')
-            invoice['ProductLines'] += invoice_lines
-    else:
-        invoice['ProductLines'] += invoice_lines
+            new_block += invoice_lines[j1:j2]
+    invoice['ProductLines'] = \
+        lines[:header_idx] + new_block + lines[footer_idx + 1:]
+    return True
+
+
+#: Optional header line of link --from-file CSV files
+LINK_HEADER = ('toggl_client', 'dinero_contact')
 
 
 @cli.command()
-@click.argument('toggl-client')
-@click.argument('dinero-contact')
+@click.argument('toggl-client', required=False)
+@click.argument('dinero-contact', required=False)
 @click.option('--toggl-api-token', envvar='TOGGL_API_TOKEN')
-@click.option('--dinero-client-id', envvar='DINERO_CLIENT_ID')
-@click.option('--dinero-client-secret', envvar='DINERO_CLIENT_SECRET')
-@click.option('--dinero-api-key', envvar='DINERO_API_KEY')
-@click.option('--dinero-organization', envvar='DINERO_ORGANIZATION')
-def link(toggl_client, dinero_contact,
+@dinero_options
+@click.option('--from-file', type=click.File('r', encoding='utf-8'),
+              help='CSV file with a Toggl client and a Dinero contact name '
+              'per line, to link many clients at once.  An optional '
+              '"toggl_client,dinero_contact" header line is skipped.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=4,
+              help='Number of contacts to update in parallel.')
+@pass_info
+def link(info, toggl_client, dinero_contact,
          toggl_api_token,
          dinero_client_id, dinero_client_secret,
-         dinero_api_key, dinero_organization):
-    """CLI link sub-command."""
-    toggl = TogglAPI(toggl_api_token)
-    dinero = DineroAPI(dinero_client_id, dinero_client_secret, dinero_api_key,
-                       dinero_organization)
-    client_id = toggl.client_id(toggl_client)
-    if not client_id:
-        click.echo(f'Error: Toggl client not found: {toggl_client}')
-    contact_id = dinero.contact_id(dinero_contact)
-    if not contact_id:
-        click.echo(f'Error: Dinero contact not found: {dinero_contact}')
-    contact = dinero.get_contact(contact_id).json()
-    extref = contact.get('ExternalReference')
-    if extref is not None:
-        extref = json.loads(extref)
+         dinero_api_key, dinero_organization, from_file, jobs):
+    """CLI link sub-command.
+
+    Link TOGGL_CLIENT to DINERO_CONTACT, or all pairs listed in the
+    --from-file CSV file.
+    """
+    if from_file is not None:
+        if toggl_client or dinero_contact:
+            raise click.UsageError('TOGGL_CLIENT and DINERO_CONTACT cannot be '
+                                   'used with --from-file')
+        pairs = [tuple(field.strip() for field in row[:2])
+                 for row in csv.reader(from_file) if row]
+        if pairs and tuple(f.casefold() for f in pairs[0]) == LINK_HEADER:
+            del pairs[0]
+        if any(len(pair) < 2 for pair in pairs):
+            raise click.UsageError(f'{from_file.name}: expected two columns')
+    elif toggl_client and dinero_contact:
+        pairs = [(toggl_client, dinero_contact)]
     else:
-        extref = {}
-    extref['toggl'] = client_id
-    contact['ExternalReference'] = json.dumps(extref)
-    dinero.update_contact(contact_id, contact)
+        raise click.UsageError('Missing TOGGL_CLIENT and DINERO_CONTACT, or '
+                               '--from-file')
+    toggl = make_toggl(info, toggl_api_token)
+    dinero = make_dinero(info, dinero_client_id, dinero_client_secret,
+                         dinero_api_key, dinero_organization)
+    results = link_clients(toggl, dinero, pairs, jobs=jobs)
+    if from_file is None:
+        return results[pairs[0]] != 'failed'
+    counts = {status: 0 for status in ('linked', 'unchanged', 'failed')}
+    for status in results.values():
+        counts[status] += 1
+    click.echo(f"{counts['linked']} linked, {counts['unchanged']} already "
+               f"linked, {counts['failed']} failed")
+    if counts['failed']:
+        click.get_current_context().exit(1)
+    return True
+
+
+def link_clients(toggl, dinero, pairs, jobs=4):
+    """
+    Link Toggl clients to Dinero contacts.
+
+    All names are resolved from the Toggl client index and the Dinero contact
+    index, each fetched in a single sweep.  Contacts that are already linked
+    to the client are skipped, and the rest are updated in parallel.
+
+    :param toggl: TogglAPI instance.
+    :param dinero: DineroAPI instance.
+    :param pairs: List of (Toggl client name, Dinero contact name) tuples.
+    :param jobs: Number of contacts to update in parallel.
+    :return: Dictionary mapping pairs to 'linked', 'unchanged' or 'failed'.
+    """
+    results = {}
+    todo = []
+    for pair in pairs:
+        toggl_client, dinero_contact = pair
+        client_id = toggl.client_id(toggl_client)
+        if not client_id:
+            click.echo(f'Error: Toggl client not found: {toggl_client}')
+            results[pair] = 'failed'
+            continue
+        contact_id = dinero.contact_id(dinero_contact)
+        if not contact_id:
+            click.echo(f'Error: Dinero contact not found: {dinero_contact}')
+            results[pair] = 'failed'
+            continue
+        if dinero.contact_with_external_reference('toggl',
+                                                  client_id) == contact_id:
+            results[pair] = 'unchanged'
+            continue
+        todo.append((pair, client_id, contact_id))
+
+    def link_one(client_id, contact_id):
+        contact = dinero.get_contact(contact_id).json()
+        extref = contact.get('ExternalReference')
+        if extref is not None:
+            extref = json.loads(extref)
+        else:
+            extref = {}
+        extref['toggl'] = client_id
+        contact['ExternalReference'] = json.dumps(extref)
+        return dinero.update_contact(contact_id, contact, store=False)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(link_one, client_id, contact_id): pair
+                   for pair, client_id, contact_id in todo}
+        for future in as_completed(futures):
+            pair = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                click.echo(f'Error: {pair[0]}: {e}')
+                ok = False
+            results[pair] = 'linked' if ok else 'failed'
+    if todo:
+        dinero.store_contact_index()
+    return results
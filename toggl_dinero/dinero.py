@@ -2,8 +2,12 @@
 
 from oauthlib.oauth2 import LegacyApplicationClient
 from requests_oauthlib import OAuth2Session
+from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
+import threading
+import time
+from .cache import cache_key
 
 # Dinero invoice creation procedure
 #
@@ -29,13 +33,278 @@ import logging
 DINERO_TOKEN_URL = 'https://authz.dinero.dk/dineroapi/oauth/token'
 
 
-class DineroAPI:
-    """A connection object for accessing Dinero API."""
+def _parse_external_reference(contact):
+    """Parse ExternalReference JSON object of contact, if any."""
+    extref = contact.get('ExternalReference')
+    if extref is None:
+        return None
+    try:
+        extref = json.loads(extref)
+    except Exception as e:
+        logging.warn(f'Bad ExternalReference value: {e}: {extref}')
+        return None
+    if not isinstance(extref, dict):
+        return None
+    return extref
+
+
+class ContactIndex:
+    """Index of contacts by name and ExternalReference key/value pairs."""
+
+    FIELDS = 'name,contactGuid,ExternalReference'
+
+    def __init__(self, contacts=()):
+        """
+        Create a new instance.
+
+        :param contacts: Contact data, with the fields listed in FIELDS.
+        """
+        self.contacts = {}
+        self.names = {}
+        self.external_references = {}
+        # Lookup keys of each contact, and contacts of each lookup key (in
+        # the order added), so single contacts can be removed
+        self._keys = {}
+        self._guids = {}
+        for contact in contacts:
+            self.add(contact)
+
+    def _lookups(self, kind):
+        return self.names if kind == 'name' else self.external_references
+
+    def add(self, contact):
+        """Add or replace contact in index."""
+        guid = contact['contactGuid']
+        if guid in self.contacts:
+            self.remove(guid)
+        self.contacts[guid] = contact
+        keys = [('name', contact['name'])]
+        for key, value in (_parse_external_reference(contact) or {}).items():
+            try:
+                hash(value)
+            except TypeError:
+                # Unhashable values (lists and objects) cannot be looked up
+                continue
+            keys.append(('extref', (key, value)))
+        self._keys[guid] = keys
+        for kind, key in keys:
+            self._guids.setdefault((kind, key), []).append(guid)
+            self._lookups(kind).setdefault(key, guid)
+
+    def remove(self, guid):
+        """Remove contact from index."""
+        self.contacts.pop(guid, None)
+        for kind, key in self._keys.pop(guid, ()):
+            guids = self._guids[(kind, key)]
+            guids.remove(guid)
+            lookups = self._lookups(kind)
+            # Names and references might belong to other contacts too
+            if guids:
+                lookups[key] = guids[0]
+            else:
+                del self._guids[(kind, key)]
+                del lookups[key]
+
+    def linked(self, key):
+        """Get dictionary mapping ExternalReference key values to IDs."""
+        return {v: guid for (k, v), guid in self.external_references.items()
+                if k == key}
+
+
+class _DineroBase:
+    """
+    Dinero API logic shared by :class:`DineroAPI` and its asyncio
+    counterpart, leaving only the sending of requests to the subclasses.
+    """
 
     API_URL_V1 = 'https://api.dinero.dk/v1'
     API_URL_V1_2 = 'https://api.dinero.dk/v1.2'
 
-    def __init__(self, client_id, client_secret, api_key, name=None):
+    CONTACTS_TTL = 24 * 60 * 60  #: time to live of cached contact index
+    PAGE_SIZE = 1000  #: maximum page size of collection APIs
+    PAGE_JOBS = 4  #: number of collection pages fetched concurrently
+    TOKEN_EXPIRY_MARGIN = 60  #: seconds before expiry to refresh token
+
+    #: Request parameters for listing all draft invoices
+    DRAFTS_PARAMS = {'fields': 'Guid,ContactGuid,Date,Description',
+                     'statusFilter': 'Draft'}
+
+    def _token_cache_name(self):
+        return f'dinero-token-{self._cache_key}.json'
+
+    @classmethod
+    def _token_expired(cls, token):
+        expires_at = token.get('expires_at')
+        if expires_at is None:
+            return True
+        return expires_at - cls.TOKEN_EXPIRY_MARGIN < time.time()
+
+    def _load_token(self):
+        if self.cache is None:
+            return None
+        token = self.cache.load(self._token_cache_name())
+        if token is None or ('refresh_token' not in token and
+                             self._token_expired(token)):
+            return None
+        return token
+
+    def _store_token(self, token):
+        self.token = token
+        if self.cache is not None:
+            self.cache.store(self._token_cache_name(), token, private=True)
+
+    def _organizations_cache_name(self):
+        return f'dinero-organizations-{self._cache_key}.json'
+
+    def _load_organization(self, name):
+        """Get cached organization ID, or None if not cached."""
+        if self.cache is None:
+            return None
+        cached = self.cache.load(self._organizations_cache_name()) or {}
+        return cached.get(name or '')
+
+    def _select_organization(self, orgs, name):
+        """
+        Set organization from list of organizations.
+
+        :param orgs: Organizations (with name and id fields).
+        :param name: Name of organization, or None if there is only one.
+        :return: Organization ID, or None if not found.
+        """
+        organization = None
+        if name is None:
+            if len(orgs) == 1:
+                organization = orgs[0]['id']
+        else:
+            for org in orgs:
+                if org['name'] == name:
+                    organization = org['id']
+                    break
+        if organization is None:
+            return None
+        self.organization = organization
+        if self.cache is not None:
+            cache_name = self._organizations_cache_name()
+            cached = self.cache.load(cache_name) or {}
+            cached[name or ''] = organization
+            self.cache.store(cache_name, cached)
+        return organization
+
+    def _load_contact_index(self):
+        """Get cached contact index, or None if not cached."""
+        if self.cache is None:
+            return None
+        contacts = self.cache.load(self._contact_index_cache_name(),
+                                   ttl=self.CONTACTS_TTL)
+        if contacts is None:
+            return None
+        return ContactIndex(contacts)
+
+    def _index_updated_contact(self, contact, data):
+        """
+        Update contact in index, if loaded.
+
+        The caller must hold the contact index lock.
+
+        :return: True if the index was updated.
+        """
+        if self._contact_index is None:
+            return False
+        self._contact_index.add({
+            'contactGuid': contact,
+            'name': data.get('Name', data.get('name')),
+            'ExternalReference': data.get('ExternalReference'),
+        })
+        return True
+
+    @staticmethod
+    def _remaining_pages(pagination, params):
+        """
+        Get number of pages left after the first page of a collection.
+
+        ResultWithoutFilter counts all items of the collection, so for
+        filtered requests (such as draft invoices) only the filtered count
+        (ResultWithFilter) can be used.
+
+        :param pagination: Pagination data of the first page.
+        :param params: Request parameters.
+        :return: Number of pages left, or None if unknown.
+        """
+        pagesize = pagination['PageSize']
+        if pagination['Result'] < pagesize:
+            return 0
+        if any(k.endswith('Filter') for k in params):
+            total = pagination.get('ResultWithFilter')
+        else:
+            total = pagination.get('ResultWithoutFilter')
+        if total is None:
+            return None
+        return -(-total // pagesize) - 1
+
+    @staticmethod
+    def _last_page(pagination):
+        """Check if page is the last page of a collection."""
+        return pagination['Result'] < pagination['PageSize']
+
+    @staticmethod
+    def _invoice_body(contact, product_lines, language, currency, comment,
+                      date):
+        """Make request body for creating an invoice."""
+        if language == 'da':
+            language = 'da-DK'
+        elif language == 'en':
+            language = 'en-GB'
+        body = {
+            'ContactGuid': contact,
+            'Currency': currency,
+            'Language': language,
+            'Comment': comment,
+            'Date': date,
+            'ProductLines': product_lines,
+        }
+        return {k: v for (k, v) in body.items() if v is not None}
+
+    @staticmethod
+    def _index_drafts(invoices):
+        """Index draft invoices by contact (see :meth:`draft_invoices`)."""
+        drafts = {}
+        for invoice in invoices:
+            drafts.setdefault(invoice['ContactGuid'], []).append(invoice)
+        for contact, contact_invoices in drafts.items():
+            if len(contact_invoices) > 1:
+                logging.warning(f'Multiple draft invoices for contact '
+                                f'{contact}')
+        return drafts
+
+    @staticmethod
+    def _contact_drafts_params(contact):
+        """Get request parameters for listing draft invoices of contact."""
+        return {'fields': "Guid,Date,Description",
+                'statusFilter': 'Draft',
+                'queryFilter': f"ContactGuid eq '{contact}'"}
+
+    @staticmethod
+    def _single_draft(invoices):
+        """Get ID of the only draft invoice, or None."""
+        if len(invoices) == 0:
+            print('Error: No draft invoice found')
+            return None
+        if len(invoices) > 1:
+            print('Error: Multiple draft invoices found')
+            return None
+        return invoices[0]['Guid']
+
+    @staticmethod
+    def _print_error(action, status_code, reason, text):
+        print(f'Error: {action} failed: {status_code} {reason}')
+        print(text)
+
+
+class DineroAPI(_DineroBase):
+    """A connection object for accessing Dinero API."""
+
+    def __init__(self, client_id, client_secret, api_key, name=None,
+                 cache=None, session_hook=None):
         """
         Create a new instance.
 
@@ -43,14 +312,41 @@ class DineroAPI:
         :param client_secret: Dinero client secret.
         :param api_key: Dinero API key.
         :param name: Name of organization to work/on.
+        :param cache: FileCache instance for persistent caching.
+        :param session_hook: Function called with the requests session (and
+                             'dinero') before it is used.
         """
+        self.cache = cache
+        self._contact_index = None
+        self._contact_index_lock = threading.Lock()
+        self._contact_store_lock = threading.Lock()
+        self._cache_key = cache_key(client_id, api_key)
         client = LegacyApplicationClient(client_id=client_id)
-        oauth = OAuth2Session(client=client)
-        token = oauth.fetch_token(token_url=DINERO_TOKEN_URL,
-                                  username=api_key, password=api_key,
-                                  client_id=client_id,
-                                  client_secret=client_secret)
+        token = self._load_token()
+        oauth = OAuth2Session(client=client, token=token,
+                              auto_refresh_url=DINERO_TOKEN_URL,
+                              auto_refresh_kwargs={
+                                  'client_id': client_id,
+                                  'client_secret': client_secret},
+                              token_updater=self._store_token)
+        if session_hook is not None:
+            session_hook(oauth, 'dinero')
         self.session = oauth
+        if token is not None and self._token_expired(token):
+            try:
+                token = oauth.refresh_token(DINERO_TOKEN_URL,
+                                            client_id=client_id,
+                                            client_secret=client_secret)
+                self._store_token(token)
+            except Exception as e:
+                logging.info(f'Refreshing Dinero token failed: {e}')
+                token = None
+        if token is None:
+            token = oauth.fetch_token(token_url=DINERO_TOKEN_URL,
+                                      username=api_key, password=api_key,
+                                      client_id=client_id,
+                                      client_secret=client_secret)
+            self._store_token(token)
         self.token = token
         if not self.set_organization(name):
             raise Exception('Could not set organization')
@@ -61,20 +357,14 @@ class DineroAPI:
         :param name: Name of organization.
 
         """
+        organization = self._load_organization(name)
+        if organization is not None:
+            self.organization = organization
+            return self.organization
         url = f'{self.API_URL_V1}/organizations'
         params = {'fields': 'name,id'}
         orgs = self.session.get(url, params=params).json()
-        if name is None:
-            if len(orgs) == 1:
-                self.organization = orgs[0]['id']
-                return self.organization
-            else:
-                return None
-        for org in orgs:
-            if org['name'] == name:
-                self.organization = org['id']
-                return self.organization
-        return None
+        return self._select_organization(orgs, name)
 
     def get_contacts(self):
         """Get all contacts of current organization."""
@@ -86,42 +376,118 @@ class DineroAPI:
         url = f'{self.API_URL_V1}/{self.organization}/contacts/{contact}'
         return self.session.get(url)
 
-    def update_contact(self, contact, data):
+    def update_contact(self, contact, data, store=True):
         """
         Update contact information in current organization.
 
         :param contact: Contact id to change.
         :param data: Update contact data to upload.
+        :param store: Store the updated contact index in the cache.  When
+                      updating many contacts, pass False and call
+                      :meth:`store_contact_index` once afterwards.
+        :return: True on success, False otherwise.
         """
         url = f'{self.API_URL_V1}/{self.organization}/contacts/{contact}'
-        self.session.put(url, json=data)
+        resp = self.session.put(url, json=data)
+        if not resp.ok:
+            self._print_error('Updating contact', resp.status_code,
+                              resp.reason, resp.text)
+            return False
+        with self._contact_index_lock:
+            if not self._index_updated_contact(contact, data):
+                return True
+        if store:
+            self.store_contact_index()
+        return True
 
-    def _get_matching_contact(self, fields, match_fn):
-        url = f'{self.API_URL_V1}/{self.organization}/contacts'
-        params = {
-            'fields': fields,
-            'page': 0}
+    def _contact_index_cache_name(self):
+        return f'dinero-contacts-{self.organization}.json'
+
+    def store_contact_index(self):
+        """Store contact index in the cache, if both exist."""
+        if self.cache is None:
+            return
+        # Snapshot and write under a separate lock, so lookups are not
+        # blocked by the write, and an older snapshot never overwrites a
+        # newer one
+        with self._contact_store_lock:
+            with self._contact_index_lock:
+                if self._contact_index is None:
+                    return
+                contacts = list(self._contact_index.contacts.values())
+            self.cache.store(self._contact_index_cache_name(), contacts)
+
+    def contact_index(self, refresh=False):
+        """
+        Get index of all contacts in current organization.
+
+        The index is built from a single sweep through all contacts, and kept
+        in memory.  If a cache is available, it is also used to persist the
+        index between runs.
+
+        :param refresh: Rebuild index, ignoring any cached index.
+        :return: ContactIndex instance.
+        """
+        with self._contact_index_lock:
+            if self._contact_index is not None and not refresh:
+                return self._contact_index
+            if not refresh:
+                self._contact_index = self._load_contact_index()
+                if self._contact_index is not None:
+                    return self._contact_index
+            index = self._contact_index = ContactIndex(
+                self._iter_contacts(ContactIndex.FIELDS))
+        # Store the new index after releasing the lock, so lookups are not
+        # blocked by the write
+        self.store_contact_index()
+        return index
+
+    def _iter_collection(self, url, params):
+        """
+        Iterate over all items of a paginated collection.
+
+        Items are requested in pages of the maximum size.  The first page
+        tells how many items there are in total, so the remaining pages are
+        then fetched concurrently.
+
+        :param url: Collection URL.
+        :param params: Request parameters (such as fields and filters).
+        :return: Generator of items.
+        """
+        def fetch(page):
+            return self.session.get(url, params=dict(
+                params, page=page, pageSize=self.PAGE_SIZE)).json()
+
+        items = fetch(0)
+        yield from items['Collection']
+        pages = self._remaining_pages(items['Pagination'], params)
+        if pages is not None:
+            with ThreadPoolExecutor(max_workers=self.PAGE_JOBS) as executor:
+                for items in executor.map(fetch, range(1, pages + 1)):
+                    yield from items['Collection']
+            return
+        # Without a total, fetch one page at a time until a short page
+        page = 1
         while True:
-            contacts = self.session.get(url, params=params).json()
-            for contact in contacts['Collection']:
-                match = match_fn(contact)
-                if match:
-                    return match
-            results = contacts['Pagination']['Result']
-            pagesize = contacts['Pagination']['PageSize']
-            if results < pagesize:
+            items = fetch(page)
+            yield from items['Collection']
+            if self._last_page(items['Pagination']):
                 break
-            params['page'] += 1
-        return None
+            page += 1
+
+    def _iter_contacts(self, fields):
+        """
+        Iterate over all contacts of current organization.
+
+        :param fields: Contact fields to request.
+        :return: Generator of contact data.
+        """
+        url = f'{self.API_URL_V1}/{self.organization}/contacts'
+        return self._iter_collection(url, {'fields': fields})
 
     def contact_id(self, name):
         """Get contact ID of named contact."""
-        def name_match(c):
-            if c['name'] == name:
-                return c['contactGuid']
-            else:
-                return None
-        return self._get_matching_contact('name,contactGuid', name_match)
+        return self.contact_index().names.get(name)
 
     def contact_with_external_reference(self, key, value):
         """
@@ -134,20 +500,16 @@ class DineroAPI:
         :param key: Key to match.
         :param value: Value to match.
         """
-        def extref_match(c):
-            extref = c.get('ExternalReference')
-            if extref is None:
-                return None
-            try:
-                extref = json.loads(extref)
-            except Exception as e:
-                logging.warn(f'Bad ExternalReference value: {e}: {extref}')
-                return None
-            if extref.get(key) == value:
-                return c['contactGuid']
-            return None
-        return self._get_matching_contact(
-            'name,contactGuid,ExternalReference', extref_match)
+        return self.contact_index().external_references.get((key, value))
+
+    def contacts_with_external_reference(self, key):
+        """
+        Get all contacts with an ExternalReference key.
+
+        :param key: Key to look for in ExternalReference JSON objects.
+        :return: Dictionary mapping key values to contact IDs.
+        """
+        return self.contact_index().linked(key)
 
     def create_invoice(self, contact, product_lines=[],
                        language=None, currency=None, comment=None, date=None):
@@ -160,28 +522,33 @@ class DineroAPI:
         :param currency: Currency to use for the invoice.
         :param comment: Comment to add to invoice.
         :param date: Invoice date.
+        :return: ID of created invoice, or None on failure.
         """
         url = f'{self.API_URL_V1}/{self.organization}/invoices'
-        if language == 'da':
-            language = 'da-DK'
-        elif language == 'en':
-            language = 'en-GB'
-        body = {
-            'ContactGuid': contact,
-            'Currency': currency,
-            'Language': language,
-            'Comment': comment,
-            'Date': date,
-            'ProductLines': product_lines,
-        }
-        body = {k: v for (k, v) in body.items() if v is not None}
+        body = self._invoice_body(contact, product_lines, language, currency,
+                                  comment, date)
         resp = self.session.post(url, json=body)
         if not resp.ok:
-            print('Error: Creating invoice failed: ' +
-                  f'{resp.status_code} {resp.reason}')
-            print(resp.text)
+            self._print_error('Creating invoice', resp.status_code,
+                              resp.reason, resp.text)
+            return None
+        return resp.json().get('Guid')
 
-    def get_draft_invoice(self, contact):
+    def draft_invoices(self):
+        """
+        Get all draft invoices, indexed by contact.
+
+        A single sweep through the draft invoices replaces a filtered list
+        request per contact, when getting draft invoices of many contacts.
+
+        :return: Dictionary mapping contact ID to list of draft invoices
+                 (with Guid, ContactGuid, Date and Description fields).
+        """
+        url = f'{self.API_URL_V1}/{self.organization}/invoices'
+        return self._index_drafts(
+            self._iter_collection(url, self.DRAFTS_PARAMS))
+
+    def get_draft_invoice(self, contact, drafts=None):
         """
         Get existing draft invoice.
 
@@ -190,48 +557,54 @@ class DineroAPI:
         returns None.
 
         :param contact: Contact ID to get draft invoice for.
+        :param drafts: Draft invoices from :meth:`draft_invoices`.  If not
+                       given, the draft invoices of the contact are listed.
         :return: Invoice data or None.
 
         """
-        url = f'{self.API_URL_V1}/{self.organization}/invoices'
-        params = {'fields': "Guid,Date,Description",
-                  'statusFilter': 'Draft',
-                  'queryFilter': f"ContactGuid eq '{contact}'"}
-        resp = self.session.get(url, params=params)
-        if not resp.ok:
-            print('Error: Getting invoice list failed: ' +
-                  f'{resp.status_code} {resp.reason}')
-            print(resp.text)
-            return None
-        invoices = resp.json()['Collection']
-        if len(invoices) == 0:
-            print('Error: No draft invoice found')
-            return None
-        if len(invoices) > 1:
-            print('Error: Multiple draft invoices found')
+        if drafts is not None:
+            invoices = drafts.get(contact, [])
+        else:
+            url = f'{self.API_URL_V1}/{self.organization}/invoices'
+            resp = self.session.get(
+                url, params=self._contact_drafts_params(contact))
+            if not resp.ok:
+                self._print_error('Getting invoice list', resp.status_code,
+                                  resp.reason, resp.text)
+                return None
+            invoices = resp.json()['Collection']
+        guid = self._single_draft(invoices)
+        if guid is None:
             return None
-        guid = invoices[0]['Guid']
+        return self.get_invoice(guid)
+
+    def get_invoice(self, guid):
+        """
+        Get invoice.
+
+        :param guid: Invoice ID.
+        :return: Invoice data or None.
+        """
         url = f'{self.API_URL_V1}/{self.organization}/invoices/{guid}'
         resp = self.session.get(url, headers={'Accept': 'application/json'})
         if not resp.ok:
-            print('Error: Getting invoice failed: ' +
-                  f'{resp.status_code} {resp.reason}')
-            print(resp.text)
+            self._print_error('Getting invoice', resp.status_code,
+                              resp.reason, resp.text)
             return None
-        invoice = resp.json()
-        return invoice
+        return resp.json()
 
     def update_invoice(self, invoice):
         """
         Update existing draft invoice.
 
         :param guid: Invoice data.
+        :return: True on success, False otherwise.
         """
         guid = invoice['Guid']
         # API v1 does not support Text lines, so we need to use at least v1.2
         url = f'{self.API_URL_V1_2}/{self.organization}/invoices/{guid}'
         resp = self.session.put(url, json=invoice)
         if not resp.ok:
-            print('Error: Updating invoice failed: ' +
-                  f'{resp.status_code} {resp.reason}')
-            print(resp.text)
+            self._print_error('Updating invoice', resp.status_code,
+                              resp.reason, resp.text)
+        return resp.ok
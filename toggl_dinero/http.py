@@ -0,0 +1,85 @@
+"""This module contains HTTP session helpers shared by the API classes."""
+
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+#: HTTP status codes that are retried
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class JitterRetry(Retry):
+    """
+    Retry configuration with random jitter added to the backoff time.
+
+    Without jitter, concurrent requests that are throttled at the same time
+    are also retried at the same time, and are likely to be throttled again.
+    Retry-After headers are still honoured as is.
+
+    Retries are sent from within the transport adapter, so a rate limiter
+    wrapping the adapter only sees the first attempt.  Set rate_limit to a
+    :class:`~toggl_dinero.ratelimit.TokenBucket` to also wait for a token
+    before each retry.
+    """
+
+    def __init__(self, *args, rate_limit=None, **kwargs):
+        """
+        Create a new instance.
+
+        :param rate_limit: TokenBucket instance limiting retries.
+        """
+        super().__init__(*args, **kwargs)
+        self.rate_limit = rate_limit
+
+    def new(self, **kw):
+        """Get copy with updated parameters, keeping rate_limit."""
+        kw.setdefault('rate_limit', self.rate_limit)
+        return super().new(**kw)
+
+    def get_backoff_time(self):
+        """Get backoff time with jitter."""
+        backoff = super().get_backoff_time()
+        return random.uniform(backoff / 2, backoff)
+
+    def sleep(self, response=None):
+        """Sleep before retrying, and wait for the rate limit."""
+        super().sleep(response)
+        if self.rate_limit is not None:
+            self.rate_limit.acquire()
+
+
+def make_session(pool_size=10, retries=5, backoff_factor=0.5):
+    """
+    Create a session with connection pooling and automatic retries.
+
+    Failed requests (connection errors, and :data:`RETRY_STATUS` responses to
+    idempotent requests) are retried with exponential backoff.  When retries
+    are exhausted, the last response is returned as is.
+
+    :param pool_size: Maximum number of connections to keep open per host.
+    :param retries: Maximum number of retries per request.
+    :param backoff_factor: Backoff factor (in seconds).
+    :return: requests.Session instance.
+    """
+    retry = JitterRetry(total=retries, backoff_factor=backoff_factor,
+                        status_forcelist=RETRY_STATUS,
+                        respect_retry_after_header=True,
+                        raise_on_status=False)
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def wrap_adapters(session, wrapper):
+    """
+    Wrap all transport adapters mounted on a session.
+
+    :param session: requests.Session instance.
+    :param wrapper: Function returning a new adapter wrapping the given
+                    adapter.
+    """
+    for prefix, adapter in list(session.adapters.items()):
+        session.mount(prefix, wrapper(adapter))
@@ -0,0 +1,184 @@
+"""This module contains a local SQLite ledger of invoiced time."""
+
+from datetime import datetime
+import sqlite3
+import threading
+
+from .aggregate import MS_PER_HOUR
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    client TEXT NOT NULL,
+    since TEXT NOT NULL,
+    until TEXT NOT NULL,
+    project TEXT,
+    description TEXT,
+    user TEXT,
+    ms INTEGER NOT NULL,
+    rate REAL,
+    amount REAL,
+    currency TEXT,
+    recorded TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_client ON items (client);
+CREATE INDEX IF NOT EXISTS items_project ON items (project);
+CREATE INDEX IF NOT EXISTS items_period ON items (since, until);
+CREATE INDEX IF NOT EXISTS items_user ON items (user);
+CREATE TABLE IF NOT EXISTS invoice_lines (
+    client TEXT NOT NULL,
+    since TEXT NOT NULL,
+    until TEXT NOT NULL,
+    contact TEXT,
+    invoice TEXT,
+    position INTEGER NOT NULL,
+    line_type TEXT,
+    description TEXT,
+    quantity REAL,
+    unit TEXT,
+    rate REAL,
+    currency TEXT,
+    sent TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS invoice_lines_client ON invoice_lines (client);
+CREATE INDEX IF NOT EXISTS invoice_lines_period
+    ON invoice_lines (since, until);
+'''
+
+#: Columns that summaries can be grouped by
+GROUP_BY = {
+    'client': 'client',
+    'project': 'project',
+    'user': 'user',
+    'period': "since || ' - ' || until",
+}
+
+
+def _date(value):
+    """Format date as string, leaving strings (and None) as is."""
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime('%Y-%m-%d')
+
+
+class Ledger:
+    """
+    Record of report items fetched from Toggl and lines sent to Dinero.
+
+    Each client and period is recorded once.  Invoicing the same client and
+    period again replaces the recorded items (and lines, if sent again), so
+    the ledger always reflects the latest invoice run.
+
+    The ledger can be shared between threads.
+    """
+
+    def __init__(self, path):
+        """
+        Open ledger, creating it if it does not exist.
+
+        :param path: Path of SQLite database file (or ':memory:').
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        """Close ledger."""
+        self._db.close()
+
+    def record_items(self, client, since, until, items):
+        """
+        Record report items of client and period.
+
+        :param client: Toggl client name.
+        :param since: Start date of period.
+        :param until: End date of period.
+        :param items: Iterable of dictionaries with 'ms', 'rate', 'amount',
+                      'currency', 'project', 'description' and 'user' keys
+                      (see :class:`Aggregator` observer).
+        """
+        since, until = _date(since), _date(until)
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = [(client, since, until, i.get('project'), i.get('description'),
+                 i.get('user'), i['ms'], i.get('rate'), i.get('amount'),
+                 i.get('currency'), now) for i in items]
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM items WHERE client = ? AND '
+                             'since = ? AND until = ?', (client, since, until))
+            self._db.executemany('INSERT INTO items VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def record_invoice_lines(self, client, since, until, product_lines,
+                             contact=None, invoice=None, currency=None):
+        """
+        Record product lines sent to a Dinero invoice.
+
+        :param client: Toggl client name.
+        :param since: Start date of invoiced period.
+        :param until: End date of invoiced period.
+        :param product_lines: Product lines sent to the invoices API.
+        :param contact: Dinero contact ID.
+        :param invoice: Dinero invoice ID.
+        :param currency: Currency of invoice.
+        """
+        since, until = _date(since), _date(until)
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = [(client, since, until, contact, invoice, position,
+                 line.get('LineType', 'Product'), line.get('Description'),
+                 line.get('Quantity'), line.get('Unit'),
+                 line.get('BaseAmountValue'), currency, now)
+                for position, line in enumerate(product_lines)]
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM invoice_lines WHERE client = ? AND '
+                             'since = ? AND until = ?', (client, since, until))
+            self._db.executemany('INSERT INTO invoice_lines VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 rows)
+
+    def summary(self, by='client', client=None, since=None, until=None,
+                invoiced=False):
+        """
+        Summarize recorded hours and amounts.
+
+        :param by: Column to group by, one of the keys of GROUP_BY.  Only
+                   'client' and 'period' are supported for invoiced lines.
+        :param client: Only include this client.
+        :param since: Only include periods starting on or after this date.
+        :param until: Only include periods ending on or before this date.
+        :param invoiced: Summarize product lines sent to Dinero, instead of
+                         report items fetched from Toggl.
+        :return: List of (group, currency, hours, amount) tuples.
+        """
+        if by not in GROUP_BY:
+            raise ValueError(f'Unsupported grouping: {by}')
+        if invoiced:
+            if by not in ('client', 'period'):
+                raise ValueError(f'Unsupported grouping of invoice lines: '
+                                 f'{by}')
+            table = 'invoice_lines'
+            hours = 'quantity'
+            amount = 'quantity * rate'
+            conditions = ["line_type = 'Product'"]
+        else:
+            table = 'items'
+            hours = f'ms / {float(MS_PER_HOUR)}'
+            # Amounts of detailed report items are more exact than rates
+            amount = f'COALESCE(amount, {hours} * rate)'
+            conditions = []
+        params = []
+        for condition, value in [('client = ?', client),
+                                 ('since >= ?', _date(since)),
+                                 ('until <= ?', _date(until))]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        query = (f'SELECT {GROUP_BY[by]} AS grp, currency, SUM({hours}), '
+                 f'SUM({amount}) FROM {table} {where} '
+                 f'GROUP BY grp, currency ORDER BY grp, currency')
+        with self._lock:
+            return [(group, currency, round(hours or 0, 2),
+                     round(amount or 0, 2))
+                    for group, currency, hours, amount
+                    in self._db.execute(query, params)]
@@ -0,0 +1,233 @@
+"""This module contains collection and export of HTTP request metrics."""
+
+from collections import defaultdict
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+from requests.adapters import BaseAdapter
+from .http import wrap_adapters
+
+#: Upper bounds (in seconds) of request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_GUID = re.compile(r'^[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}$')
+
+
+def endpoint_template(url):
+    """
+    Get endpoint template of URL.
+
+    Numeric IDs and GUIDs in the URL path are replaced by placeholders, so
+    that requests for different objects are counted as the same endpoint.
+    Query parameters are dropped.
+
+    :param url: Request URL.
+    :return: Templated path, such as '/v1/{id}/invoices/{guid}'.
+    """
+    segments = []
+    for segment in urlsplit(url).path.split('/'):
+        if segment.isdigit():
+            segment = '{id}'
+        elif _GUID.match(segment):
+            segment = '{guid}'
+        segments.append(segment)
+    return '/'.join(segments)
+
+
+class _Endpoint:
+    """Metrics of a single endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.status = defaultdict(int)
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.bytes = 0
+
+    def observe(self, status, seconds, nbytes):
+        self.count += 1
+        self.status[status] += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.bytes += nbytes
+
+
+class Metrics:
+    """Thread safe collection of HTTP request metrics per endpoint."""
+
+    def __init__(self):
+        """Create a new instance."""
+        self._endpoints = defaultdict(_Endpoint)
+        self._waits = defaultdict(lambda: [0, 0.0, 0.0])
+        self._lock = threading.Lock()
+
+    def install(self, session, api):
+        """
+        Install metrics collection on a requests session.
+
+        :param session: requests.Session instance.
+        :param api: Name of API the session is used for ('toggl' or
+                    'dinero').
+        """
+        wrap_adapters(session,
+                      lambda adapter: MetricsAdapter(self, adapter, api))
+
+    def observe(self, api, method, url, status, seconds, nbytes):
+        """
+        Record a request.
+
+        :param api: Name of API.
+        :param method: HTTP method.
+        :param url: Request URL.
+        :param status: HTTP status code, or 'error' if no response was
+                       received.
+        :param seconds: Time from sending request until response body was
+                        received.
+        :param nbytes: Size of response body.
+        """
+        key = (api, method, endpoint_template(url))
+        with self._lock:
+            self._endpoints[key].observe(str(status), seconds, nbytes)
+
+    def observe_wait(self, api, seconds):
+        """
+        Record time a request was queued by a rate limiter.
+
+        :param api: Name of API.
+        :param seconds: Time waited.
+        """
+        with self._lock:
+            wait = self._waits[api]
+            wait[0] += 1
+            wait[1] += seconds
+            wait[2] = max(wait[2], seconds)
+
+    def to_dict(self):
+        """Get metrics as JSON serializable data."""
+        with self._lock:
+            endpoints = []
+            for (api, method, endpoint), m in sorted(self._endpoints.items()):
+                endpoints.append({
+                    'api': api,
+                    'method': method,
+                    'endpoint': endpoint,
+                    'count': m.count,
+                    'status': dict(sorted(m.status.items())),
+                    'seconds': round(m.seconds, 6),
+                    'latency_buckets': {
+                        str(bound): n
+                        for bound, n in zip(LATENCY_BUCKETS, m.buckets)},
+                    'bytes': m.bytes,
+                })
+            waits = [{'api': api, 'count': count,
+                      'seconds': round(seconds, 6),
+                      'max_seconds': round(max_seconds, 6)}
+                     for api, (count, seconds, max_seconds)
+                     in sorted(self._waits.items())]
+            return {'endpoints': endpoints, 'rate_limit_waits': waits}
+
+    def to_prometheus(self):
+        """Get metrics in Prometheus text exposition format."""
+        prefix = 'toggl_dinero_http'
+        requests = [
+            f'# HELP {prefix}_requests_total HTTP requests sent.',
+            f'# TYPE {prefix}_requests_total counter']
+        latency = [
+            f'# HELP {prefix}_request_duration_seconds HTTP request latency.',
+            f'# TYPE {prefix}_request_duration_seconds histogram']
+        nbytes = [
+            f'# HELP {prefix}_response_bytes_total HTTP response body bytes.',
+            f'# TYPE {prefix}_response_bytes_total counter']
+        waits = [
+            '# HELP toggl_dinero_rate_limit_wait_seconds Time requests were '
+            'queued by rate limiter.',
+            '# TYPE toggl_dinero_rate_limit_wait_seconds summary']
+        with self._lock:
+            for (api, method, endpoint), m in sorted(self._endpoints.items()):
+                labels = (f'api="{api}",method="{method}",'
+                          f'endpoint="{endpoint}"')
+                for status, n in sorted(m.status.items()):
+                    requests.append(f'{prefix}_requests_total'
+                                    f'{{{labels},status="{status}"}} {n}')
+                for bound, n in zip(LATENCY_BUCKETS, m.buckets):
+                    latency.append(f'{prefix}_request_duration_seconds_bucket'
+                                   f'{{{labels},le="{bound}"}} {n}')
+                latency.append(f'{prefix}_request_duration_seconds_bucket'
+                               f'{{{labels},le="+Inf"}} {m.count}')
+                latency.append(f'{prefix}_request_duration_seconds_sum'
+                               f'{{{labels}}} {m.seconds:.6f}')
+                latency.append(f'{prefix}_request_duration_seconds_count'
+                               f'{{{labels}}} {m.count}')
+                nbytes.append(f'{prefix}_response_bytes_total'
+                              f'{{{labels}}} {m.bytes}')
+            for api, (count, seconds, _) in sorted(self._waits.items()):
+                waits.append('toggl_dinero_rate_limit_wait_seconds_sum'
+                             f'{{api="{api}"}} {seconds:.6f}')
+                waits.append('toggl_dinero_rate_limit_wait_seconds_count'
+                             f'{{api="{api}"}} {count}')
+        return '\n'.join(requests + latency + nbytes + waits) + '\n'
+
+    def write(self, path, format='json'):
+        """
+        Write metrics to file.
+
+        The file is replaced atomically, as required by the node exporter
+        textfile collector.
+
+        :param path: Path of file to write.
+        :param format: Either 'json' or 'prometheus'.
+        """
+        if format == 'prometheus':
+            data = self.to_prometheus()
+        else:
+            data = json.dumps(self.to_dict(), indent=2) + '\n'
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class MetricsAdapter(BaseAdapter):
+    """Transport adapter recording metrics of all requests."""
+
+    def __init__(self, metrics, adapter, api=None):
+        """
+        Create a new instance.
+
+        :param metrics: Metrics instance.
+        :param adapter: Transport adapter to wrap.
+        :param api: Name of API the adapter is used for.
+        """
+        super().__init__()
+        self.metrics = metrics
+        self.adapter = adapter
+        self.api = api
+
+    def send(self, request, stream=False, **kwargs):
+        """Send request, recording its metrics."""
+        start = time.perf_counter()
+        try:
+            response = self.adapter.send(request, stream=stream, **kwargs)
+            if stream:
+                # Don't consume streamed bodies, use Content-Length instead
+                nbytes = int(response.headers.get('Content-Length') or 0)
+            else:
+                # The session reads the body right after anyway
+                nbytes = len(response.content)
+        except Exception:
+            self.metrics.observe(self.api, request.method, request.url,
+                                 'error', time.perf_counter() - start, 0)
+            raise
+        self.metrics.observe(self.api, request.method, request.url,
+                             response.status_code,
+                             time.perf_counter() - start, nbytes)
+        return response
+
+    def close(self):
+        """Close wrapped adapter."""
+        self.adapter.close()
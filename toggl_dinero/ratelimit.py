@@ -0,0 +1,122 @@
+"""This module contains rate limiting of HTTP requests."""
+
+import asyncio
+import logging
+import threading
+import time
+from requests.adapters import BaseAdapter
+from .http import JitterRetry, wrap_adapters
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter.
+
+    Requests are scheduled in the order they reserve a token, so a request
+    never waits longer than needed to stay within the rate, no matter how
+    many threads (or asyncio tasks) are sharing the bucket.
+    """
+
+    def __init__(self, rate, burst=1, metrics=None, api=None):
+        """
+        Create a new instance.
+
+        :param rate: Number of requests allowed per second.
+        :param burst: Number of requests allowed back-to-back after being
+                      idle.
+        :param metrics: Metrics instance to report wait times to.
+        :param api: Name of API (for metrics).
+        """
+        if rate <= 0:
+            raise ValueError(f'Invalid rate: {rate}')
+        self.rate = rate
+        self.burst = burst
+        self.metrics = metrics
+        self.api = api
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Reserve a token.
+
+        :return: Time (in seconds) to wait before the token can be used.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Tokens go negative while requests are queued
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+        if self.metrics is not None:
+            self.metrics.observe_wait(self.api, wait)
+        if wait:
+            logging.debug(f'Rate limiting {self.api} request: {wait:.3f} s')
+        return wait
+
+    def acquire(self):
+        """
+        Wait until a request can be sent.
+
+        :return: Time waited (in seconds).
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """
+        Wait until a request can be sent, without blocking the event loop.
+
+        :return: Time waited (in seconds).
+        """
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def install(self, session):
+        """
+        Install rate limiting of all requests sent through a requests session.
+
+        Retries sent by the retry configuration of the transport adapters
+        (see :class:`~toggl_dinero.http.JitterRetry`) are rate limited too.
+
+        :param session: requests.Session instance.
+        """
+        for adapter in session.adapters.values():
+            # Find transport adapter below wrapping adapters
+            while hasattr(adapter, 'adapter'):
+                adapter = adapter.adapter
+            retries = getattr(adapter, 'max_retries', None)
+            if isinstance(retries, JitterRetry):
+                adapter.max_retries = retries.new(rate_limit=self)
+        wrap_adapters(session, lambda adapter: RateLimitAdapter(self, adapter))
+
+
+class RateLimitAdapter(BaseAdapter):
+    """Transport adapter delaying requests as needed by a TokenBucket."""
+
+    def __init__(self, bucket, adapter):
+        """
+        Create a new instance.
+
+        :param bucket: TokenBucket instance.
+        :param adapter: Transport adapter to wrap.
+        """
+        super().__init__()
+        self.bucket = bucket
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        """Send request when allowed by the token bucket."""
+        self.bucket.acquire()
+        return self.adapter.send(request, **kwargs)
+
+    def close(self):
+        """Close wrapped adapter."""
+        self.adapter.close()
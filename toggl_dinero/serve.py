@@ -0,0 +1,172 @@
+"""This module contains a long-running service refreshing draft invoices."""
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import threading
+from urllib.parse import unquote
+from .cli import invoice_client, invoice_clients, linked_clients
+
+
+class InvoiceService:
+    """
+    Refresh draft invoices of linked clients, on a schedule and on demand.
+
+    The Toggl and Dinero connections (including the Dinero OAuth2 token) and
+    the client and contact indexes are kept between refreshes.  Indexes are
+    rebuilt on every scheduled refresh, so that clients and contacts linked
+    in the meantime are picked up.
+    """
+
+    def __init__(self, toggl, dinero, workspace_ids, period='this-month',
+                 jobs=4, **kwargs):
+        """
+        Create a new instance.
+
+        :param toggl: TogglAPI instance.
+        :param dinero: DineroAPI instance.
+        :param workspace_ids: List of Toggl workspace IDs.
+        :param period: Period to invoice (see :func:`invoice_client`).
+        :param jobs: Number of clients to refresh in parallel.
+        :param kwargs: Additional arguments for :func:`invoice_client`.
+        """
+        self.toggl = toggl
+        self.dinero = dinero
+        self.workspace_ids = workspace_ids
+        self.period = period
+        self.jobs = jobs
+        self.kwargs = kwargs
+        self.last_refresh = None
+        self.results = {}
+        # Refreshes are serialized, so that a draft invoice is never updated
+        # by two refreshes at the same time
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def refresh_all(self, refresh_indexes=False):
+        """
+        Refresh draft invoices of all linked clients.
+
+        :param refresh_indexes: Rebuild client and contact indexes first.
+        :return: Dictionary mapping client name to success (bool).
+        """
+        with self._lock:
+            if refresh_indexes:
+                self.toggl.invalidate()
+                self.dinero.contact_index(refresh=True)
+            clients = linked_clients(self.toggl, self.dinero,
+                                     self.workspace_ids)
+            results = invoice_clients(self.toggl, self.dinero, clients,
+                                      self.period, jobs=self.jobs,
+                                      update=True, **self.kwargs)
+            self.results = {name: ok for name, (ok, _) in results.items()}
+            self.last_refresh = datetime.now()
+            failed = sum(1 for ok in self.results.values() if not ok)
+            logging.info(f'Refreshed {len(results)} draft invoices, '
+                         f'{failed} failed')
+            return self.results
+
+    def refresh_client(self, name):
+        """
+        Refresh draft invoice of a single client.
+
+        :param name: Toggl client name.
+        :return: Success (bool), or None if client is unknown.
+        """
+        with self._lock:
+            client_ids = self.toggl.client_ids(name, self.workspace_ids)
+            if not client_ids:
+                return None
+            ok = bool(invoice_client(self.toggl, self.dinero, name,
+                                     client_ids, self.period, update=True,
+                                     **self.kwargs))
+            self.results[name] = ok
+            return ok
+
+    def run_schedule(self, interval):
+        """
+        Refresh all draft invoices now, and then every interval seconds.
+
+        Runs until :meth:`stop` is called.
+
+        :param interval: Time between refreshes in seconds.
+        """
+        refresh_indexes = False
+        while not self._stop.is_set():
+            try:
+                self.refresh_all(refresh_indexes=refresh_indexes)
+            except Exception:
+                logging.exception('Scheduled refresh failed')
+            refresh_indexes = True
+            self._stop.wait(interval)
+
+    def stop(self):
+        """Stop scheduled refreshes."""
+        self._stop.set()
+
+    def status(self):
+        """Get status of last refreshes as JSON serializable data."""
+        last_refresh = self.last_refresh
+        return {
+            'last_refresh': last_refresh.isoformat() if last_refresh else None,
+            'results': dict(self.results),
+        }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of InvoiceService.
+
+    * ``GET /status`` - Status of last refreshes.
+    * ``POST /refresh`` - Refresh draft invoices of all linked clients.
+    * ``POST /refresh/<client>`` - Refresh draft invoice of a single client.
+    """
+
+    service = None
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Handle GET request."""
+        if self.path == '/status':
+            self._reply(200, self.service.status())
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        """Handle POST request."""
+        if self.path == '/refresh':
+            self._reply(200, {'results': self.service.refresh_all()})
+        elif self.path.startswith('/refresh/'):
+            name = unquote(self.path[len('/refresh/'):])
+            ok = self.service.refresh_client(name)
+            if ok is None:
+                self._reply(404, {'error': f'Unknown client: {name}'})
+            else:
+                self._reply(200, {'client': name, 'ok': ok})
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        """Log requests with logging instead of to stderr."""
+        logging.info(f'{self.address_string()} {format % args}')
+
+
+def make_server(service, host='127.0.0.1', port=8080):
+    """
+    Create HTTP server for InvoiceService.
+
+    :param service: InvoiceService instance.
+    :param host: Address to listen on.
+    :param port: Port to listen on (0 for any free port).
+    :return: ThreadingHTTPServer instance.
+    """
+    handler = type('Handler', (RequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
@@ -1,48 +1,320 @@
 """This module contains a class for providing access to Toggl API."""
 
 from togglwrapper import Toggl
-import requests
+from togglwrapper.decorators import error_checking, return_json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+import json
 import logging
+import os
+import threading
+import time
+from .cache import cache_key
+from .http import make_session
 
+TOGGL_REPORTS_URL = 'https://api.track.toggl.com/reports/api'
 
-class TogglAPI:
+
+class _Toggl(Toggl):
+    """Toggl API wrapper sending all requests through a shared session."""
+
+    def __init__(self, api_token, session, **kwargs):
+        super().__init__(api_token, **kwargs)
+        self.session = session
+
+    @return_json
+    @error_checking
+    def get(self, uri, params=None):
+        return self.session.get(f'{self.api_url}{uri}',
+                                params=params, auth=self.auth)
+
+    @return_json
+    @error_checking
+    def post(self, uri, data=None):
+        payload = json.dumps(data) if data is not None else None
+        return self.session.post(f'{self.api_url}{uri}',
+                                 data=payload, auth=self.auth)
+
+    @return_json
+    @error_checking
+    def put(self, uri, data):
+        return self.session.put(f'{self.api_url}{uri}',
+                                data=json.dumps(data), auth=self.auth)
+
+    @error_checking
+    def delete(self, uri):
+        return self.session.delete(f'{self.api_url}{uri}', auth=self.auth)
+
+
+class _Index:
+    """Index of Toggl objects (clients, workspaces, users) by a name field."""
+
+    def __init__(self, items, field):
+        self.items = items
+        self.exact = {}
+        self.folded = {}
+        for item in items:
+            name = item[field]
+            self.exact.setdefault(name, item['id'])
+            # Ambiguous case-insensitive matches are marked with None
+            folded = name.casefold()
+            if self.folded.get(folded, item['id']) != item['id']:
+                self.folded[folded] = None
+            else:
+                self.folded[folded] = item['id']
+
+    def lookup(self, name):
+        """Look up ID by name, falling back to case-insensitive match."""
+        if name in self.exact:
+            return self.exact[name]
+        return self.folded.get(name.casefold())
+
+
+@contextmanager
+def _atomic_write(path):
+    """
+    Open file for writing, replacing path when the file is complete.
+
+    The file is written to a temporary file, and renamed when done, so that
+    a partially written file is never left behind.
+    """
+    tmp = f'{path}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class _TogglBase:
+    """
+    Toggl API logic shared by :class:`TogglAPI` and its asyncio
+    counterpart, leaving only the sending of requests to the subclasses.
+    """
+
+    INDEX_TTL = 24 * 60 * 60  #: time to live of cached clients, users, etc.
+    REPORT_TTL_CLOSED = 30 * 24 * 60 * 60  #: ... of reports for past periods
+    REPORT_TTL_OPEN = 5 * 60  #: ... of reports for periods not yet ended
+    PDF_CHUNK_SIZE = 64 * 1024  #: bytes to write at a time when streaming
+
+    def _load_index(self, name):
+        """Get cached list of Toggl objects, or None if not cached."""
+        if self.cache is None:
+            return None
+        return self.cache.load(self._index_cache_name(name),
+                               ttl=self.INDEX_TTL)
+
+    def _store_index(self, name, items, field):
+        """Index list of Toggl objects, and store it in the cache."""
+        items = items or []
+        if self.cache is not None:
+            self.cache.store(self._index_cache_name(name), items)
+        self._indexes[name] = _Index(items, field)
+        return self._indexes[name]
+
+    @staticmethod
+    def _lookup_workspace(index, name):
+        """Get workspace ID from index (see :meth:`TogglAPI.workspace_id`)."""
+        if name is None:
+            if len(index.items) != 1:
+                logging.warning('Unable to determine workspace ID, '
+                                'Please specify workspace name')
+                return None
+            return index.items[0]['id']
+        workspace_id = index.lookup(name)
+        if workspace_id is None:
+            logging.warning(f'Unknown workspace: {name}')
+        return workspace_id
+
+    def _load_summary_report(self, params):
+        """
+        Get cached summary report.
+
+        :return: Tuple of cache entry name (None without a cache), and the
+                 cached report (None if not cached).
+        """
+        if self.cache is None:
+            return None, None
+        name = self._report_cache_name('summary', params) + '.json'
+        return name, self.cache.load(name, ttl=self._report_ttl(params))
+
+    def _load_summary_report_pdf(self, params, path=None):
+        """
+        Get cached summary report PDF.
+
+        :param path: Path to copy cached PDF file to.
+        :return: Tuple of cache entry name (None without a cache), and the
+                 cached PDF as bytes, or path if given (None if not cached).
+        """
+        if self.cache is None:
+            return None, None
+        name = self._report_cache_name('summary', params) + '.pdf'
+        ttl = self._report_ttl(params)
+        if path is None:
+            return name, self.cache.load_bytes(name, ttl=ttl)
+        if self.cache.load_file(name, path, ttl=ttl):
+            return name, path
+        return name, None
+
+    @staticmethod
+    def _next_page(report, page):
+        """Get number of next detailed report page, or None if last."""
+        if report['data'] and page * report['per_page'] < \
+                report['total_count']:
+            return page + 1
+        return None
+
+
+class TogglAPI(_TogglBase):
     """A connection object for accessing Toggl API."""
 
-    def __init__(self, api_token):
-        """Create a new instance."""
-        self.api = Toggl(api_token)
-        self.reports_api = Toggl(api_token,
-                                 base_url='https://api.track.toggl.com/reports/api',
-                                 version='v2')
+    SYNC_FULL_INTERVAL = 24 * 60 * 60  #: time between full syncs of reports
+    SYNC_CHUNK = 100  #: max number of time entries to fetch per sync request
+
+    def __init__(self, api_token, pool_size=10, retries=5, cache=None,
+                 session_hook=None):
+        """
+        Create a new instance.
+
+        All requests are sent through a single session, keeping connections
+        alive, and retrying throttled (HTTP 429) and failed requests.
+
+        :param api_token: Toggl API token.
+        :param pool_size: Maximum number of connections to keep open per host.
+        :param retries: Maximum number of retries per request.
+        :param cache: FileCache instance for persistent caching.
+        :param session_hook: Function called with the requests session (and
+                             'toggl') before it is used.
+        """
+        self.cache = cache
+        self._cache_key = cache_key(api_token)
+        self._indexes = {}
+        self._index_locks = {}
+        self._lock = threading.Lock()
+        self.session = make_session(pool_size=pool_size, retries=retries)
+        if session_hook is not None:
+            session_hook(self.session, 'toggl')
+        self.api = _Toggl(api_token, self.session)
+        self.reports_api = _Toggl(api_token, self.session,
+                                  base_url=TOGGL_REPORTS_URL, version='v2')
+
+    def _index_cache_name(self, name):
+        return f'toggl-{name}-{self._cache_key}.json'
+
+    def _index(self, name, field, fetch):
+        """
+        Get index of Toggl objects.
+
+        The list of objects is fetched once, and kept in memory.  If a cache
+        is available, it is also used to persist the list between runs.
+
+        :param name: Name of the list.
+        :param field: Name of field to index by.
+        :param fetch: Function for fetching the list from Toggl.
+        :return: _Index instance.
+        """
+        with self._lock:
+            lock = self._index_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name in self._indexes:
+                return self._indexes[name]
+            items = self._load_index(name)
+            if items is not None:
+                self._indexes[name] = _Index(items, field)
+                return self._indexes[name]
+            return self._store_index(name, fetch(), field)
+
+    def invalidate(self):
+        """Forget all fetched clients, workspaces and users."""
+        with self._lock:
+            names = {'clients', 'workspaces'} | set(self._indexes)
+            self._indexes = {}
+        if self.cache is not None:
+            for name in names:
+                self.cache.invalidate(self._index_cache_name(name))
+
+    def clients(self):
+        """Get all clients."""
+        return self._index('clients', 'name', self.api.Clients.get).items
 
     def client_id(self, name):
         """Resolve client ID from name."""
-        for client in self.api.Clients.get():
-            if client['name'] == name:
-                return client['id']
-        return None
+        return self._index('clients', 'name', self.api.Clients.get
+                           ).lookup(name)
+
+    def client_ids(self, name, workspace_ids):
+        """
+        Resolve IDs of clients with the same name in a number of workspaces.
+
+        :param name: Client name.
+        :param workspace_ids: List of workspace IDs.
+        :return: Dictionary mapping workspace ID to client ID, for the
+                 workspaces where the client exists.
+        """
+        clients = [c for c in self.clients() if c.get('wid') in workspace_ids]
+        matches = [c for c in clients if c['name'] == name]
+        if not matches:
+            matches = [c for c in clients
+                       if c['name'].casefold() == name.casefold()]
+        ids = {}
+        for client in matches:
+            ids.setdefault(client['wid'], client['id'])
+        return ids
 
     def user_id(self, workspace_id, email):
         """Resolve user ID from email."""
-        for user in self.api.Workspaces.get_users(workspace_id):
-            if user['email'] == email:
-                return user['id']
-        return None
+        return self._index(
+            f'users-{workspace_id}', 'email',
+            lambda: self.api.Workspaces.get_users(workspace_id)).lookup(email)
 
     def workspace_id(self, name=None):
         """Get workspace ID."""
-        workspaces = self.api.Workspaces.get()
-        if name is None:
-            if len(workspaces) != 1:
-                logging.warning('Unable to determine workspace ID, '
-                                'Please specify workspace name')
-                return None
-            return workspaces[0]['id']
-        for workspace in workspaces:
-            if workspace['name'] == name:
-                return workspace['id']
-        logging.warning(f'Unknown workspace: {name}')
-        return None
+        index = self._index('workspaces', 'name', self.api.Workspaces.get)
+        return self._lookup_workspace(index, name)
+
+    def workspace_ids(self, names=()):
+        """
+        Get IDs of a number of workspaces.
+
+        :param names: Workspace names.  If 'all' is included, all workspaces
+                      are returned.  If empty, the only workspace is returned
+                      (see :meth:`workspace_id`).
+        :return: List of workspace IDs, or None if any workspace is unknown.
+        """
+        if 'all' in names:
+            index = self._index('workspaces', 'name', self.api.Workspaces.get)
+            return [w['id'] for w in index.items]
+        if not names:
+            names = [None]
+        ids = [self.workspace_id(name) for name in names]
+        if None in ids:
+            return None
+        return list(dict.fromkeys(ids))
+
+    def _report_cache_name(self, kind, params):
+        """Get cache entry name for report with given request parameters."""
+        params = {k: str(v) for k, v in params.items() if k != 'user_agent'}
+        return f'toggl-{kind}-{cache_key(self._cache_key, params)}'
+
+    def _report_ttl(self, params):
+        """
+        Get time to live for cached report.
+
+        Time entries in past periods rarely change, so reports for these can
+        be cached for a long time, while reports for periods that are not yet
+        ended (such as this-month) are only cached for a short while.
+        """
+        try:
+            until = datetime.strptime(params['until'], '%Y-%m-%d').date()
+        except (KeyError, ValueError):
+            return self.REPORT_TTL_OPEN
+        if until < date.today():
+            return self.REPORT_TTL_CLOSED
+        return self.REPORT_TTL_OPEN
 
     def summary_report(self, params):
         """
@@ -52,19 +324,138 @@ class TogglAPI:
         :return: Summary report data as dictionary
         """
         params.setdefault('user_agent', 'toggl-dinero')
-        return self.reports_api.get('/summary', params=params)
+        name, report = self._load_summary_report(params)
+        if report is None:
+            report = self.reports_api.get('/summary', params=params)
+            if name is not None:
+                self.cache.store(name, report)
+        return report
+
+    def detailed_report(self, params):
+        """
+        Fetch detailed report, one page at a time.
+
+        The next page is fetched in the background while the time entries
+        of the current page are consumed.
+
+        :param params: Request parameters for the detailed report API.
+        :return: Generator of time entries.
+        """
+        params = dict(params)
+        params.setdefault('user_agent', 'toggl-dinero')
+
+        def fetch(page):
+            return self.reports_api.get('/details',
+                                        params=dict(params, page=page))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = 1
+            next_page = executor.submit(fetch, page)
+            while next_page is not None:
+                report = next_page.result()
+                next_page = None
+                page = self._next_page(report, page)
+                if page is not None:
+                    next_page = executor.submit(fetch, page)
+                yield from report['data']
+
+    def updated_time_entries(self, since):
+        """
+        Get time entries changed since a point in time.
+
+        Only time entries of the user owning the API token are included.
+
+        :param since: Unix timestamp.
+        :return: Tuple of list of changed time entries (deleted time entries
+                 have a 'server_deleted_at' field), and the timestamp to use
+                 for the next call.
+        """
+        resp = self.api.get('/me', params={'with_related_data': 'true',
+                                           'since': since})
+        return resp['data'].get('time_entries') or [], resp['since']
+
+    def synced_detailed_report(self, params):
+        """
+        Get detailed report, synced incrementally with local state.
+
+        The first time, the full detailed report is fetched and stored in the
+        cache.  After that, only time entries changed since the last sync
+        (see :meth:`updated_time_entries`) are fetched from the detailed
+        report and merged into the stored time entries.
+
+        Changes are only seen for time entries of the user owning the API
+        token, so a full sync is done every SYNC_FULL_INTERVAL seconds to pick
+        up changes made by other users.
+
+        :param params: Request parameters for the detailed report API.
+        :return: List of time entries, ordered by start time.
+        """
+        if self.cache is None:
+            raise ValueError('Incremental sync requires a cache')
+        params = dict(params)
+        params.setdefault('user_agent', 'toggl-dinero')
+        name = self._report_cache_name('sync', params) + '.json'
+        state = self.cache.load(name)
+        if state is None or \
+                time.time() - state['synced'] > self.SYNC_FULL_INTERVAL:
+            # Get watermark before fetching, so no changes are missed
+            _, since = self.updated_time_entries(int(time.time()))
+            entries = {e['id']: e for e in self.detailed_report(params)}
+            state = {'synced': time.time()}
+        else:
+            changed, since = self.updated_time_entries(state['since'])
+            entries = {e['id']: e for e in state['entries']}
+            workspace_id = int(params['workspace_id'])
+            ids = []
+            for entry in changed:
+                if entry.get('wid') != workspace_id:
+                    continue
+                # Changed entries are removed, and added back if they still
+                # match the report parameters
+                entries.pop(entry['id'], None)
+                if not entry.get('server_deleted_at'):
+                    ids.append(entry['id'])
+            for i in range(0, len(ids), self.SYNC_CHUNK):
+                chunk = ids[i:i + self.SYNC_CHUNK]
+                for entry in self.detailed_report(dict(
+                        params, time_entry_ids=','.join(map(str, chunk)))):
+                    entries[entry['id']] = entry
+            logging.info(f'Synced {len(ids)} changed time entries')
+        state['since'] = since
+        state['entries'] = sorted(
+            entries.values(), key=lambda e: (e.get('start') or '', e['id']))
+        self.cache.store(name, state)
+        return state['entries']
 
-    def summary_report_pdf(self, params):
+    def summary_report_pdf(self, params, path=None):
         """
         Fetch summary report (PDF file).
 
+        When a path is given, the PDF is streamed to disk in chunks instead of
+        being held in memory.
+
         :param params: Request parameters for the summary report API.
-        :return: Summary report PDF as bytes
+        :param path: Path to write PDF file to.
+        :return: Summary report PDF as bytes, or path if given.
         """
         params.setdefault('user_agent', 'toggl-dinero')
+        name, report = self._load_summary_report_pdf(params, path)
+        if report is not None:
+            return report
         # togglwrapper wraps get() with a return_json fixture, so we need
-        # use requests directly
-        report = requests.get(f'{self.reports_api.api_url}/summary.pdf',
-                              params=params, auth=self.reports_api.auth)
-        report.raise_for_status()
-        return report.content
+        # use the session directly
+        report = self.session.get(f'{self.reports_api.api_url}/summary.pdf',
+                                  params=params, auth=self.reports_api.auth,
+                                  stream=path is not None)
+        with report:
+            report.raise_for_status()
+            if path is None:
+                if name is not None:
+                    self.cache.store_bytes(name, report.content)
+                return report.content
+            with _atomic_write(path) as f:
+                for chunk in report.iter_content(self.PDF_CHUNK_SIZE):
+                    f.write(chunk)
+        if name is not None:
+            self.cache.store_file(name, path)
+        return path